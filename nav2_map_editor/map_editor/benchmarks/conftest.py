@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+'''
+Benchmarks of image helpers on synthetic maps, run from the directory of setup.py:
+    python -m pytest benchmarks [--map-sizes 1024,4096] [--update-thresholds]
+- every helper is timed by pytest-benchmark, then called once more under tracemalloc for its peak memory,
+  NumPy and OpenCV arrays are traced, buffers allocated by Qt itself are not
+- maps are square, 1k^2 up to 16k^2, sizes which do not fit into available memory are skipped
+- thresholds.json holds limits of mean time (s), peak memory (bytes) or 90th percentile of latency (s)
+  of replayed input per benchmark, exceeding a limit fails it, --update-thresholds rewrites them from this run
+'''
+
+# External lib
+import numpy as np
+import pytest
+
+# Python
+import json
+import os
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# PyQT
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+# Constants
+map_sizes = (1024, 2048, 4096, 8192, 16384)
+thresholds_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+time_margin = 1.5  # timing differs between runs much more than memory
+memory_margin = 1.1
+time_floor = 1e-4  # limits of microsecond helpers are not left to the noise of the timer
+memory_floor = 1 << 16
+latency_margin = 2  # single events are timed, not averaged
+latency_floor = 1e-3
+margins = {'time': (time_margin, time_floor), 'peak_memory': (memory_margin, memory_floor),
+           'latency': (latency_margin, latency_floor)}
+synthetic_cell = 16  # pixels of one cell of synthetic map
+synthetic_values = (254, 254, 254, 205, 0)  # free, unknown and occupied, in map_server trinary mode
+
+
+def pytest_addoption(parser):
+    parser.addoption('--map-sizes', default=','.join(map(str, map_sizes)),
+                     help="comma separated sizes of synthetic maps, in pixels")
+    parser.addoption('--update-thresholds', action='store_true',
+                     help="write limits measured by this run into thresholds.json")
+
+
+def pytest_generate_tests(metafunc):
+    if 'map_size' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('--map-sizes').split(',')]
+        metafunc.parametrize('map_size', sizes)
+
+
+def pytest_configure(config):
+    config.measured_thresholds = {}
+    config.peak_memory = {}  # benchmark name -> bytes
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if config.peak_memory:
+        terminalreporter.section('peak memory')
+        for name, peak in sorted(config.peak_memory.items(), key=lambda item: item[1]):
+            terminalreporter.write_line('%-40s %12.1f MB' % (name, peak / 2 ** 20))
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    if config.getoption('--update-thresholds') and config.measured_thresholds:
+        thresholds = load_thresholds()
+        thresholds.update(config.measured_thresholds)
+        with open(thresholds_path, 'w') as file:
+            json.dump(dict(sorted(thresholds.items())), file, indent=4)
+            file.write('\n')
+
+
+def load_thresholds() -> dict:
+    try:
+        with open(thresholds_path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def check_thresholds(request, measured) -> None:
+    ''' measured {'time': s, 'peak_memory': bytes, 'latency': s} of the benchmark are checked against its limits,
+    or kept as its new limits with --update-thresholds '''
+    name = request.node.name
+    if request.config.getoption('--update-thresholds'):
+        limits = {}
+        for key, value in measured.items():
+            margin, floor = margins[key]
+            limit = max(value * margin, floor)
+            limits[key] = int(limit) if key == 'peak_memory' else float('%.3g' % limit)
+        request.config.measured_thresholds[name] = limits
+        return
+    limits = load_thresholds().get(name, {})
+    for key, value in measured.items():
+        if key in limits:
+            assert value <= limits[key], "%s %s is %.4g, limit is %.4g" % (name, key, value, limits[key])
+
+
+def available_memory() -> int:
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def require_memory(pixels, bytes_per_pixel) -> None:
+    ''' skips benchmark, which would need more than available memory, rather than let it swap or be killed '''
+    needed = pixels * bytes_per_pixel
+    if needed > available_memory():
+        pytest.skip("needs about %d MB of memory" % (needed >> 20))
+
+
+def synthetic_map(size) -> np.ndarray:
+    ''' (size, size, 4) BGRA array of MapRaster layout, cells of free, unknown and occupied, the same every run '''
+    random = np.random.default_rng(size)
+    cells = random.choice(np.array(synthetic_values, dtype=np.uint8),
+                          size=(-(-size // synthetic_cell), -(-size // synthetic_cell)))
+    gray = np.repeat(np.repeat(cells, synthetic_cell, axis=0), synthetic_cell, axis=1)[:size, :size]
+    array = np.empty((size, size, 4), dtype=np.uint8)
+    for channel in range(3):
+        array[..., channel] = gray
+    array[..., 3] = 255
+    return array
+
+
+def peak_memory(function, *args) -> int:
+    ''' bytes traced by tracemalloc at the peak of single call, over what was allocated before it '''
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        result = function(*args)
+        peak = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def measure(benchmark, request):
+    '''
+    measure(function, *args) times function by benchmark and records its peak memory,
+    then checks both against thresholds.json, returns result of the function
+    '''
+    def run(function, *args):
+        peak = peak_memory(function, *args)
+        benchmark.extra_info['peak_memory'] = peak
+        request.config.peak_memory[request.node.name] = peak
+        result = benchmark(function, *args)
+        if benchmark.stats is not None:  # else --benchmark-disable
+            check_thresholds(request, {'time': benchmark.stats.stats.mean, 'peak_memory': peak})
+        return result
+
+    return run
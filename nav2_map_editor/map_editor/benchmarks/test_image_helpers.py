@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+'''
+Hot paths of rotation, conversion between NumPy and Qt, and gray/lightness computation
+- raster_rotation, cached_rotation, bgra2gray and MapRaster.grayscale are what the editor runs,
+  the older QPixmap and float helpers are kept for comparison
+'''
+
+# External lib
+import numpy as np
+import pytest
+
+# PyQT
+from PyQt5.QtGui import QPixmap
+
+# Python
+from itertools import cycle
+
+# Source files
+from map_editor.Helpers import helpers
+from map_editor.Helpers.helpers import rotation, rotateAndScale, numpyQImage, qimage2array
+from map_editor.Helpers.helpers import raster_rotation, cached_rotation
+from map_editor.Helpers.colors_helpers import rgb2gray, bgra2gray, change_lightness, colors
+from map_editor.Helpers.raster import MapRaster
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import grayscale_chunk_pixels, rotation_cache_size
+
+from conftest import require_memory, synthetic_map
+
+angle = 30  # not multiple of 90, so the rotated map is larger and resampled
+
+# estimated bytes per pixel of the map, held at once: input, intermediate copies and result
+rotation_memory = 32  # QPixmap, its QImage, rotated array of ~1.9x area, rotated QPixmap
+rotate_and_scale_memory = 12
+view_memory = 8
+rgb2gray_memory = 48  # rgb array, float64 of 3 channels, float64 dot product and rounded result
+raster_rotation_memory = 12  # raster and rotated raster of ~1.9x area
+cached_rotation_memory = 4 + 8 * rotation_cache_size  # raster and full cache of rotated rasters
+bgra2gray_memory = 5  # raster and gray result, chunk buffers are bounded by grayscale_chunk_pixels
+
+
+def test_rotation(qapp, measure, map_size):
+    require_memory(map_size ** 2, rotation_memory)
+    raster = MapRaster(synthetic_map(map_size))
+    pixmap = QPixmap.fromImage(raster.image)
+    del raster
+    rotated = measure(rotation, pixmap, angle)
+    assert rotated.width() > map_size
+
+
+def test_raster_rotation(measure, map_size):
+    require_memory(map_size ** 2, raster_rotation_memory)
+    raster = MapRaster(synthetic_map(map_size))
+    rotated = measure(raster_rotation, raster, angle)
+    assert rotated.width() > map_size
+
+
+@pytest.fixture
+def rotation_cache():
+    ''' cached rotations of large maps are not left in memory for the following benchmarks '''
+    yield
+    with helpers._rotation_cache_lock:
+        helpers._rotation_cache.clear()
+
+
+@pytest.mark.parametrize('cached', [True, False], ids=['hit', 'miss'])
+def test_cached_rotation(measure, map_size, rotation_cache, cached):
+    require_memory(map_size ** 2, cached_rotation_memory)
+    raster = MapRaster(synthetic_map(map_size))
+    if cached:
+        cached_rotation(raster, angle)
+        rotated = measure(cached_rotation, raster, angle)
+    else:
+        def modified_rotation():
+            raster.touch()  # as after every routine, the cached rotation is stale
+            return cached_rotation(raster, angle)
+        rotated = measure(modified_rotation)
+    assert rotated.width() > map_size
+
+
+def test_rotate_and_scale(measure, map_size):
+    require_memory(map_size ** 2, rotate_and_scale_memory)
+    array = synthetic_map(map_size)
+    rotated = measure(rotateAndScale, array, angle)
+    assert rotated.shape[0] > map_size
+
+
+def test_numpyQImage(measure, map_size):
+    require_memory(map_size ** 2, view_memory)
+    array = synthetic_map(map_size)
+    image = measure(numpyQImage, array)
+    assert image.width() == map_size
+
+
+def test_qimage2array(measure, map_size):
+    require_memory(map_size ** 2, view_memory)
+    raster = MapRaster(synthetic_map(map_size))
+    array = measure(qimage2array, raster.image)
+    assert array.shape == (map_size, map_size, 3)
+
+
+def test_rgb2gray(measure, map_size):
+    require_memory(map_size ** 2, rgb2gray_memory)
+    rgb = np.ascontiguousarray(synthetic_map(map_size)[..., 2::-1])
+    gray = measure(rgb2gray, rgb)
+    assert gray.shape == (map_size, map_size)
+
+
+@pytest.mark.parametrize('cached', [True, False], ids=['palette', 'new_color'])
+def test_change_lightness(measure, cached):
+    if cached:
+        color = colors['Nav2-blue']
+        rgb = measure(change_lightness, color, 100)
+    else:
+        # more distinct colors than lightness_lut() keeps, so every call computes the table
+        new_colors = cycle([(red, green, 50) for red in range(0, 256, 8) for green in range(0, 256, 8)])
+        rgb = measure(lambda: change_lightness(next(new_colors), 100))
+    assert len(rgb) == 3
+
+
+def test_bgra2gray(measure, map_size):
+    require_memory(map_size ** 2, bgra2gray_memory)
+    array = synthetic_map(map_size)
+    gray = measure(bgra2gray, array, grayscale_chunk_pixels)
+    assert gray.shape == (map_size, map_size)
+
+
+def test_grayscale(measure, map_size):
+    ''' in place, repeated calls convert the same, already gray, pixels '''
+    require_memory(map_size ** 2, bgra2gray_memory)
+    raster = MapRaster(synthetic_map(map_size))
+    measure(raster.grayscale)
+    assert (raster.array[..., 0] == raster.array[..., 2]).all()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+'''
+Handler latency of canvas input, synthetic trace of hovering, panning, zooming, rotating, painting and undo/redo
+is replayed by map_editor.replay on synthetic map, 90th percentile of every event label is checked
+'''
+
+# PyQT
+from PyQt5.QtCore import Qt
+
+# Python
+import pytest
+
+# Source files
+from map_editor.Canvas.input_trace import trace_version, view_state
+from map_editor.Helpers.raster import MapRaster
+from map_editor.replay import replay, summarize
+
+from conftest import check_thresholds, synthetic_map
+
+replay_map_size = 4096
+viewport = (800, 600)
+labels = ['mouse_move:hover', 'mouse_move:pan', 'wheel', 'key_press:W', 'key_press:2', 'key_release',
+          'mouse_move:brush', 'mouse_release:brush', 'undo', 'redo', 'frame']
+
+
+def mouse(kind, x, y, button=Qt.NoButton, buttons=Qt.NoButton, modifiers=Qt.NoModifier) -> dict:
+    return {'type': kind, 'pos': [x, y], 'button': int(button), 'buttons': int(buttons),
+            'modifiers': int(modifiers)}
+
+
+def key(kind, key_code, modifiers=Qt.NoModifier, auto_repeat=False) -> dict:
+    return {'type': kind, 'key': int(key_code), 'modifiers': int(modifiers), 'text': '', 'auto_repeat': auto_repeat}
+
+
+def synthetic_records() -> list:
+    width, height = viewport
+    records = [mouse('mouse_move', x, x * height // width) for x in range(0, width, 4)]
+    # pan across the map, press is taken only over the map
+    records.append(mouse('mouse_move', 400, 300))
+    records.append(mouse('mouse_press', 400, 300, Qt.LeftButton, Qt.LeftButton, Qt.ControlModifier))
+    records += [mouse('mouse_move', 400 - x, 300 - x // 2, Qt.NoButton, Qt.LeftButton, Qt.ControlModifier)
+                for x in range(0, 200, 2)]
+    records.append(mouse('mouse_release', 200, 200, Qt.LeftButton, Qt.NoButton, Qt.ControlModifier))
+    # zoom in and out
+    for delta in [120] * 10 + [-120] * 10:
+        records.append({'type': 'wheel', 'pos': [400, 300], 'delta': [0, delta], 'buttons': 0, 'modifiers': 0})
+    # keyboard pan
+    for _ in range(20):
+        records += [key('key_press', Qt.Key_W), key('key_release', Qt.Key_W)]
+    # three rotations, each held key makes one history entry on release
+    for _ in range(3):
+        records += [key('key_press', Qt.Key_2, auto_repeat=repeat > 0) for repeat in range(10)]
+        records.append(key('key_release', Qt.Key_2))
+    # brush stroke, painting is chosen in Paint menu, that is recorded as tool state
+    records.append({'type': 'state', 'state': {'brushReady': True}})
+    records.append(mouse('mouse_move', 300, 200))
+    records.append(mouse('mouse_press', 300, 200, Qt.LeftButton, Qt.LeftButton))
+    records += [mouse('mouse_move', 300 + x, 200 + x // 3, Qt.NoButton, Qt.LeftButton) for x in range(0, 200, 2)]
+    records.append(mouse('mouse_release', 500, 266, Qt.LeftButton, Qt.NoButton))
+    records.append({'type': 'state', 'state': {'brushReady': False}})
+    for _ in range(3):
+        records += [key('key_press', Qt.Key_Z, Qt.ControlModifier), key('key_release', Qt.Key_Z, Qt.ControlModifier)]
+    for _ in range(3):
+        records += [key('key_press', Qt.Key_Z, Qt.ControlModifier | Qt.ShiftModifier),
+                    key('key_release', Qt.Key_Z, Qt.ControlModifier | Qt.ShiftModifier)]
+    for time, record in enumerate(records):
+        record['t'] = time * 0.01
+    return records
+
+
+@pytest.fixture(scope='module')
+def replayed(qapp):
+    ''' summary of the replay, label -> percentiles of latency in s '''
+    from map_editor.main import MainWindow
+    raster = MapRaster(synthetic_map(replay_map_size))  # alive, while the window copies its image
+    window = MainWindow(raster.image, 'synthetic.pgm')
+    window.show()
+    qapp.processEvents()
+    header = {'type': 'header', 'version': trace_version, 'viewport': list(viewport),
+              'view': view_state(window.canvas)}
+    try:
+        return summarize(replay(window, header, synthetic_records(), speed=0))
+    finally:
+        window.close()
+
+
+@pytest.mark.parametrize('label', labels)
+def test_replay_latency(replayed, request, label):
+    assert label in replayed, "%s was not replayed" % label
+    check_thresholds(request, {'latency': replayed[label]['p90']})
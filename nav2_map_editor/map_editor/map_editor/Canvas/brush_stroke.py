@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+# PyQT
+from PyQt5.QtGui import QPainter, QGuiApplication
+from PyQt5.QtCore import QRect, QTimer
+
+# Python
+import logging
+
+# Source files
+from map_editor.Helpers.raster import rect_slices
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import stroke_backup_tile_size, default_refresh_rate
+
+logger = logging.getLogger("map_editor")
+
+
+class BrushStroke:
+    '''
+    One brush stroke, painted straight into the raster of TiledPixmapItem
+    - consecutive mouse samples are joined by line segments, so fast movement leaves no gaps
+    - pixels are backed up per stroke_backup_tile_size tile, just before the stroke touches them first time,
+      so history gets the region before the stroke without copying whole map
+    - changed region is collected and repainted at most once per display refresh
+    '''
+    def __init__(self, tiled_item, pen):
+        self.tiled_item = tiled_item
+        self.pen = pen
+        self.margin = pen.width() + 1  # square cap of rotated segment reaches over half of pen width
+        self.backup = {}  # (column, row) -> (tile rect, array of pixels before the stroke)
+        self.rect = QRect()  # region changed by whole stroke
+        self.pending_rect = QRect()  # changed, but not repainted yet
+        self.last_point = None
+
+        screen = QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen is not None else default_refresh_rate
+        self.flush_timer = QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(int(1000 / (refresh_rate or default_refresh_rate)))
+        self.flush_timer.timeout.connect(self.flush)
+
+    def _backup_region(self, rect) -> None:
+        raster = self.tiled_item.raster()
+        for row in range(rect.top() // stroke_backup_tile_size, rect.bottom() // stroke_backup_tile_size + 1):
+            for column in range(rect.left() // stroke_backup_tile_size, rect.right() // stroke_backup_tile_size + 1):
+                if (column, row) not in self.backup:
+                    tile_rect = QRect(column * stroke_backup_tile_size, row * stroke_backup_tile_size,
+                                      stroke_backup_tile_size, stroke_backup_tile_size).intersected(raster.rect())
+                    self.backup[(column, row)] = (tile_rect, raster.region(tile_rect).copy())
+
+    def add_point(self, point) -> None:
+        ''' paints segment from the previous point, or single stamp for the first one '''
+        start_point = point if self.last_point is None else self.last_point
+        segment_rect = QRect(start_point, point).normalized().adjusted(
+            -self.margin, -self.margin, self.margin, self.margin)
+        segment_rect = segment_rect.intersected(self.tiled_item.raster().rect())
+        self.last_point = point
+        if segment_rect.isEmpty():
+            return
+        self._backup_region(segment_rect)
+
+        painter = QPainter(self.tiled_item.paint_device())
+        painter.setPen(self.pen)
+        if start_point == point:
+            painter.drawPoint(point)
+        else:
+            painter.drawLine(start_point, point)
+        painter.end()
+
+        self.rect |= segment_rect
+        self.pending_rect |= segment_rect
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self) -> None:
+        ''' repaints tiles changed since the last flush '''
+        self.flush_timer.stop()
+        if not self.pending_rect.isEmpty():
+            self.tiled_item.invalidate(self.pending_rect)
+            self.pending_rect = QRect()
+
+    def finish(self):
+        ''' returns (rect, before, after) arrays of region changed by the stroke, rect is empty if nothing changed '''
+        self.flush()
+        if self.rect.isEmpty():
+            return self.rect, None, None
+        raster = self.tiled_item.raster()
+        after = raster.region(self.rect)
+        before = after.copy()  # pixels outside of backup tiles were not painted
+        for tile_rect, tile in self.backup.values():
+            part = tile_rect.intersected(self.rect)
+            before[rect_slices(part.translated(-self.rect.topLeft()))] = tile[rect_slices(part.translated(-tile_rect.topLeft()))]
+        self.backup.clear()
+        return self.rect, before, after.copy()
@@ -2,29 +2,57 @@
 
 # External lib
 import numpy as np
-import qimage2ndarray
 
 # PyQT
 from PyQt5.QtGui import QImage, QPixmap, QKeyEvent, QMouseEvent, QWheelEvent, QShowEvent, QResizeEvent
-from PyQt5.QtGui import QKeySequence, QPen, QPainter, QBrush
-from PyQt5.QtCore import QPoint, QPointF, QRect, QRectF, QSize, QSizeF, pyqtSignal
-from PyQt5.Qt import Qt
-from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QRubberBand
+from PyQt5.QtGui import QKeySequence, QPen, QPainter, QBrush, QTransform
+from PyQt5.QtCore import QPoint, QPointF, QRect, QRectF, QSize, QSizeF, QLineF, QTimer, pyqtSignal
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QRubberBand
+from PyQt5.QtWidgets import QGraphicsLineItem, QGraphicsRectItem, QGraphicsPixmapItem
 
 # Python
 import logging
 
 # Source files
 from map_editor.Helpers.helpers import Routine, AddingPosition
-from map_editor.Helpers.helpers import clamp, rotation, qimage2array, unit_vectors
-from map_editor.Helpers.colors_helpers import calculate_lightness, colors, rgb2gray
+from map_editor.Helpers.helpers import clamp, cached_rotation, prepare_rotation, rotated_size, unit_vectors
+from map_editor.Helpers.colors_helpers import calculate_lightness, colors
 from map_editor.Waypoint_Menu.waypoint_class import Waypoint
+from map_editor.Waypoint_Menu.waypoint_store import WaypointStore
+from map_editor.Waypoint_Menu.waypoint_layer import WaypointLayer
+from map_editor.Helpers.raster import MapRaster
+from map_editor.Helpers import instrumentation
+from map_editor.Helpers.waypoint_io import dump_waypoints
+from map_editor.Canvas.tiled_pixmap import TiledPixmapItem
+from map_editor.Canvas.history import History, HistoryEntry
+from map_editor.Canvas.brush_stroke import BrushStroke
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import rotation_prepare_delay
 
 logger = logging.getLogger("map_editor")
 
 # ROI = Region of interest
 
 
+def grayscale_job(raster, angle, progress=None):
+    '''
+    background job, returns (gray copy of raster, history entry of the change)
+    raster shown by the canvas is only read, the copy is swapped in by the GUI thread, so the job can be cancelled
+    '''
+    gray = raster.copy()
+    if progress is not None:
+        progress(0.3)
+    gray.grayscale()
+    if progress is not None:
+        progress(0.6)
+    history_entry = HistoryEntry.patch(Routine.GRAY.value, angle, raster.rect(), raster.array, gray.array)
+    if progress is not None:
+        progress(1)
+    return gray, history_entry
+
+
 class ImageView(QGraphicsView):
     imageChanged = pyqtSignal()
     '''
@@ -40,8 +68,16 @@ class ImageView(QGraphicsView):
         self.scene_pos = self.mapToScene(QPoint(0, 0))
         self.cursor_widget_x, self.cursor_widget_y = 0, 0
         self.cursor_image_x, self.cursor_image_y = 0, 0
-        self.graphics_pixmap = QGraphicsPixmapItem()
+        self.graphics_pixmap = TiledPixmapItem()  # only visible tiles are drawn, at level matching the zoom
         self.main_scene.addItem(self.graphics_pixmap)
+        self.preview_item = QGraphicsPixmapItem()  # downsampled map from map cache, shown while the map loads
+        self.preview_item.setTransformationMode(Qt.SmoothTransformation)
+        self.preview_item.hide()
+        self.main_scene.addItem(self.preview_item)
+        self.loading_item = TiledPixmapItem()  # map being loaded, over the preview, refined strip by strip
+        self.loading_item.hide()
+        self.main_scene.addItem(self.loading_item)
+        self.loading_rect = QRectF()  # of the map being loaded
         self.setScene(self.main_scene)
         self.start_drag_ui = QPoint()
         self.last_scene_roi = None
@@ -55,25 +91,43 @@ class ImageView(QGraphicsView):
         self.rotating = False; self.rotating_allowed = True
         self.zoom_factor = 1.5
         self.angle = 0
+        self.view_angle = 0  # latest_raster is shown rotated by graphics item, until commit_rotation()
         self.pan_speed = 10
         self.pan_acceleration = 3  # this is const hard coded
         self.rotating_speed = 1
         self.rotating_acceleration = 1  # this is const hard coded
-        self.latest_pixmap = None  # inserted from the main
-        self.history = []  # first default pixmap is added here, then loaded const pixmap
+        self.latest_raster = None  # unrotated map, inserted from the main
+        self.history = History()  # first default pixmap is added here, then loaded const pixmap
         self.history_current_idx = 0
+        self.map_busy = False  # background job is changing the map, only view can be changed
+        # settled rotation is resampled in background, so its commit does not block
+        self.rotation_prepare_timer = QTimer(self)
+        self.rotation_prepare_timer.setSingleShot(True)
+        self.rotation_prepare_timer.setInterval(rotation_prepare_delay)
+        self.rotation_prepare_timer.timeout.connect(self.prepare_rotation)
 
         # map painting
         self.brushReady = False; self.drawing_brush = False
         self.paint_rectReady = False; self.drawing_rect = False
         self.paint_lineReady = False; self.drawing_line = False
+        self.brush_stroke = None  # BrushStroke in progress
+        self.dirty_rect = QRect()  # region changed by the current paint routine
+        # line and rectangle are previewed by overlay items, map is painted only on mouse release
+        self.line_preview = QGraphicsLineItem()
+        self.rect_preview = QGraphicsRectItem()
+        for preview in (self.line_preview, self.rect_preview):
+            preview.setZValue(1)
+            preview.hide()
+            self.main_scene.addItem(preview)
         self.brushSize = 10
         self.const_paintColor = colors['Nav2-blue']
         self.paintColor = colors['Nav2-blue']
         self.paintLightness = np.interp(calculate_lightness(self.paintColor), [0, 255], [0, 100])
         self.adding_waypoint = False
         self.waypoint_adding_position = AddingPosition.END.value
-        self.waypoints = []
+        self.waypoints = WaypointStore()
+        self.waypoint_layer = WaypointLayer(self)  # draws all waypoints, above map
+        self.main_scene.addItem(self.waypoint_layer)
 
     def update_light(self) -> None:
         self.main_widget.paint_menu.light.spin_light.setValue(round(np.interp(calculate_lightness(
@@ -86,85 +140,101 @@ class ImageView(QGraphicsView):
         '''used for deciding, whether waypoints should be movable'''
         should_waypoint_move = not (self.rotating or self.panning or self.brushReady or self.paint_rectReady
                                     or self.paint_lineReady or self.adding_waypoint)
-        Waypoint.change_movable(should_waypoint_move)
+        self.waypoint_layer.set_movable(should_waypoint_move)
         logger.debug("Waypoints movable: " + str(should_waypoint_move))
 
     def add_waypoint(self) -> None:
         waypoint_x = self.cursor_image_x
         waypoint_y = self.cursor_image_y
-        waypoint = Waypoint(self, waypoint_x, waypoint_y, self.angle)
+        wp_id, row = self.waypoints.generate_id(self.waypoint_adding_position)
+        waypoint = Waypoint(waypoint_x, waypoint_y, self.angle, wp_id)
         if self.waypoint_adding_position not in (AddingPosition.END.value, AddingPosition.START.value):
-            next_wp_number = Waypoint.next_waypoint_number(self.waypoint_adding_position)
-            Waypoint.waypoint_adding_position = next_wp_number
-            self.main_widget.waypoint_menu.choices.radio3_line_edit.setText(str(next_wp_number))
-        self.main_scene.addItem(waypoint)
+            # next waypoint goes after this one
+            self.waypoint_adding_position = wp_id
+            self.main_widget.waypoint_menu.choices.radio3_line_edit.setText(str(wp_id))
         self.disable_transformations()
-
-        waypoint.moveBy(waypoint_x, waypoint_y)
+        self.main_widget.waypoint_menu.waypoint_table.waypoint_model.insert(waypoint, row)
+        self.waypoint_layer.add(waypoint)
+
+    def load_waypoints(self, rows) -> None:
+        ''' replaces all waypoints by (x, y, theta) rows, in route order, ids are 1, 2, ... '''
+        loaded_waypoints = [Waypoint(x, y, theta, idx + 1) for idx, (x, y, theta) in enumerate(rows)]
+        self.waypoint_layer.clear()
+        self.waypoints.reset(loaded_waypoints)
+        self.waypoint_layer.add_many(loaded_waypoints)
         self.populate_waypoint_table()
 
-    def load_waypoint(self, x, y, theta, wp_id) -> None:
-        loaded_waypoint = Waypoint(self, x, y, theta, wp_id)
-        self.main_scene.addItem(loaded_waypoint)
-        loaded_waypoint.moveBy(x, y)
-
     def populate_waypoint_table(self) -> None:
         '''used for updating waypoint table'''
         self.main_widget.waypoint_menu.waypoint_table.populate()
 
     def export_waypoints(self) -> str:
-        # used for saving waypoints into YAML file
-        result_string = '\n'
-        Waypoint.reindex_waypoint()
-        wpc = Waypoint.waypoint_container
-        for wp in wpc:
-            substring = 'wp_%s: [%s, %s, %s]' % (wp.id, wp.x, wp.y, self.angle)
-            result_string += substring
-            result_string += '\n'
-        return result_string
+        ''' waypoints block of YAML file, ids are not saved, so they are reindexed as they will be loaded '''
+        self.waypoint_layer.reindex()
+        return '\n' + dump_waypoints([(wp.x, wp.y, wp.theta) for wp in self.waypoints])
 
     def delete_all_waypoints(self):
-        wpc = Waypoint.waypoint_container
-        if wpc:
-            for wp in wpc:
-                self.main_scene.removeItem(wp)
-            Waypoint.waypoint_container = []
+        self.waypoints.clear()
+        self.waypoint_layer.clear()
         self.main_widget.waypoint_menu.waypoint_table.populate()
 
 
     def delete_specific_waypoint(self, wp_id):
-        wpc = Waypoint.waypoint_container
-        for wp_idx, wp_value in enumerate(wpc):
-            if wp_id == wp_value.id:
-                self.main_scene.removeItem(wp_value)
-                Waypoint.waypoint_container.pop(wp_idx)
-                self.populate_waypoint_table()
-                break
+        if wp_id in self.waypoints:
+            waypoint = self.main_widget.waypoint_menu.waypoint_table.waypoint_model.remove(wp_id)
+            self.waypoint_layer.remove(waypoint)
 
     # /Waypoint functions 
 
 
+    def brush_pen(self) -> QPen:
+        return QPen(self.paintColor, self.brushSize, Qt.SolidLine, Qt.SquareCap, Qt.RoundJoin)
+
+    def rect_pen(self) -> QPen:
+        pen = QPen()
+        pen.setWidth(1)
+        pen.setColor(self.paintColor)
+        return pen
+
+    def rect_brush(self) -> QBrush:
+        brush = QBrush()
+        brush.setColor(self.paintColor)
+        brush.setStyle(Qt.SolidPattern)
+        return brush
+
     def init_brush_paint(self, target_image):
         '''call it before starting paint with brush'''
         self.painter = QPainter(target_image)
-        self.painter.setPen(QPen(self.paintColor, self.brushSize, Qt.SolidLine, Qt.SquareCap, Qt.RoundJoin))
+        self.painter.setPen(self.brush_pen())
 
     def init_rect_paint(self, target_image):
         ''' call it before starting paint with rectangle'''
         self.painter = QPainter(target_image)
-        brush = QBrush()
-        brush.setColor(self.paintColor)
-        brush.setStyle(Qt.SolidPattern)
-        self.painter.setBrush(brush)
+        self.painter.setBrush(self.rect_brush())
+        self.painter.setPen(self.rect_pen())
 
-        pen = QPen()
-        pen.setWidth(1)
-        pen.setColor(self.paintColor)
-        self.painter.setPen(pen)
+    @property
+    def raster(self) -> MapRaster:
+        ''' map as user sees it, painting on it changes the map, call graphics_pixmap.invalidate() afterwards '''
+        # rotation shown by the view is resampled first
+        self.commit_rotation()
+        return self.graphics_pixmap.raster()
+
+    @raster.setter
+    def raster(self, raster) -> None:
+        self.hide_preview()
+        self.view_angle = 0
+        self.graphics_pixmap.setRotation(0)
+        self.graphics_pixmap.setPos(0, 0)
+        self.graphics_pixmap.setRaster(raster)
+        self.setSceneDims()
+        self.graphics_pixmap.update()
+        self.imageChanged.emit()
 
     @property
     def pixmap(self):
-        return self.graphics_pixmap.pixmap()
+        ''' copy of the map, for display outside of canvas '''
+        return self.raster.to_pixmap()
 
     @pixmap.setter
     def pixmap(self, image, image_format=None):
@@ -175,12 +245,12 @@ class ImageView(QGraphicsView):
                     if image_format is None:
                         image_format = QImage.Format_RGB888
                     q_image = QImage(image.data, image.shape[1], image.shape[0], image_format)
-                    pixmap = QPixmap.fromImage(q_image)  # copy data from the QImage referencing image original data
+                    raster = MapRaster.from_image(q_image)  # copy data from the QImage referencing image original data
                 elif image.shape[2] == 4:
                     if image_format is None:
                         image_format = QImage.Format_RGB32
                     q_image = QImage(image.data, image.shape[1], image.shape[0], image_format)
-                    pixmap = QPixmap.fromImage(q_image)  # copy data from the QImage referencing image original data
+                    raster = MapRaster.from_image(q_image)  # copy data from the QImage referencing image original data
                 else:
                     logger.critical("Unknown format")
                     raise TypeError(image)
@@ -188,23 +258,20 @@ class ImageView(QGraphicsView):
                 if image_format is None:
                     image_format = QImage.Format_RGB888
                 q_image = QImage(image.data, image.shape[1], image.shape[0], image_format)
-                pixmap = QPixmap.fromImage(q_image)  # copy data from the QImage referencing original image
+                raster = MapRaster.from_image(q_image)  # copy data from the QImage referencing original image
             else:
                 logger.critical("Unknown format")
                 raise ValueError(image)
 
-        elif isinstance(image, QImage):
-            pixmap = QPixmap.fromImage(image)
-        elif isinstance(image, QPixmap):
-            pixmap = image
+        elif isinstance(image, (QImage, QPixmap)):
+            raster = MapRaster.from_image(image)
+        elif isinstance(image, MapRaster):
+            raster = image
         else:
             logger.critical("Unknown format")
             raise TypeError(image)  # TODO
 
-        self.graphics_pixmap.setPixmap(pixmap)
-        self.setSceneDims()
-        self.graphics_pixmap.update()
-        self.imageChanged.emit()
+        self.raster = raster
 
     @property
     def image(self):
@@ -214,13 +281,42 @@ class ImageView(QGraphicsView):
     def image(self, image) -> None:
         self.pixmap = image
 
+    def show_rotated(self, angle) -> None:
+        ''' shows latest_raster rotated by the graphics item, raster is not resampled until commit_rotation() '''
+        if self.graphics_pixmap.raster().cache_key() != self.latest_raster.cache_key():
+            self.graphics_pixmap.setRaster(self.latest_raster)
+        width, height = self.latest_raster.width(), self.latest_raster.height()
+        rotated_width, rotated_height = rotated_size(width, height, angle)
+        # same placement as helpers.rotation(), rotated map starts at scene origin
+        self.graphics_pixmap.setTransformOriginPoint(width / 2, height / 2)
+        self.graphics_pixmap.setRotation(angle)
+        self.graphics_pixmap.setPos((rotated_width - width) / 2, (rotated_height - height) / 2)
+        self.view_angle = angle % 360
+        self.setSceneDims()
+        self.imageChanged.emit()
+        if self.view_angle:
+            self.rotation_prepare_timer.start()
+
+    def prepare_rotation(self) -> None:
+        if self.view_angle:
+            self.main_widget.jobs.submit('rotation', prepare_rotation, self.latest_raster, self.view_angle)
+
+    def commit_rotation(self) -> None:
+        ''' replaces rotation shown by the view with resampled map, recent angles are cached '''
+        self.rotation_prepare_timer.stop()
+        if self.view_angle:
+            with instrumentation.span('angle_commit', angle=self.view_angle):
+                # cached raster stays untouched, map gets painted on its copy
+                self.raster = cached_rotation(self.latest_raster, self.view_angle).copy()
+
     def setSceneDims(self) -> None:
-        pixmap = self.pixmap
-        self.setSceneRect(QRectF(QPointF(0, 0), QPointF(pixmap.width(), pixmap.height())))
+        self.setSceneRect(QRectF(QPointF(0, 0), self.image_scene_rect.bottomRight()))
 
     @property
     def image_scene_rect(self):
-        return QRectF(self.graphics_pixmap.pos(), QSizeF(self.pixmap.size()))
+        if self.previewing():
+            return self.loading_rect
+        return self.graphics_pixmap.sceneBoundingRect()
 
     def resizeEvent(self, event: QResizeEvent) -> None:
         QGraphicsView.resizeEvent(self, event)
@@ -229,7 +325,6 @@ class ImageView(QGraphicsView):
         self.fitInView(self.last_scene_roi, Qt.KeepAspectRatio)
 
     def zoomROITo(self, p, zoom_level_delta) -> None:
-        pixmap = self.graphics_pixmap.pixmap()
         roi = self.current_scene_ROI
         roi_dims = QPointF(roi.width(), roi.height())
         roi_topleft = roi.topLeft()
@@ -241,7 +336,8 @@ class ImageView(QGraphicsView):
         nroi_dims = roi_dims * roi_scalef
         nroi_dims.setX(max(nroi_dims.x(), 1))
         nroi_dims.setY(max(nroi_dims.y(), 1))
-        if nroi_dims.x() > self.pixmap.size().width() or nroi_dims.y() > self.pixmap.size().height():
+        image_size = self.image_scene_rect.size()
+        if nroi_dims.x() > image_size.width() or nroi_dims.y() > image_size.height():
             self.reset_view()
         else:
             prel_scaled_x = (p.x() - roi_topleft.x()) / roi_dims.x()
@@ -271,10 +367,106 @@ class ImageView(QGraphicsView):
         n_roi = QRectF(new_top_left, roi.size())
         self.fitInView(n_roi, Qt.KeepAspectRatio)
 
+    def is_busy(self) -> bool:
+        if self.map_busy:
+            logger.info("Map is being processed, press Esc to cancel")
+        return self.map_busy
+
+    def run_map_job(self, name, function, *args, on_finished=None, on_failed=None, on_partial=None):
+        ''' background job changing the map, editing is blocked until it ends, view stays interactive '''
+        self.map_busy = True
+        job = self.main_widget.jobs.submit(name, function, *args, on_finished=on_finished, on_failed=on_failed,
+                                           on_partial=on_partial)
+        job.signals.ended.connect(self.map_job_ended)
+        return job
+
+    def map_job_ended(self) -> None:
+        self.map_busy = False
+        self.hide_preview()
+
+    def show_preview(self, image, size) -> None:
+        ''' shows downsampled map, scaled to the map size, instead of the map, until new map is set '''
+        self.preview_item.setPixmap(QPixmap.fromImage(image))
+        self.preview_item.setTransform(QTransform.fromScale(size.width() / image.width(),
+                                                            size.height() / image.height()))
+        self.preview_item.show()
+        self.show_loading_area(QRectF(QPointF(0, 0), QSizeF(size)))
+
+    def show_loading_area(self, rect) -> None:
+        ''' map is hidden and view fits rect of the map being loaded, once per load '''
+        if not self.previewing():
+            self.loading_rect = rect
+            self.graphics_pixmap.hide()
+            self.setSceneRect(rect)
+            self.fitInView(rect, Qt.KeepAspectRatio)
+
+    def map_loading(self, update) -> None:
+        ''' partial result of map loading job, see map_io.load_pgm() '''
+        if update[0] == 'preview':
+            _, size, image = update
+            if not self.preview_item.isVisible():  # preview from map cache is smoother
+                self.show_preview(image, size)
+        elif update[0] == 'raster':
+            self.loading_item.setRaster(update[1])
+            self.loading_item.show()
+            self.show_loading_area(self.loading_item.boundingRect())
+        elif update[0] == 'rows':
+            _, top, bottom = update
+            self.loading_item.invalidate(QRect(0, top, self.loading_item.raster().width(), bottom - top))
+
+    def previewing(self) -> bool:
+        ''' map being loaded or its preview is shown instead of the map '''
+        return not self.graphics_pixmap.isVisible()
+
+    def hide_preview(self) -> None:
+        ''' preview and map being loaded are replaced by the map '''
+        if not self.previewing():
+            return
+        self.preview_item.hide()
+        self.preview_item.setPixmap(QPixmap())
+        self.loading_item.hide()
+        self.loading_item.setRaster(MapRaster.empty(0, 0))
+        self.graphics_pixmap.show()
+        self.setSceneDims()
+
     def grayscale_canvas(self):
+        if self.is_busy():
+            return
+        logger.debug("Grayscale started")
+        span = instrumentation.span('gray')
+        job = self.run_map_job('grayscale', grayscale_job, self.raster, self.angle, on_finished=self.grayscale_finished)
+        span.track(job)
+
+    def grayscale_finished(self, result) -> None:
         logger.debug("Grayscaled")
-        self.pixmap = QPixmap.fromImage(qimage2ndarray.array2qimage(rgb2gray(qimage2array(self.pixmap.toImage()))))
-        self.add_routine_cull_history((Routine.GRAY.value, self.pixmap, self.angle))
+        gray, history_entry = result
+        if self.latest_raster is self.graphics_pixmap.raster():
+            self.latest_raster = gray
+        self.raster = gray
+        self.add_routine_cull_history(history_entry)
+
+    def line_dirty_rect(self, start_point, end_point) -> QRect:
+        ''' region covered by line drawn with brush pen, square caps included '''
+        margin = self.brushSize + 1
+        return QRect(start_point, end_point).normalized().adjusted(-margin, -margin, margin, margin)
+
+    def commit_preview(self, routine) -> None:
+        ''' draws previewed line or rectangle straight into the map, only dirty_rect is copied and repainted '''
+        raster = self.raster
+        rect = self.dirty_rect.intersected(raster.rect())
+        self.dirty_rect = QRect()
+        if rect.isEmpty():
+            return
+        before = raster.region(rect).copy()
+        if routine == Routine.PAINT_LINE.value:
+            self.init_brush_paint(self.graphics_pixmap.paint_device())
+            self.painter.drawLine(self.line_preview.line())
+        else:
+            self.init_rect_paint(self.graphics_pixmap.paint_device())
+            self.painter.drawRect(self.rect)
+        self.painter.end()
+        self.graphics_pixmap.invalidate(rect)
+        self.add_routine_cull_history(HistoryEntry.patch(routine, self.angle, rect, before, raster.region(rect)))
 
     def disable_transformations(self, disable=True):
         # rotating and cropping only allowed at start, for now
@@ -303,7 +495,7 @@ class ImageView(QGraphicsView):
 
     def mousePressEvent(self, event: QMouseEvent) -> None:
 
-        if not ((0 <= self.cursor_image_x <= self.image.width()) and (0 <= self.cursor_image_y <= self.image.height())):
+        if not self.image_scene_rect.contains(QPointF(self.cursor_image_x, self.cursor_image_y)):
             # prevents user from event-clicking outside image (solves lot of issues later)
             # TODO: when map is rotated, the Zoom rubberband gives slightly wrong selection, but one can wheel zoom, which works perfectly
             return
@@ -314,7 +506,7 @@ class ImageView(QGraphicsView):
         modifier = event.modifiers()
         self.start_drag_ui = event.pos()
         self.start_drag_image = QPoint(self.cursor_image_x, self.cursor_image_y)
-        self.current_image_pos = QPoint(self.scene_pos.x(), self.scene_pos.y())
+        self.current_image_pos = QPoint(int(self.scene_pos.x()), int(self.scene_pos.y()))
 
         # pan
         if modifier == Qt.ControlModifier and button == Qt.LeftButton:
@@ -327,6 +519,9 @@ class ImageView(QGraphicsView):
             self.rubberBand.setGeometry(QRect(self.start_drag_ui, QSize()))
             self.rubberBand.show()
 
+        elif self.map_busy and button == Qt.LeftButton:
+            self.is_busy()
+
         elif self.cropping_allowed and (modifier == Qt.AltModifier or self.cropping_activated) and button == Qt.LeftButton:
             if self.cropBand is None:
                 self.cropBand = QRubberBand(QRubberBand.Rectangle, self.viewport())
@@ -336,27 +531,35 @@ class ImageView(QGraphicsView):
 
         elif self.brushReady and event.button() == Qt.LeftButton:
             logger.debug("Paint brush started")
+            self.commit_rotation()
             self.drawing_brush = True
-            self.paint_pixmap = self.pixmap.copy()
-            self.init_brush_paint(self.paint_pixmap)
-            self.lastPoint = QPoint(self.scene_pos.x(), self.scene_pos.y())
-            self.painter.drawPoint(self.lastPoint)
-            self.pixmap = self.paint_pixmap
+            self.brush_stroke = BrushStroke(self.graphics_pixmap, self.brush_pen())
+            self.lastPoint = QPoint(int(self.scene_pos.x()), int(self.scene_pos.y()))
+            self.brush_stroke.add_point(self.lastPoint)
             self.disable_transformations()
 
         elif self.paint_lineReady and event.button() == Qt.LeftButton:
             logger.debug("Paint line started")
+            self.commit_rotation()
             self.drawing_line = True
-            self.const_pixmap = self.pixmap.copy()
-            self.lastPoint = QPoint(self.scene_pos.x(), self.scene_pos.y())
+            self.dirty_rect = QRect()
+            self.lastPoint = QPoint(int(self.scene_pos.x()), int(self.scene_pos.y()))
+            self.line_preview.setPen(self.brush_pen())
+            self.line_preview.setLine(QLineF(self.start_drag_image, self.start_drag_image))
+            self.line_preview.show()
             self.disable_transformations()
 
         elif self.paint_rectReady and event.button() == Qt.LeftButton:
             logger.debug("Paint rect started")
+            self.commit_rotation()
             self.drawing_rect = True
-            self.const_pixmap = self.pixmap.copy()
+            self.dirty_rect = QRect()
             self.rect = QRect(self.start_drag_image, self.start_drag_image)
-            self.lastPoint = QPoint(self.scene_pos.x(), self.scene_pos.y())
+            self.lastPoint = QPoint(int(self.scene_pos.x()), int(self.scene_pos.y()))
+            self.rect_preview.setPen(self.rect_pen())
+            self.rect_preview.setBrush(self.rect_brush())
+            self.rect_preview.setRect(QRectF(self.rect))
+            self.rect_preview.show()
             self.disable_transformations()
 
         elif self.adding_waypoint and event.button() == Qt.LeftButton:
@@ -366,7 +569,7 @@ class ImageView(QGraphicsView):
             if self.main_widget.waypoint_menu.choices.button.isChecked():
                 self.main_widget.waypoint_menu.choices.button.setChecked(False)
                 self.main_widget.waypoint_menu.choices.toggle_state()
-                Waypoint.change_movable(True)
+                self.waypoint_layer.set_movable(True)
 
     def mouseMoveEvent(self, event: QMouseEvent) -> None:
         QGraphicsView.mouseMoveEvent(self, event)
@@ -385,28 +588,19 @@ class ImageView(QGraphicsView):
             self.start_drag_ui = end_drag_ui
 
         elif self.drawing_brush:
-            current_point = QPoint(self.scene_pos.x(), self.scene_pos.y())
-            self.painter.drawPoint(current_point)
-            self.pixmap = self.paint_pixmap
+            current_point = QPoint(int(self.scene_pos.x()), int(self.scene_pos.y()))
+            self.brush_stroke.add_point(current_point)
 
         elif self.drawing_line:
-            current_point = QPoint(self.scene_pos.x(), self.scene_pos.y())
-            self.pixmap = self.const_pixmap.copy()
-            self.paint_pixmap = self.const_pixmap.copy()
-            self.init_brush_paint(self.paint_pixmap)
-            self.painter.drawLine(self.start_drag_image, current_point)
-            self.painter.end()
-            self.pixmap = self.paint_pixmap
+            current_point = QPoint(int(self.scene_pos.x()), int(self.scene_pos.y()))
+            self.line_preview.setLine(QLineF(self.start_drag_image, current_point))
+            self.dirty_rect = self.line_dirty_rect(self.start_drag_image, current_point)
 
         elif self.drawing_rect:
-            current_point = QPoint(self.scene_pos.x(), self.scene_pos.y())
-            self.rect = QRect(self.start_drag_image, current_point)
-            self.pixmap = self.const_pixmap.copy()
-            self.paint_pixmap = self.const_pixmap.copy()
-            self.init_rect_paint(self.paint_pixmap)
-            self.painter.drawRect(self.rect)
-            self.painter.end()
-            self.pixmap = self.paint_pixmap
+            current_point = QPoint(int(self.scene_pos.x()), int(self.scene_pos.y()))
+            self.rect = QRect(self.start_drag_image, current_point).normalized()
+            self.rect_preview.setRect(QRectF(self.rect))
+            self.dirty_rect = self.rect.adjusted(-1, -1, 1, 1)
 
     def mouseReleaseEvent(self, event: QMouseEvent) -> None:
         QGraphicsView.mouseReleaseEvent(self, event)
@@ -421,37 +615,44 @@ class ImageView(QGraphicsView):
             self.rubberBand = None
 
         elif self.cropBand is not None:
-            self.angle = 0
-            self.cropBand.hide()
-            roi_width = self.cursor_image_x - self.start_drag_image.x()
-            roi_height = self.cursor_image_y - self.start_drag_image.y()
-            roi_rect = QRect(self.start_drag_image.x(), self.start_drag_image.y(), roi_width, roi_height)
-            self.pixmap = self.pixmap.copy(roi_rect)
-            self.latest_pixmap = self.pixmap
-            self.add_routine_cull_history((Routine.CROP.value, self.latest_pixmap, 0))
-            self.cropBand = None
-            self.reset_view()
+            with instrumentation.span('crop'):
+                self.angle = 0
+                self.cropBand.hide()
+                roi_width = self.cursor_image_x - self.start_drag_image.x()
+                roi_height = self.cursor_image_y - self.start_drag_image.y()
+                roi_rect = QRect(self.start_drag_image.x(), self.start_drag_image.y(), roi_width, roi_height)
+                self.raster = self.raster.copy(roi_rect)
+                self.latest_raster = self.raster
+                self.add_routine_cull_history(HistoryEntry.keyframe(Routine.CROP.value, self.latest_raster, 0))
+                self.cropBand = None
+                self.reset_view()
 
         elif self.panning:
             self.panning = False
 
         elif self.drawing_brush:
             logger.debug("Paint brush ended")
-            self.drawing_brush = False
-            self.painter.end()
-            self.add_routine_cull_history((Routine.PAINT_BRUSH.value, self.paint_pixmap, self.angle))
-            # self.latest_pixmap = self.paint_pixmap
+            with instrumentation.span('paint_brush'):
+                self.drawing_brush = False
+                rect, before, after = self.brush_stroke.finish()
+                self.brush_stroke = None
+                if not rect.isEmpty():
+                    self.add_routine_cull_history(HistoryEntry.patch(Routine.PAINT_BRUSH.value, self.angle,
+                                                                     rect, before, after))
 
         elif self.drawing_line:
             logger.debug("Paint line ended")
-            self.drawing_line = False
-            self.add_routine_cull_history((Routine.PAINT_LINE.value, self.paint_pixmap, self.angle))
+            with instrumentation.span('paint_line'):
+                self.drawing_line = False
+                self.line_preview.hide()
+                self.commit_preview(Routine.PAINT_LINE.value)
 
         elif self.drawing_rect:
             logger.debug("Paint rect ended")
-            self.drawing_rect = False
-            self.add_routine_cull_history((Routine.PAINT_RECT.value, self.paint_pixmap, self.angle))
-            # self.latest_pixmap = self.paint_pixmap
+            with instrumentation.span('paint_rect'):
+                self.drawing_rect = False
+                self.rect_preview.hide()
+                self.commit_preview(Routine.PAINT_RECT.value)
 
     def wheelEvent(self, event: QWheelEvent) -> None:
         dy = event.angleDelta().y()
@@ -461,12 +662,32 @@ class ImageView(QGraphicsView):
             sign = 1 if dy >= 0 else -1
             self.zoomROITo(scene_pos, sign)
 
+    @property
+    def history_current_idx(self) -> int:
+        ''' index of history entry shown, it is recorded in journal of history '''
+        return self._history_current_idx
+
+    @history_current_idx.setter
+    def history_current_idx(self, idx) -> None:
+        self._history_current_idx = idx
+        self.history.mark_current(idx)
+
+    def recover_history(self, entries, current_idx) -> None:
+        ''' replaces history by entries replayed from journal and shows the map after current_idx '''
+        self.history.entries = entries
+        self.history_current_idx = current_idx
+        self.history_current_idx -= self.history.evict(current_idx)
+        self.execute_latest_history(self.history_current_idx + 1)
+        self.populate_history_table()
+        self.reset_view()
+
     def add_routine_cull_history(self, added_routine) -> None:
         ''' prevents branching of history, when you Undo and make new, you cannot return '''
         logger.debug("Add and cull history")
         self.history_current_idx += 1
-        self.history = self.history[:self.history_current_idx]
+        self.history.truncate(self.history_current_idx)
         self.history.append(added_routine)
+        self.history_current_idx -= self.history.evict(self.history_current_idx)
         self.populate_history_table()
 
     def populate_history_table(self):
@@ -475,16 +696,17 @@ class ImageView(QGraphicsView):
         self.main_widget.left_menu.history_table.populate()
 
     def angle_rotate(self, angle) -> None:
-        self.delete_all_waypoints()
-        self.angle %= 360
-        self.pixmap = rotation(self.latest_pixmap, angle)
-        self.main_widget.paint_menu.angle_box.angle_entry.setText(str(self.angle))
+        with instrumentation.span('angle', angle=angle):
+            self.delete_all_waypoints()
+            self.angle %= 360
+            self.show_rotated(angle)
+            self.main_widget.paint_menu.angle_box.angle_entry.setText(str(self.angle))
         # self.reset_view()
 
     def undo_redo_disable_transformations(self, current_history):
         ''' enabling and disabling transformations after undo/redo '''
-        for event in current_history:  
-            event_type = event[0]
+        for event in current_history:
+            event_type = event.routine
             if event_type not in (Routine.LOAD.value, Routine.ANGLE.value, Routine.CROP.value):
                 self.disable_transformations(True)
                 break
@@ -492,62 +714,67 @@ class ImageView(QGraphicsView):
             self.disable_transformations(False)
 
     def execute_latest_history(self, history_current_idx):
-        ''' goes through the stack of routines in history and executes them in order '''
+        ''' shows the map as it was after history entry on index history_current_idx - 1
+        rebuilt from the closest keyframe and the patches following it '''
         current_history = self.history[:history_current_idx]
         self.undo_redo_disable_transformations(current_history)
-        for history_idx, last_history_event in enumerate(reversed(current_history)):
-            history_event_routine = last_history_event[0]
-            history_event_pixmap = last_history_event[1]
-            history_event_angle = last_history_event[2]
-            if history_event_routine != Routine.ANGLE.value:
-                previous_pixmap = history_event_pixmap
-                self.latest_pixmap = previous_pixmap
-                routines = current_history[len(current_history) - history_idx:]
-                if routines:
-                    previous_angle = routines[-1][2]
-                    self.angle = previous_angle
-                    previous_pixmap = rotation(previous_pixmap, previous_angle)
-                else:
-                    # no routines means the last is pixmap
-                    self.angle = 0
-
-                self.main_widget.paint_menu.angle_box.angle_entry.setText(str(self.angle))
-                self.pixmap = previous_pixmap
-                # self.reset_view()
-                break
+        raster, self.latest_raster, self.angle = self.history.restore(max(history_current_idx - 1, 0))
+        if raster is None:
+            self.show_rotated(self.angle)
+        else:
+            self.raster = raster
+        self.main_widget.paint_menu.angle_box.angle_entry.setText(str(self.angle))
 
     def undo(self):
-        if self.history_current_idx >= 1:
-            self.execute_latest_history(self.history_current_idx)
-            self.history_current_idx -= 1
-        else:
-            # WARNING: Already at the oldest change
-            logger.info("Already at the oldest change")
-        self.populate_history_table()
+        if self.is_busy():
+            return
+        with instrumentation.span('undo'):
+            if self.history_current_idx >= 1:
+                history_event = self.history[self.history_current_idx]
+                if not history_event.is_patch:
+                    self.execute_latest_history(self.history_current_idx)
+                else:
+                    # patch is reverted in place, nothing else has to be rebuilt
+                    self.undo_redo_disable_transformations(self.history[:self.history_current_idx])
+                    self.commit_rotation()
+                    self.graphics_pixmap.paste(history_event.before.rect.topLeft(), history_event.before.array())
+                    self.angle = self.history[self.history_current_idx - 1].angle
+                    self.main_widget.paint_menu.angle_box.angle_entry.setText(str(self.angle))
+                self.history_current_idx -= 1
+            else:
+                # WARNING: Already at the oldest change
+                logger.info("Already at the oldest change")
+            self.populate_history_table()
 
     def redo(self):
-        redo_index = self.history_current_idx + 1
-        current_history = self.history[:redo_index + 1]
-        self.undo_redo_disable_transformations(current_history)
-        if redo_index < len(self.history):
-            last_history_event = self.history[redo_index]
-            history_event_routine = last_history_event[0]
-            history_event_pixmap = last_history_event[1]
-            history_event_angle = last_history_event[2]
-
-            if history_event_routine == Routine.ANGLE.value:
-                self.pixmap = rotation(self.latest_pixmap, history_event_angle)
-            else:
-                self.latest_pixmap = history_event_pixmap
-                self.pixmap = self.latest_pixmap
+        if self.is_busy():
+            return
+        with instrumentation.span('redo'):
+            redo_index = self.history_current_idx + 1
+            current_history = self.history[:redo_index + 1]
+            self.undo_redo_disable_transformations(current_history)
+            if redo_index < len(self.history):
+                last_history_event = self.history[redo_index]
+                history_event_routine = last_history_event.routine
+                history_event_angle = last_history_event.angle
+
+                if last_history_event.is_keyframe:
+                    self.raster = last_history_event.raster.copy()
+                    self.latest_raster = self.raster
+                elif history_event_routine == Routine.ANGLE.value:
+                    self.show_rotated(history_event_angle)
+                else:
+                    self.commit_rotation()
+                    after = last_history_event.after
+                    self.graphics_pixmap.paste(after.rect.topLeft(), after.array())
 
-            self.angle = history_event_angle
-            self.history_current_idx += 1
-        else:
-            # WARNING: Already at the newest change
-            logger.info("Already at the newest change")
-        self.populate_history_table()
-        # self.reset_view()
+                self.angle = history_event_angle
+                self.history_current_idx += 1
+            else:
+                # WARNING: Already at the newest change
+                logger.info("Already at the newest change")
+            self.populate_history_table()
+            # self.reset_view()
 
     def keyPressEvent(self, event: QKeyEvent) -> None:
         if event.matches(QKeySequence.Undo):
@@ -558,12 +785,15 @@ class ImageView(QGraphicsView):
         elif event.key() == Qt.Key_G:
             self.grayscale_canvas()
 
+        elif event.key() == Qt.Key_Escape:
+            self.main_widget.jobs.cancel_all(keep=('save',))
+
         # rotation
-        elif self.rotating_allowed and (event.key() == Qt.Key_1):  # clockwise rotation
+        elif self.rotating_allowed and not self.map_busy and (event.key() == Qt.Key_1):  # clockwise rotation
             self.angle -= self.rotating_speed
             self.angle_rotate(self.angle)
 
-        elif self.rotating_allowed and (event.key() == Qt.Key_2):  # counter clockwise rotation
+        elif self.rotating_allowed and not self.map_busy and (event.key() == Qt.Key_2):  # counter clockwise
             self.angle += self.rotating_speed
             self.angle_rotate(self.angle)
 
@@ -591,13 +821,10 @@ class ImageView(QGraphicsView):
         elif event.key() == Qt.Key_F:
             self.pan_speed -= self.pan_acceleration
 
-        elif event.key() == Qt.Key_H:
-            Waypoint.sort_waypoints_by_id()
-
     def keyReleaseEvent(self, event: QKeyEvent) -> None:
-        if (event.key() == Qt.Key_1 and not event.isAutoRepeat()) or (
-                event.key() == Qt.Key_2 and not event.isAutoRepeat()):
-            self.add_routine_cull_history((Routine.ANGLE.value, self.pixmap, self.angle))
+        if self.rotating_allowed and not self.map_busy and ((event.key() == Qt.Key_1 and not event.isAutoRepeat()) or (
+                event.key() == Qt.Key_2 and not event.isAutoRepeat())):
+            self.add_routine_cull_history(HistoryEntry.rotation(Routine.ANGLE.value, self.angle))
 
     def showEvent(self, event: QShowEvent) -> None:
         QGraphicsView.showEvent(self, event)
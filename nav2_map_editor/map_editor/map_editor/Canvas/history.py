@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+# External lib
+import numpy as np
+
+# PyQT
+from PyQt5.QtGui import QImage
+from PyQt5.QtCore import QRect
+
+# Python
+import logging
+import zlib
+from itertools import count
+
+# Source files
+from map_editor.Helpers.helpers import Routine, cached_rotation, raster_rotation
+from map_editor.Helpers.raster import image_view, raster_channels
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import history_memory_budget, history_compression_level
+
+logger = logging.getLogger("map_editor")
+
+_entry_ids = count()
+
+
+class Patch:
+    '''
+    Pixels of rectangular region of the map
+    - stored as raw bytes of MapRaster region, zlib compressed if compression_level > 0
+    - once written to journal, bytes can be dropped from memory by spill(), they are read back when needed
+    '''
+    def __init__(self, array, rect, compression_level=history_compression_level):
+        self.rect = QRect(rect)
+        self.compressed = compression_level > 0
+        data = np.ascontiguousarray(array).data
+        self._data = zlib.compress(data, compression_level) if self.compressed else bytes(data)
+        self.journal = None
+        self.location = None  # (offset, length) in journal
+
+    @classmethod
+    def stored(cls, journal, offset, length, rect, compressed):
+        ''' patch, whose bytes are only in journal '''
+        patch = cls.__new__(cls)
+        patch.rect = QRect(*rect)
+        patch.compressed = bool(compressed)
+        patch._data = None
+        patch.journal, patch.location = journal, (offset, length)
+        return patch
+
+    def store(self, journal, offset, length) -> None:
+        ''' called by journal, when bytes of the patch are written at offset '''
+        self.journal, self.location = journal, (offset, length)
+
+    def spill(self) -> bool:
+        ''' drops bytes from memory, if they are in journal '''
+        if self.location is None or self._data is None:
+            return False
+        self._data = None
+        return True
+
+    @property
+    def data(self) -> bytes:
+        data = self._data  # read once, thumbnail job may read the patch, while it is spilled
+        if data is not None:
+            return data
+        return self.journal.read(*self.location)
+
+    @property
+    def nbytes(self) -> int:
+        ''' bytes held in memory '''
+        return 0 if self._data is None else len(self._data)
+
+    def array(self) -> np.ndarray:
+        data = zlib.decompress(self.data) if self.compressed else self.data
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.rect.height(), self.rect.width(), raster_channels)
+
+    def image(self) -> QImage:
+        array = self.array().copy()  # has to outlive its view, copy() detaches the image from it
+        return image_view(array).copy()
+
+    def paint_on(self, raster) -> None:
+        ''' replaces pixels of the region, in place '''
+        raster.paste(self.rect.topLeft(), self.array())
+
+
+def reconstruct(recipe, copy=True):
+    '''
+    MapRaster of History.recipe(), keyframe and patches are only read, so it can be built by background job
+    keyframe raster itself is returned, when there is nothing to apply and copy is False, it must not be painted on
+    '''
+    raster, steps = recipe
+    owned = False
+    for angle, patches in steps:
+        if angle is not None:
+            raster, owned = cached_rotation(raster, angle), False
+        if patches and not owned:
+            raster, owned = raster.copy(), True
+        for patch in patches:
+            patch.paint_on(raster)
+    return raster.copy() if copy and not owned else raster
+
+
+class HistoryEntry:
+    '''
+    Single routine done by user
+    - keyframe (LOAD, CROP) holds copy of whole MapRaster, as shown after the routine
+    - rotation (ANGLE) holds only the angle, map is resampled from the preceding one when needed
+    - patch (PAINT_BRUSH, PAINT_LINE, PAINT_RECT, GRAY) holds only the changed region,
+      before and after the routine, so it can be applied in both directions
+    '''
+    def __init__(self, routine, angle, raster=None, before=None, after=None):
+        self.uid = next(_entry_ids)  # identifies entry in history table, indices shift on eviction
+        self.journal_id = None  # identifies entry in journal
+        self.routine = routine
+        self.angle = angle
+        self.raster = raster
+        self.before = before
+        self.after = after
+
+    @classmethod
+    def keyframe(cls, routine, raster, angle):
+        return cls(routine, angle, raster=raster.copy())
+
+    @classmethod
+    def rotation(cls, routine, angle):
+        return cls(routine, angle)
+
+    @classmethod
+    def patch(cls, routine, angle, rect, before, after):
+        ''' before and after are arrays of MapRaster layout, of the size of rect '''
+        return cls(routine, angle, before=Patch(before, rect), after=Patch(after, rect))
+
+    @property
+    def is_keyframe(self) -> bool:
+        return self.raster is not None
+
+    @property
+    def is_patch(self) -> bool:
+        return self.before is not None
+
+    @property
+    def nbytes(self) -> int:
+        if self.is_keyframe:
+            return self.raster.nbytes
+        if self.is_patch:
+            return self.before.nbytes + self.after.nbytes
+        return 0
+
+
+class History:
+    '''
+    List of HistoryEntry, first entry is always keyframe
+    - when memory_budget (bytes) is exceeded, the oldest patches already written to journal are dropped
+      from memory, only if it is not enough (or there is no journal), the oldest patches are folded
+      into the oldest keyframe, so the oldest changes cannot be undone anymore
+    - with journal, every change of entries is recorded in it, so history can be replayed after crash
+    '''
+    def __init__(self, memory_budget=history_memory_budget):
+        self.entries = []
+        self.memory_budget = memory_budget
+        self.journal = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        return self.entries[idx]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def append(self, entry) -> None:
+        self.entries.append(entry)
+        if self.journal is not None:
+            self.journal.append(entry)
+
+    def truncate(self, length) -> None:
+        if self.journal is not None and length < len(self.entries):
+            self.journal.truncate(self.entries[length - 1] if length else None)
+        del self.entries[length:]
+
+    def mark_current(self, idx) -> None:
+        ''' entry shown to user, recorded in journal, so it is shown again after recovery '''
+        if self.journal is not None and 0 <= idx < len(self.entries):
+            self.journal.current(self.entries[idx])
+
+    def spill(self) -> int:
+        ''' drops patches written to journal from memory, the oldest first, until history fits into budget '''
+        spilled, nbytes = 0, self.nbytes
+        for entry in self.entries:
+            if nbytes <= self.memory_budget:
+                break
+            if entry.is_patch:
+                entry_nbytes = entry.nbytes
+                spilled += entry.before.spill() + entry.after.spill()
+                nbytes -= entry_nbytes - entry.nbytes
+        if spilled:
+            logger.debug("History spilled %d patches to journal" % spilled)
+        return spilled
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.nbytes for entry in self.entries)
+
+    def evict(self, current_idx) -> int:
+        ''' drops the oldest entries until history fits into budget, returns count of dropped entries
+        entry on current_idx is always kept '''
+        self.spill()
+        dropped = 0
+        while current_idx - dropped >= 1 and self.nbytes > self.memory_budget:
+            head, following = self.entries[0], self.entries[1]
+            if following.routine == Routine.ANGLE.value and not following.is_keyframe:
+                # rotation is computed from its predecessor
+                if current_idx - dropped < 2:
+                    break
+                if self.entries[2].is_patch:
+                    # patches were painted on resampled map, it becomes the new keyframe
+                    following.raster = raster_rotation(head.raster, following.angle)
+                    del self.entries[0]
+                else:
+                    del self.entries[1]
+            else:
+                if not following.is_keyframe:
+                    # keyframes are never painted on, journal and thumbnail jobs may be reading them
+                    folded = head.raster.copy()
+                    following.after.paint_on(folded)
+                    following.raster, following.before, following.after = folded, None, None
+                del self.entries[0]
+            dropped += 1
+        if dropped:
+            logger.debug("History evicted %d entries" % dropped)
+        return dropped
+
+    def _base_idx(self, idx) -> int:
+        ''' index of the last entry before the rotations ending at idx '''
+        while idx > 0 and not self.entries[idx].is_keyframe and not self.entries[idx].is_patch:
+            idx -= 1
+        return idx
+
+    def recipe(self, idx):
+        '''
+        (keyframe raster, steps) of the map after entry idx, for reconstruct()
+        every step is (angle of rotation, or None for the keyframe, patches following it)
+        '''
+        steps = []
+        while True:
+            start_idx = idx
+            while self.entries[start_idx].is_patch:
+                start_idx -= 1
+            start = self.entries[start_idx]
+            patches = [entry.after for entry in self.entries[start_idx + 1:idx + 1]]
+            if start.is_keyframe:
+                steps.append((None, patches))
+                return start.raster, steps[::-1]
+            steps.append((start.angle, patches))
+            idx = self._base_idx(start_idx)
+
+    def _reconstruct(self, idx):
+        ''' new MapRaster after entry idx, from the closest keyframe or rotation and patches following it '''
+        return reconstruct(self.recipe(idx))
+
+    def base(self, idx):
+        ''' unrotated MapRaster, which rotation on idx is applied to '''
+        return self._reconstruct(self._base_idx(idx))
+
+    def base_recipe(self, idx):
+        ''' recipe() of base(), only references to entries, the map is built by reconstruct() in background '''
+        return self.recipe(self._base_idx(idx))
+
+    def restore(self, idx):
+        ''' returns (shown raster, unrotated raster, angle) after entry idx
+        shown raster is None for rotation, it is left for the view to rotate unrotated raster '''
+        entry = self.entries[idx]
+        if entry.is_keyframe or entry.is_patch:
+            raster = self._reconstruct(idx)
+            return raster, raster, entry.angle
+        return None, self.base(idx), entry.angle
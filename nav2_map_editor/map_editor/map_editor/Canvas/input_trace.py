@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+'''
+Trace of user input on the canvas, recorded in the editor and replayed offscreen by map_editor_replay
+- trace is JSON lines, the first is header with view of the map, every other is record with time in s
+- mouse and wheel events of the viewport, key events and viewport resizes of the canvas are recorded,
+  positions are in viewport coordinates, the same as event.pos() of canvas handlers
+- undo/redo shortcuts are taken by the Edit menu before the canvas sees the key, their override is recorded
+- painting tools are chosen outside of the canvas, their state is recorded, whenever it changed before a press
+- loaded map is recorded too, so the replay edits the same map
+'''
+
+# PyQT
+from PyQt5.QtGui import QColor, QKeyEvent, QKeySequence, QMouseEvent, QTransform, QWheelEvent
+from PyQt5.QtCore import QEvent, QObject, QPoint, QPointF
+from PyQt5.QtCore import Qt
+
+# Python
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("map_editor")
+
+trace_version = 1
+
+mouse_types = {
+    QEvent.MouseButtonPress: 'mouse_press',
+    QEvent.MouseButtonRelease: 'mouse_release',
+    QEvent.MouseButtonDblClick: 'mouse_double_click',
+    QEvent.MouseMove: 'mouse_move',
+}
+key_types = {
+    QEvent.KeyPress: 'key_press',
+    QEvent.KeyRelease: 'key_release',
+}
+event_types = {name: event_type for event_type, name in list(mouse_types.items()) + list(key_types.items())}
+
+# canvas attributes set by Paint and Waypoint menus, they decide what a press does
+tool_attributes = ('brushReady', 'paint_lineReady', 'paint_rectReady', 'zooming_activated', 'cropping_activated',
+                   'adding_waypoint', 'brushSize', 'rotating_speed', 'pan_speed')
+
+
+def tool_state(canvas) -> dict:
+    state = {name: getattr(canvas, name) for name in tool_attributes}
+    state['paintColor'] = QColor(canvas.paintColor).getRgb()
+    return state
+
+
+def apply_tool_state(canvas, state) -> None:
+    for name in tool_attributes:
+        if name in state:
+            setattr(canvas, name, state[name])
+    if 'paintColor' in state:
+        canvas.paintColor = QColor(*state['paintColor'])
+
+
+def is_undo_redo(event) -> bool:
+    return event.matches(QKeySequence.Undo) or event.matches(QKeySequence.Redo)
+
+
+def view_state(canvas) -> dict:
+    ''' transform and center of the view, so replayed positions hit the same map pixels '''
+    transform = canvas.transform()
+    center = canvas.mapToScene(canvas.viewport().rect().center())
+    return {'transform': [transform.m11(), transform.m12(), transform.m13(),
+                          transform.m21(), transform.m22(), transform.m23(),
+                          transform.m31(), transform.m32(), transform.m33()],
+            'center': [center.x(), center.y()],
+            'angle': canvas.angle}
+
+
+def apply_view_state(canvas, view) -> None:
+    canvas.setTransform(QTransform(*view['transform']))
+    canvas.centerOn(QPointF(*view['center']))
+
+
+class InputRecorder(QObject):
+    '''
+    Event filter of the canvas and its viewport, writes every input event into trace file
+    events are only observed, they are delivered to the canvas as if there was no recorder
+    '''
+    def __init__(self, canvas, path):
+        QObject.__init__(self, canvas)
+        self.canvas = canvas
+        self.path = path
+        self.file = open(path, 'w')
+        self.started = time.perf_counter()
+        self.state = None
+        self.overridden = None  # undo/redo key recorded from ShortcutOverride, its KeyPress is not recorded again
+        viewport = canvas.viewport()
+        self._write({'type': 'header', 'version': trace_version,
+                     'viewport': [viewport.width(), viewport.height()], 'view': view_state(canvas)})
+        self.record_state()
+        canvas.installEventFilter(self)
+        viewport.installEventFilter(self)
+        logger.info("Recording input trace: " + path)
+
+    def _write(self, record) -> None:
+        self.file.write(json.dumps(record) + '\n')
+
+    def record(self, record) -> None:
+        record['t'] = round(time.perf_counter() - self.started, 6)
+        self._write(record)
+
+    def record_state(self) -> None:
+        state = tool_state(self.canvas)
+        if state != self.state:
+            self.state = state
+            self.record({'type': 'state', 'state': state})
+
+    def record_map(self, path) -> None:
+        ''' map loaded from path, with the view fitted to it '''
+        self.record({'type': 'map', 'path': os.path.abspath(path), 'view': view_state(self.canvas)})
+
+    def stop(self) -> None:
+        self.canvas.removeEventFilter(self)
+        self.canvas.viewport().removeEventFilter(self)
+        self.file.close()
+        logger.info("Input trace recorded: " + self.path)
+
+    def eventFilter(self, watched, event) -> bool:
+        event_type = event.type()
+        if watched is self.canvas.viewport():
+            if event_type in mouse_types:
+                if event_type in (QEvent.MouseButtonPress, QEvent.MouseButtonDblClick):
+                    self.record_state()
+                self.record({'type': mouse_types[event_type], 'pos': [event.pos().x(), event.pos().y()],
+                             'button': int(event.button()), 'buttons': int(event.buttons()),
+                             'modifiers': int(event.modifiers())})
+            elif event_type == QEvent.Wheel:
+                self.record({'type': 'wheel', 'pos': [event.pos().x(), event.pos().y()],
+                             'delta': [event.angleDelta().x(), event.angleDelta().y()],
+                             'buttons': int(event.buttons()), 'modifiers': int(event.modifiers())})
+            elif event_type == QEvent.Resize:
+                self.record({'type': 'resize', 'size': [event.size().width(), event.size().height()]})
+        elif watched is self.canvas:
+            if event_type == QEvent.ShortcutOverride and is_undo_redo(event):
+                self.overridden = (event.key(), int(event.modifiers()))
+                self._record_key('key_press', event)
+            elif event_type in key_types:
+                if event_type == QEvent.KeyPress:
+                    if self.overridden == (event.key(), int(event.modifiers())):
+                        self.overridden = None
+                        return False
+                    self.record_state()
+                self._record_key(key_types[event_type], event)
+        return False
+
+    def _record_key(self, name, event) -> None:
+        self.record({'type': name, 'key': event.key(), 'modifiers': int(event.modifiers()),
+                     'text': event.text(), 'auto_repeat': event.isAutoRepeat()})
+
+
+def read_trace(path):
+    ''' (header, records) of trace file '''
+    with open(path) as file:
+        lines = [json.loads(line) for line in file if line.strip()]
+    if not lines or lines[0].get('type') != 'header' or lines[0].get('version') != trace_version:
+        raise ValueError("Not an input trace: " + path)
+    return lines[0], lines[1:]
+
+
+def input_event(record):
+    ''' Qt event of mouse, wheel or key record, None for other records '''
+    kind = record['type']
+    if kind in mouse_types.values():
+        return QMouseEvent(event_types[kind], QPointF(*record['pos']), Qt.MouseButton(record['button']),
+                           Qt.MouseButtons(record['buttons']), Qt.KeyboardModifiers(record['modifiers']))
+    if kind == 'wheel':
+        pos = QPointF(*record['pos'])
+        return QWheelEvent(pos, pos, QPoint(), QPoint(*record['delta']), Qt.MouseButtons(record['buttons']),
+                           Qt.KeyboardModifiers(record['modifiers']), Qt.NoScrollPhase, False)
+    if kind in key_types.values():
+        return QKeyEvent(event_types[kind], record['key'], Qt.KeyboardModifiers(record['modifiers']),
+                         record['text'], record['auto_repeat'])
+    return None
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+'''
+Append-only journal of history, crash recovery and storage of patches evicted from memory
+- every appended HistoryEntry is written as record with its routine, angle and pixels (keyframe or patches),
+  truncation of history and the current entry are small records referring to entries by journal id
+- records are written by single background thread, the GUI thread only queues them
+- record is kind, payload length, crc32 and payload, torn record at the end of crashed journal is ignored
+- journal of running editor is locked, journal which can be locked was left by crashed editor
+- patches, which are written, can be dropped from memory, they are read back from the journal when needed
+'''
+
+# External lib
+import numpy as np
+
+# Python
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl  # journals are locked only where flock() exists, elsewhere they are never recovered
+except ImportError:
+    fcntl = None
+
+# Source files
+from map_editor.Helpers.helpers import app_cache_directory
+from map_editor.Helpers.raster import MapRaster, raster_channels
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import history_compression_level
+
+logger = logging.getLogger("map_editor")
+
+journal_magic = b'NAV2MEJ1'
+journal_extension = '.journal'
+
+RECORD_ENTRY, RECORD_TRUNCATE, RECORD_CURRENT = 1, 2, 3
+ENTRY_ROTATION, ENTRY_KEYFRAME, ENTRY_PATCH = 0, 1, 2
+
+_record_header = struct.Struct('<BII')  # kind, payload length, crc32 of payload
+_entry_header = struct.Struct('<QBdB')  # journal id, routine, angle, entry kind
+_keyframe_header = struct.Struct('<IIB')  # width, height, compressed
+_patch_header = struct.Struct('<iiiiBI')  # x, y, width, height, compressed, length of before data
+_id = struct.Struct('<q')
+
+
+def journal_directory() -> str:
+    return app_cache_directory('journal')
+
+
+def _lock(file) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def orphan_journals(directory=None) -> list:
+    ''' paths of journals left by crashed editors, the newest last '''
+    directory = journal_directory() if directory is None else directory
+    if fcntl is None or not os.path.isdir(directory):
+        return []
+    orphans = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.endswith(journal_extension):
+            continue
+        with open(path, 'rb') as file:
+            if _lock(file):  # unlocked when closed
+                orphans.append(path)
+    return sorted(orphans, key=os.path.getmtime)
+
+
+def _angle(value):
+    return int(value) if float(value).is_integer() else value
+
+
+class Journal:
+    '''
+    Journal of one editing session, History calls append(), truncate() and current()
+    '''
+    def __init__(self, path, file, next_id=0):
+        self.path = path
+        self.file = file  # unbuffered, so written records survive crash of the editor
+        self.reader = open(path, 'rb')
+        self.read_lock = threading.Lock()
+        self.next_id = next_id
+        self.current_id = None
+        self.queue = queue.Queue()
+        self.error = None
+        self.writer = threading.Thread(target=self._write_records, name='journal', daemon=True)
+        self.writer.start()
+
+    @classmethod
+    def create(cls, directory=None):
+        directory = journal_directory() if directory is None else directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '%d-%d%s' % (time.time(), os.getpid(), journal_extension))
+        file = open(path, 'xb', buffering=0)
+        _lock(file)
+        file.write(journal_magic)
+        logger.debug("Journal created: " + path)
+        return cls(path, file)
+
+    # GUI thread
+
+    def append(self, entry) -> None:
+        entry.journal_id = self.next_id
+        self.next_id += 1
+        self.queue.put((RECORD_ENTRY, entry))
+
+    def truncate(self, last_entry) -> None:
+        ''' entries after last_entry are dropped, all of them if it is None '''
+        self.queue.put((RECORD_TRUNCATE, -1 if last_entry is None else last_entry.journal_id))
+
+    def current(self, entry) -> None:
+        if entry.journal_id != self.current_id:
+            self.current_id = entry.journal_id
+            self.queue.put((RECORD_CURRENT, entry.journal_id))
+
+    def wait(self) -> None:
+        ''' blocks until all queued records are written '''
+        self.queue.join()
+
+    def close(self, remove=True) -> None:
+        self.queue.put(None)
+        self.writer.join()
+        self.file.close()
+        self.reader.close()
+        if remove:
+            os.remove(self.path)
+            logger.debug("Journal removed: " + self.path)
+
+    # any thread
+
+    def read(self, offset, length) -> bytes:
+        with self.read_lock:
+            self.reader.seek(offset)
+            return self.reader.read(length)
+
+    # writer thread
+
+    def _write_records(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self._write_record(*item)
+            except OSError as error:
+                self.error = error  # editing goes on, only without journal
+                logger.error("Journal write failed: " + str(error))
+            finally:
+                self.queue.task_done()
+
+    def _write_record(self, kind, value) -> None:
+        if kind != RECORD_ENTRY:
+            payload = _id.pack(value)
+            self.file.write(_record_header.pack(kind, len(payload), zlib.crc32(payload)) + payload)
+            return
+        entry = value
+        if entry.is_keyframe:
+            data = entry.raster.array.data
+            compressed = history_compression_level > 0
+            body = [_keyframe_header.pack(entry.raster.width(), entry.raster.height(), compressed),
+                    zlib.compress(data, history_compression_level) if compressed else data]
+            entry_kind = ENTRY_KEYFRAME
+        elif entry.is_patch:
+            rect = entry.before.rect
+            before, after = entry.before.data, entry.after.data
+            body = [_patch_header.pack(rect.x(), rect.y(), rect.width(), rect.height(), entry.before.compressed,
+                                       len(before)), before, after]
+            entry_kind = ENTRY_PATCH
+        else:
+            body = []
+            entry_kind = ENTRY_ROTATION
+        parts = [_entry_header.pack(entry.journal_id, entry.routine, entry.angle, entry_kind)] + body
+        length = sum(len(part) for part in parts)
+        crc = 0
+        for part in parts:
+            crc = zlib.crc32(part, crc)
+        offset = self.file.tell() + _record_header.size
+        self.file.write(_record_header.pack(RECORD_ENTRY, length, crc))
+        for part in parts:
+            self.file.write(part)
+        if entry_kind == ENTRY_PATCH:
+            # patch data is written, from now on it can be dropped from memory
+            before_offset = offset + _entry_header.size + _patch_header.size
+            entry.before.store(self, before_offset, len(before))
+            entry.after.store(self, before_offset + len(before), len(after))
+
+    # recovery
+
+    @classmethod
+    def recover(cls, path):
+        '''
+        replays journal left by crashed editor, returns (journal, entries, current index)
+        journal is taken over, new records are appended to it, patches are left on disk
+        '''
+        from map_editor.Canvas.history import HistoryEntry, Patch  # history imports journal
+        file = open(path, 'r+b', buffering=0)
+        if not _lock(file) or file.read(len(journal_magic)) != journal_magic:
+            file.close()
+            raise ValueError("Not a recoverable journal: " + path)
+        records = []  # (kind, offset of payload, payload)
+        while True:
+            offset = file.tell()
+            header = file.read(_record_header.size)
+            if len(header) < _record_header.size:
+                break
+            kind, length, crc = _record_header.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append((kind, offset + _record_header.size, payload))
+            offset = file.tell()
+        file.seek(offset)
+        file.truncate()  # torn record of the crash
+        journal = cls(path, file)
+
+        entries, current_id, next_id = [], None, 0
+        for kind, offset, payload in records:
+            if kind == RECORD_TRUNCATE:
+                (last_id,) = _id.unpack(payload)
+                while entries and entries[-1].journal_id != last_id:
+                    entries.pop()
+            elif kind == RECORD_CURRENT:
+                (current_id,) = _id.unpack(payload)
+            elif kind == RECORD_ENTRY:
+                journal_id, routine, angle, entry_kind = _entry_header.unpack_from(payload)
+                body = _entry_header.size
+                if entry_kind == ENTRY_KEYFRAME:
+                    width, height, compressed = _keyframe_header.unpack_from(payload, body)
+                    data = payload[body + _keyframe_header.size:]
+                    data = zlib.decompress(data) if compressed else data
+                    array = np.frombuffer(data, dtype=np.uint8).reshape(height, width, raster_channels)
+                    entry = HistoryEntry(routine, _angle(angle), raster=MapRaster(array.copy()))
+                elif entry_kind == ENTRY_PATCH:
+                    x, y, width, height, compressed, before_length = _patch_header.unpack_from(payload, body)
+                    data_offset = offset + body + _patch_header.size
+                    after_length = len(payload) - body - _patch_header.size - before_length
+                    rect = (x, y, width, height)
+                    entry = HistoryEntry(routine, _angle(angle),
+                                         before=Patch.stored(journal, data_offset, before_length, rect, compressed),
+                                         after=Patch.stored(journal, data_offset + before_length, after_length,
+                                                            rect, compressed))
+                else:
+                    entry = HistoryEntry(routine, _angle(angle))
+                entry.journal_id = journal_id
+                next_id = max(next_id, journal_id + 1)
+                entries.append(entry)
+        journal.next_id = next_id
+        ids = [entry.journal_id for entry in entries]
+        current_idx = ids.index(current_id) if current_id in ids else len(entries) - 1
+        journal.current_id = current_id
+        logger.info("Journal recovered: %d entries from %s" % (len(entries), path))
+        return journal, entries, current_idx
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+# PyQT
+from PyQt5.QtGui import QImage, QPixmap, QPainter
+from PyQt5.QtCore import QRect, QRectF
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+# Python
+import logging
+from collections import OrderedDict
+from math import ceil, floor, log2
+
+# Source files
+from map_editor.Helpers.raster import MapRaster, image_view
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import tile_size, tile_cache_limit
+
+logger = logging.getLogger("map_editor")
+
+
+class TiledPixmapItem(QGraphicsItem):
+    '''
+    Replacement of QGraphicsPixmapItem for huge maps
+    - map is MapRaster, owned by the item, it is converted to QPixmap per tile, only when the tile is shown
+    - raster is split into tile_size x tile_size tiles
+    - level 0 is the original resolution, every next mip-map level halves it
+    - paint() draws only the exposed tiles, from the level that matches the zoom
+    - tiles are created on demand and kept in LRU cache, so pan and zoom cost
+      depends on the viewport size, not on the map size
+    - coarser levels are cut from downsampled arrays, if they were given by setLevels() (map cache),
+      until the raster changes, then they are composed from the finer tiles
+    '''
+
+    def __init__(self, raster=None, parent=None):
+        QGraphicsItem.__init__(self, parent)
+        self._raster = MapRaster.empty(0, 0) if raster is None else raster
+        self._tiles = OrderedDict()  # (level, column, row) -> QPixmap
+        self._levels = []  # arrays of levels 1, 2, ... of the raster
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)  # fills option.exposedRect
+
+    def raster(self) -> MapRaster:
+        ''' shown raster, not a copy, after changing its pixels call invalidate() with the changed region '''
+        return self._raster
+
+    def setRaster(self, raster) -> None:
+        ''' item takes the ownership, raster must not be painted by anyone else '''
+        if raster.size() != self._raster.size():
+            self.prepareGeometryChange()
+        self._raster = raster
+        self.invalidate()
+
+    def setLevels(self, levels) -> None:
+        ''' downsampled arrays of levels 1, 2, ... of the current raster, they are dropped when it changes '''
+        self._levels = list(levels)
+
+    def pixmap(self) -> QPixmap:
+        return self._raster.to_pixmap()
+
+    def paint_device(self) -> QImage:
+        ''' QImage view of the raster for QPainter, after painting on it call invalidate() with the changed region '''
+        return self._raster.image
+
+    def paste(self, point, array) -> None:
+        ''' replaces pixels at point by array, only tiles under the array are dropped '''
+        self._raster.paste(point, array)
+        self.invalidate(QRect(point.x(), point.y(), array.shape[1], array.shape[0]))
+
+    def invalidate(self, rect=None) -> None:
+        ''' drops cached tiles intersecting rect (in image coordinates), all of them if rect is None '''
+        self._raster.touch()
+        self._levels = []
+        if rect is None:
+            self._tiles.clear()
+            self.update()
+            return
+        rect = QRect(rect)
+        for key in [key for key in self._tiles if self._tile_rect(*key).intersects(rect)]:
+            del self._tiles[key]
+        self.update(QRectF(rect))
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, self._raster.width(), self._raster.height())
+
+    @property
+    def max_level(self) -> int:
+        ''' level, at which whole image fits into single tile '''
+        longest_side = max(self._raster.width(), self._raster.height())
+        if longest_side <= tile_size:
+            return 0
+        return ceil(log2(longest_side / tile_size))
+
+    def level_for_scale(self, scale) -> int:
+        ''' scale is count of screen pixels per image pixel '''
+        if scale >= 1:
+            return 0
+        if scale <= 0:
+            return self.max_level
+        return min(floor(log2(1 / scale)), self.max_level)
+
+    def _tile_rect(self, level, column, row) -> QRect:
+        ''' part of the image covered by the tile, in image coordinates '''
+        span = tile_size << level
+        return QRect(column * span, row * span, span, span).intersected(self._raster.rect())
+
+    def _tile(self, level, column, row) -> QPixmap:
+        key = (level, column, row)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        tile_rect = self._tile_rect(level, column, row)
+        if level == 0:
+            tile = QPixmap.fromImage(self._raster.image_region(tile_rect))
+        elif level <= len(self._levels):
+            divider = 1 << level
+            top, left = row * tile_size, column * tile_size
+            region = self._levels[level - 1][top:top + ceil(tile_rect.height() / divider),
+                                             left:left + ceil(tile_rect.width() / divider)]
+            tile = QPixmap.fromImage(image_view(region))
+        else:
+            # tile of coarser level is composed of 4 downscaled tiles of finer level
+            divider = 1 << level
+            tile = QPixmap(ceil(tile_rect.width() / divider), ceil(tile_rect.height() / divider))
+            tile.fill(Qt.transparent)
+            painter = QPainter(tile)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            for child_column in (2 * column, 2 * column + 1):
+                for child_row in (2 * row, 2 * row + 1):
+                    child_rect = self._tile_rect(level - 1, child_column, child_row)
+                    if child_rect.isEmpty():
+                        continue
+                    child = self._tile(level - 1, child_column, child_row)
+                    target = QRectF((child_rect.x() - tile_rect.x()) / divider,
+                                    (child_rect.y() - tile_rect.y()) / divider,
+                                    child_rect.width() / divider,
+                                    child_rect.height() / divider)
+                    painter.drawPixmap(target, child, QRectF(child.rect()))
+            painter.end()
+
+        self._tiles[key] = tile
+        while len(self._tiles) > tile_cache_limit:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def paint(self, painter, option, widget=None) -> None:
+        if self._raster.isNull():
+            return
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.level_for_scale(scale)
+        span = tile_size << level
+        exposed = option.exposedRect.toAlignedRect().intersected(self._raster.rect())
+        if exposed.isEmpty():
+            return
+        for row in range(exposed.top() // span, exposed.bottom() // span + 1):
+            for column in range(exposed.left() // span, exposed.right() // span + 1):
+                tile = self._tile(level, column, row)
+                painter.drawPixmap(QRectF(self._tile_rect(level, column, row)), tile, QRectF(tile.rect()))
@@ -1,11 +1,21 @@
 from PyQt5.QtCore import Qt
-from PyQt5.Qt import QColor
+from PyQt5.QtGui import QColor
 import numpy as np
+from functools import lru_cache
+
+# base colors with precomputed lightness table, not in magic_gui_numbers, which imports colors from here,
+# lru_cache() needs the size while this module is imported, so importing it back would be circular
+lightness_lut_cache_size = 64
 
 red_weight = 0.299
 green_weight = 0.587
 blue_weight = 0.114
 
+# same weights in fixed point, in 1/256, they sum up to 256, so white stays 255
+red_weight_fixed = 77
+green_weight_fixed = 150
+blue_weight_fixed = 29
+
 colors = {
     'Nav2-blue': QColor(20, 88, 134, 255),
     'White': Qt.white,
@@ -23,51 +33,77 @@ def rgb2gray(rgb):
     return np.round(np.dot(rgb[..., :3], [red_weight, green_weight, blue_weight]), 0)
 
 
+def bgra2gray(bgra, chunk_pixels, out=None):
+    '''
+    Integer rgb2gray for MapRaster arrays (channels B, G, R, A), returns (height, width) uint8
+    - (77*R + 150*G + 29*B + 128) >> 8 fits into uint16, no float buffer is allocated
+    - rows are processed in chunks of about chunk_pixels, so temporary buffers stay small
+    '''
+    height, width = bgra.shape[:2]
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+    chunk_rows = max(1, chunk_pixels // max(width, 1))
+    accumulator = np.empty((min(chunk_rows, height), width), dtype=np.uint16)
+    product = np.empty_like(accumulator)
+    for top in range(0, height, chunk_rows):
+        chunk = bgra[top:top + chunk_rows]
+        acc, prod = accumulator[:len(chunk)], product[:len(chunk)]
+        np.multiply(chunk[..., 2], red_weight_fixed, out=acc, dtype=np.uint16)
+        np.multiply(chunk[..., 1], green_weight_fixed, out=prod, dtype=np.uint16)
+        acc += prod
+        np.multiply(chunk[..., 0], blue_weight_fixed, out=prod, dtype=np.uint16)
+        acc += prod
+        acc += 128  # rounding
+        acc >>= 8
+        out[top:top + chunk_rows] = acc
+    return out
+
+
 def single_rgb2gray(rgb):
     if not isinstance(rgb, np.ndarray):
         rgb = np.array(rgb)
     return np.dot(rgb[..., :3], [red_weight, green_weight, blue_weight])
 
 
-def calculate_lightness(rgb):
+def _to_rgb(rgb):
     if isinstance(rgb, QColor):
         rgb = rgb.getRgb()
     elif isinstance(rgb, type(Qt.white)):
         rgb = QColor(rgb).getRgb()
-    rgb = rgb[0], rgb[1], rgb[2]
-    return single_rgb2gray(rgb)
+    return int(rgb[0]), int(rgb[1]), int(rgb[2])
+
+
+def calculate_lightness(rgb):
+    return single_rgb2gray(_to_rgb(rgb))
+
+
+@lru_cache(maxsize=lightness_lut_cache_size)
+def lightness_lut(rgb):
+    '''
+    (256, 3) table, row L is color of lightness L, made by adding the same amount to R, G and B
+    - channels are clipped to 0..255, so lightness is piecewise linear in the added amount
+    - the amount is found by inverting it at breakpoints, where some channel gets clipped
+    - table is computed once per base color, rgb has to be tuple, so it can be cached
+    '''
+    base = np.array(rgb, dtype=float)
+    weights = np.array([red_weight, green_weight, blue_weight])
+    shifts = np.unique(np.concatenate((-base, 255 - base)))
+    shifts = shifts[(shifts >= -base.max()) & (shifts <= 255 - base.min())]
+    shift_lightness = np.clip(base + shifts[:, np.newaxis], 0, 255) @ weights
+    lightness_shifts = np.interp(np.arange(256), shift_lightness, shifts)
+    return np.clip(base + lightness_shifts[:, np.newaxis], 0, 255)
 
 
 def change_lightness(rgb, lightness):
-    tolerance = 0.1
-    m = 0.1  # multiplier step
-    target = lightness
-    if isinstance(rgb, QColor):
-        rgb = rgb.getRgb()
-    elif isinstance(rgb, type(Qt.white)):
-        rgb = QColor(rgb).getRgb()
-    rgb = [rgb[0], rgb[1], rgb[2]]
-    # mr = m * red_weight
-    # mb = m * blue_weight
-    # mg = m * green_weight
-    mr = m
-    mb = m
-    mg = m
-    if calculate_lightness(rgb) < target:
-        while (target - tolerance) > calculate_lightness(rgb) < target:
-            if rgb[0]+mr < 255:
-                rgb[0] += mr
-            if rgb[1]+mb < 255:
-                rgb[1] += mb
-            if rgb[2]+mg < 255:
-                rgb[2] += mg
-    elif calculate_lightness(rgb) > target:
-        while (target + tolerance) < calculate_lightness(rgb) > target:
-            if rgb[0]-mr > 0:
-                rgb[0] -= mr
-            if rgb[1]-mb > 0:
-                rgb[1] -= mb
-            if rgb[2]-mg > 0:
-                rgb[2] -= mg
-    rgb = round(rgb[0]), round(rgb[1]), round(rgb[2])
-    return rgb
+    ''' color of given lightness (0..255) made from rgb, interpolated between two rows of lightness_lut() '''
+    lut = lightness_lut(_to_rgb(rgb))
+    lightness = min(max(lightness, 0), 255)
+    lower = min(int(lightness), 254)
+    fraction = lightness - lower
+    row = lut[lower] * (1 - fraction) + lut[lower + 1] * fraction
+    return round(row[0]), round(row[1]), round(row[2])
+
+
+# palette colors share their tables, so picking speed zone color is single lookup
+for _color in colors.values():
+    lightness_lut(_to_rgb(_color))
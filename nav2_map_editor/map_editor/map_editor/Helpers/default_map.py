@@ -1,4 +1,7 @@
 #!/usr/bin/python3
+'''
+Map shown on start, default_yaml and default_image are loaded on their first use, not on import
+'''
 
 # External lib
 import yaml  # pip pyaml
@@ -18,6 +21,12 @@ def yaml_and_image():
         _default_image.load(correct_image_path(default_image_name))
         return _default_yaml, _default_image
     except FileNotFoundError:
-        pass
+        return None, QImage()
 
-default_yaml, default_image = yaml_and_image()
+
+def __getattr__(name):
+    global default_yaml, default_image
+    if name not in ('default_yaml', 'default_image'):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    default_yaml, default_image = yaml_and_image()  # module attributes from now on, __getattr__ is not called
+    return globals()[name]
@@ -2,18 +2,24 @@
 
 # External lib
 import numpy as np
-import cv2
-import qimage2ndarray
+# cv2 and qimage2ndarray are imported by the functions using them, they are not needed for the window to show
 
 
 # PyQT
 from PyQt5.QtGui import *
-from PyQt5.QtCore import QRect, QPoint
+from PyQt5.QtCore import QRect, QPoint, QStandardPaths
 
 # Python
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from threading import Lock
 from enum import Enum, auto, unique
 
+# Source files
+from map_editor.Helpers.raster import MapRaster, array_view, raster_format
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import rotation_cache_size, app_cache_dir_name
+
 
 def correct_image_path(image_name):
     import os
@@ -22,6 +28,12 @@ def correct_image_path(image_name):
     return os.path.join(_, 'Images', image_name)
 
 
+def app_cache_directory(name):
+    ''' directory of the editor in user cache, it is not created here '''
+    import os
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), app_cache_dir_name, name)
+
+
 @unique
 class Routine(Enum):
     '''Each routine represents action by user'''
@@ -105,12 +117,18 @@ def numpyQImage(image):
     return q_image
 
 
+def rotated_size(width, height, degrees):
+    ''' size of bounding box of rotated rectangle, not rounded '''
+    r = np.deg2rad(degrees)
+    return abs(np.sin(r)*height) + abs(np.cos(r)*width), abs(np.sin(r)*width) + abs(np.cos(r)*height)
+
+
 def rotateAndScale(img, degrees_clockwise, scale_factor=1):
+    import cv2
+
     old_y, old_x, _ = img.shape
     rotation_matrix = cv2.getRotationMatrix2D(center=(old_x/2, old_y/2), angle=degrees_clockwise, scale=scale_factor)
-    new_x, new_y = old_x*scale_factor, old_y*scale_factor
-    r = np.deg2rad(degrees_clockwise)
-    new_x, new_y = abs(np.sin(r)*new_y) + abs(np.cos(r)*new_x), abs(np.sin(r)*new_x) + abs(np.cos(r)*new_y)
+    new_x, new_y = rotated_size(old_x*scale_factor, old_y*scale_factor, degrees_clockwise)
     tx, ty = (new_x-old_x)/2, (new_y-old_y)/2
     rotation_matrix[0, 2] += tx
     rotation_matrix[1, 2] += ty
@@ -118,16 +136,48 @@ def rotateAndScale(img, degrees_clockwise, scale_factor=1):
 
 
 def rotation(_pixmap, degrees_clockwise):
-    img = _pixmap.toImage()
-    channels_count = 4
-    buffer_string = img.bits().asstring(img.width() * img.height() * channels_count)
-    buffer_array = np.frombuffer(buffer_string, dtype=np.uint8).reshape((img.height(), img.width(), channels_count))
-    rotated = rotateAndScale(buffer_array, -degrees_clockwise)
+    img = _pixmap.toImage().convertToFormat(raster_format)
+    rotated = rotateAndScale(array_view(img), -degrees_clockwise)
     rotated_q_image = numpyQImage(rotated)
     rotated_pixmap = QPixmap.fromImage(rotated_q_image)
     return rotated_pixmap
 
 
+def raster_rotation(_raster, degrees_clockwise):
+    ''' same as rotation(), warpAffine reads the raster buffer directly and writes the new one '''
+    return MapRaster(rotateAndScale(_raster.array, -degrees_clockwise))
+
+
+_rotation_cache = OrderedDict()  # (MapRaster.cache_key(), angle) -> rotated MapRaster
+_rotation_cache_lock = Lock()  # rotations are prepared by background jobs too
+
+
+def cached_rotation(_raster, degrees_clockwise):
+    '''
+    Same as raster_rotation(), recently used angles are kept in small LRU cache
+    cache_key() changes whenever raster is modified, so cached result cannot be stale
+    returned raster is shared by the cache, copy it before painting on it
+    '''
+    key = (_raster.cache_key(), degrees_clockwise % 360)
+    with _rotation_cache_lock:
+        rotated_raster = _rotation_cache.get(key)
+        if rotated_raster is not None:
+            _rotation_cache.move_to_end(key)
+            return rotated_raster
+    # resampled outside of the lock, so GUI thread does not wait for background rotation
+    rotated_raster = raster_rotation(_raster, degrees_clockwise)
+    with _rotation_cache_lock:
+        _rotation_cache[key] = rotated_raster
+        while len(_rotation_cache) > rotation_cache_size:
+            _rotation_cache.popitem(last=False)
+    return rotated_raster
+
+
+def prepare_rotation(_raster, degrees_clockwise, progress=None) -> None:
+    ''' background job, fills rotation cache, so the later commit of the rotation is just a copy '''
+    cached_rotation(_raster, degrees_clockwise)
+
+
 def remove_rotation_artifacts(_pixmap, _width, _height):
     delta_w = (_pixmap.width() - _width) // 2
     delta_h = (_pixmap.height() - _height) // 2
@@ -146,10 +196,12 @@ def scaleToFit(canvas_w, canvas_h, image_w, image_h):
     return dimensions(int(image_w), int(image_h))
 
 def qimage2array(_qimage):
+    import qimage2ndarray
     return qimage2ndarray.rgb_view(_qimage)
 
 
 def qimage2raw_array(_qimage):
+    import qimage2ndarray
     return qimage2ndarray.raw_view(_qimage)
 
 
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+'''
+Timing and memory of editor operations, off unless instrumentation_env is set, read as create_logger() reads logging
+- NAV2_MAP_EDITOR_INSTRUMENT=ops.jsonl map_editor writes every operation as one JSON line into ops.jsonl
+- span of operation has its duration, resident memory of the editor and memory of history, before and after
+- operation running as background job ends its span when the job ends, with status of the job
+- the last operation and the last frame painted by the canvas are kept for the status bar overlay
+- when disabled, span() and frame() return shared no-op object, operations pay only the call
+'''
+
+# Python
+import json
+import logging
+import os
+import threading
+import time
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import instrumentation_env
+
+logger = logging.getLogger("map_editor")
+
+_log = None  # JSON log file, None while disabled
+_log_lock = threading.Lock()
+_history = None  # History of the canvas, its memory is reported
+last_operation = None  # (name, duration in s) of the last ended span
+last_frame = None  # s, paint of the canvas viewport
+
+try:
+    _page_size = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _page_size = None
+
+
+def enable(path) -> None:
+    global _log
+    _log = open(path, 'a', buffering=1)  # line buffered, operations logged before a crash stay in the log
+    logger.info("Instrumentation log: " + path)
+
+
+def enable_from_environment() -> None:
+    path = os.getenv(instrumentation_env)
+    if path:
+        try:
+            enable(path)
+        except OSError as error:
+            logger.info("Instrumentation is off: " + str(error))
+
+
+def enabled() -> bool:
+    return _log is not None
+
+
+def disable() -> None:
+    global _log
+    if _log is not None:
+        _log.close()
+        _log = None
+
+
+def watch_history(history) -> None:
+    global _history
+    _history = history
+
+
+def resident_memory():
+    ''' bytes of physical memory held by the editor, None where /proc is not available '''
+    if _page_size is None:
+        return None
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * _page_size
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def history_memory():
+    return None if _history is None else _history.nbytes
+
+
+def _write(record) -> None:
+    with _log_lock:
+        if _log is not None:
+            _log.write(json.dumps(record) + '\n')
+
+
+class Span:
+    '''
+    Timing of one operation, used as context manager or ended by end()
+    fields are written into its record, status is 'ok', unless set otherwise
+    '''
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.rss_before = resident_memory()
+        self.history_before = history_memory()
+        self.wall_time = time.time()
+        self.started = time.perf_counter()
+        self.ended = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> bool:
+        if error_type is not None:
+            self.fields.update(status='failed', error=str(error))
+        self.end()
+        return False
+
+    def end(self, **fields) -> None:
+        global last_operation
+        if self.ended:
+            return
+        self.ended = True
+        duration = time.perf_counter() - self.started
+        self.fields.update(fields)
+        record = {'op': self.name, 'time': round(self.wall_time, 6), 'duration_ms': round(duration * 1000, 3),
+                  'status': self.fields.pop('status', 'ok'),
+                  'rss_before': self.rss_before, 'rss_after': resident_memory(),
+                  'history_before': self.history_before, 'history_after': history_memory()}
+        record.update(self.fields)
+        _write(record)
+        last_operation = (self.name, duration)
+
+    def track(self, job) -> None:
+        ''' span ends with background job, after its result is handled '''
+        job.signals.failed.connect(lambda error: self.fields.update(status='failed', error=str(error)))
+        job.signals.cancelled.connect(lambda: self.fields.update(status='cancelled'))
+        job.signals.ended.connect(self.end)
+
+
+class Frame:
+    ''' times paint of the canvas, paints are not nested, so single instance is reused '''
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> bool:
+        global last_frame
+        last_frame = time.perf_counter() - self.started
+        return False
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> bool:
+        return False
+
+    def end(self, **fields) -> None:
+        pass
+
+    def track(self, job) -> None:
+        pass
+
+
+_no_span = NoSpan()
+_frame = Frame()
+
+
+def span(name, **fields):
+    return Span(name, **fields) if _log is not None else _no_span
+
+
+def frame():
+    return _frame if _log is not None else _no_span
+
+
+def overlay_text() -> str:
+    ''' last operation, frame time and memory of history, for the status bar '''
+    parts = []
+    if last_operation is not None:
+        parts.append('%s %.1f ms' % (last_operation[0], last_operation[1] * 1000))
+    if last_frame is not None:
+        parts.append('frame %.1f ms' % (last_frame * 1000))
+    history = history_memory()
+    if history is not None:
+        parts.append('history %.1f MB' % (history / 2 ** 20))
+    return '  |  '.join(parts)
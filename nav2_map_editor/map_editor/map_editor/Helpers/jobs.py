@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+'''
+Background jobs, heavy map operations run outside of the GUI thread
+- job is plain function, it gets keyword argument progress, callable with done fraction 0..1
+- progress() raises JobCancelled, once the job is cancelled, so work stops at the next strip/chunk
+- job submitted with on_partial gets keyword argument partial too, callable with intermediate result,
+  like preview of the map being loaded
+- results, errors and progress are delivered by Qt signals, slots run in the GUI thread
+- result of cancelled job is never delivered, even when the job was cancelled after its last progress report
+'''
+
+# PyQT
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+# Python
+import logging
+
+logger = logging.getLogger("map_editor")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobSignals(QObject):
+    ''' created in the GUI thread, signals emitted by worker thread are queued into it '''
+    progress = pyqtSignal(int)  # %
+    partial = pyqtSignal(object)  # intermediate result, before finished
+    finished = pyqtSignal(object)  # result of the function
+    failed = pyqtSignal(object)  # raised exception
+    cancelled = pyqtSignal()
+    ended = pyqtSignal()  # after any of three above
+
+
+class Job(QRunnable):
+    def __init__(self, name, function, *args, **kwargs):
+        QRunnable.__init__(self)
+        self.setAutoDelete(False)  # scheduler holds the job, until it ends
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = JobSignals()
+        self.is_cancelled = False
+        self.last_percent = -1
+
+    def cancel(self) -> None:
+        ''' thread safe, job stops on its next progress report '''
+        self.is_cancelled = True
+
+    def report(self, fraction) -> None:
+        if self.is_cancelled:
+            raise JobCancelled(self.name)
+        percent = int(fraction * 100)
+        if percent != self.last_percent:
+            self.last_percent = percent
+            self.signals.progress.emit(percent)
+
+    def publish(self, value) -> None:
+        if self.is_cancelled:
+            raise JobCancelled(self.name)
+        self.signals.partial.emit(value)
+
+    def run(self) -> None:
+        try:
+            self.report(0)
+            result = self.function(*self.args, progress=self.report, **self.kwargs)
+        except JobCancelled:
+            self.signals.cancelled.emit()
+        except Exception as error:
+            self.signals.failed.emit(error)
+        else:
+            if self.is_cancelled:  # cancelled after its last progress report
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+        self.signals.ended.emit()
+
+    def finished_slot(self, on_finished):
+        ''' on_finished, unless the job gets cancelled while its result is queued for the GUI thread '''
+        def finished(result):
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+            elif on_finished is not None:
+                on_finished(result)
+        return finished
+
+    def partial_slot(self, on_partial):
+        def partial(value):
+            if not self.is_cancelled:
+                on_partial(value)
+        return partial
+
+
+class JobScheduler(QObject):
+    '''
+    Runs jobs in its own QThreadPool
+    - there is at most one job of each name, submitting the same name cancels the older job
+    - jobStarted/jobProgress/jobEnded are meant for progress display
+    '''
+    jobStarted = pyqtSignal(str)
+    jobProgress = pyqtSignal(str, int)
+    jobEnded = pyqtSignal(str)
+
+    def __init__(self, max_threads=None):
+        QObject.__init__(self)
+        self.pool = QThreadPool(self)
+        if max_threads is not None:
+            self.pool.setMaxThreadCount(max_threads)
+        self.jobs = {}  # name -> running or queued Job
+
+    def submit(self, name, function, *args, on_finished=None, on_failed=None, on_progress=None, on_partial=None,
+               **kwargs) -> Job:
+        self.cancel(name)
+        job = Job(name, function, *args, **kwargs)
+        job.signals.finished.connect(job.finished_slot(on_finished))
+        if on_progress is not None:
+            job.signals.progress.connect(on_progress)
+        if on_partial is not None:
+            job.kwargs['partial'] = job.publish
+            job.signals.partial.connect(job.partial_slot(on_partial))
+        job.signals.failed.connect(on_failed if on_failed is not None else
+                                   lambda error: logger.error("%s failed: %s" % (name, error)))
+        job.signals.progress.connect(lambda percent: self.jobProgress.emit(name, percent))
+        job.signals.ended.connect(lambda: self._ended(job))
+        self.jobs[name] = job
+        self.jobStarted.emit(name)
+        self.pool.start(job)
+        return job
+
+    def _ended(self, job) -> None:
+        if self.jobs.get(job.name) is job:
+            del self.jobs[job.name]
+        self.jobEnded.emit(job.name)
+
+    def is_running(self, name) -> bool:
+        return name in self.jobs
+
+    def cancel(self, name) -> None:
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancel()
+            if self.pool.tryTake(job):  # not started yet
+                job.signals.cancelled.emit()
+                job.signals.ended.emit()
+
+    def cancel_all(self, keep=()) -> None:
+        for name in list(self.jobs):
+            if name not in keep:
+                self.cancel(name)
+
+    def wait(self, msecs=-1) -> bool:
+        ''' blocks until all jobs end, their signals are delivered by the next event processing '''
+        return self.pool.waitForDone(msecs)
@@ -31,6 +31,36 @@ default_brush_size = 10
 color_icon_width = 15 ; color_icon_height = color_icon_width
 default_paint_color = colors['Nav2-blue']
 
+# Canvas rendering
+tile_size = 512  # px, side of one tile of the map, on every mip-map level
+tile_cache_limit = 256  # count of tiles kept in memory, ~1MB each
+stroke_backup_tile_size = 256  # px, granularity of pixels saved before brush stroke touches them
+default_refresh_rate = 60  # Hz, used when screen does not report it
+
+# Undo/redo history
+history_memory_budget = 1024 * 1024 * 1024  # bytes, the oldest changes are forgotten above it
+history_compression_level = 1  # zlib level of stored patches, 0 turns compression off
+app_cache_dir_name = 'nav2_map_editor'  # in user cache directory, holds journals of history and map cache
+map_cache_size_limit = 1024 * 1024 * 1024  # bytes of cached map pyramids, the least recently used are removed above it
+map_cache_preview_pixels = 1024 * 1024  # the finest cached level at most this large is shown, while map loads
+map_cache_hash_samples = 64  # count of 4kB blocks of map file hashed, with its size and mtime, to find its cache
+map_load_refresh_interval = 0.1  # s, how often rows loaded so far are shown, while map loads
+rotation_cache_size = 4  # count of resampled rotations of the map kept in memory
+history_thumbnail_size = 64  # px, longer side of pixmap shown in history table
+history_thumbnail_cache_size = 256  # count of history table thumbnails kept in memory
+grayscale_chunk_pixels = 1 << 20  # pixels converted to gray at once, bounds temporary buffers
+map_io_strip_pixels = 1 << 22  # pixels read or written at once by map_io
+png_compression_level = 6  # zlib level of saved PNG maps
+rotation_prepare_delay = 300  # ms, rotation is resampled in background after the angle stops changing
+
+# Input trace
+input_trace_env = 'NAV2_MAP_EDITOR_INPUT_TRACE'  # path of trace, input of the canvas is recorded into it when set
+replay_percentiles = (50, 90, 99)  # of handler latency and frame time, reported by map_editor_replay
+
+# Instrumentation
+instrumentation_env = 'NAV2_MAP_EDITOR_INSTRUMENT'  # path of JSON log of operations, instrumentation is on when set
+instrumentation_overlay_interval = 250  # ms, refresh of last operation, frame time and history memory in status bar
+
 top_menu_button_dimensions = dimensions(width=top_menu_button_width, height=top_menu_button_height)
 load_button_dimensions = top_menu_button_dimensions
 save_button_dimensions = top_menu_button_dimensions
@@ -45,6 +75,14 @@ yaml_button_dimensions = dimensions(width=yaml_button_width, height=yaml_button_
 # Waypoints magic numbers
 waypoint_menu_width = 142
 waypoint_column_width = waypoint_menu_width - 15
+waypoint_delete_button_size = 16  # px, painted by delegate of waypoint table
+waypoint_store_bucket_size = 512  # order keys per bucket of waypoint store
+waypoint_order_gap = 1 << 32  # gap between order keys of waypoints added to start or end
+waypoint_relabel_density = 1.5  # key range of 2**level keys is respaced, once it has < 1.5**level waypoints
+waypoint_size = 2  # diameter of waypoint marker, in map px
+waypoint_grid_cell_size = 64  # map px, cell of grid index of waypoint layer
+waypoint_label_min_height = 6  # screen px, smaller labels are not drawn (zoomed out)
+waypoint_label_chars = 8  # bounding rect of waypoint layer is grown by label this long
 wp_text_size_divider = 4
 wp_default_text_size = 4
 default_color_text = colors['Nav2-blue']
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+'''
+Persistent cache of downsampled map pyramids, in user cache directory
+- map file is found by its size, mtime and hash of blocks sampled across it, nothing else of the file is read,
+  changed or replaced file gets new key
+- level n of the pyramid is the map downsampled 2**n times, by averaging 2x2 pixels, the same levels
+  TiledPixmapItem shows zoomed out, down to the thumbnail level, which fits into single tile
+- levels are .npy files of MapRaster layout, they are memory-mapped, not read, when the map is loaded again
+- entry is written into temporary directory and renamed, its mtime is refreshed on every use,
+  the least recently used entries are removed, when the cache grows over size limit
+'''
+
+# External lib
+import numpy as np
+
+# PyQT
+from PyQt5.QtCore import QSize
+
+# Python
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+# Source files
+from map_editor.Helpers.helpers import app_cache_directory
+from map_editor.Helpers.raster import image_view
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import tile_size, map_cache_size_limit, map_cache_preview_pixels
+from map_editor.Helpers.magic_gui_numbers import map_cache_hash_samples
+
+logger = logging.getLogger("map_editor")
+
+hash_block_size = 4096
+size_file_name = 'size'
+
+
+def cache_directory() -> str:
+    return app_cache_directory('maps')
+
+
+def map_key(path) -> str:
+    ''' key of map file in cache, from its size, mtime and blocks sampled evenly across it '''
+    status = os.stat(path)
+    digest = hashlib.blake2b(b'%d:%d' % (status.st_size, status.st_mtime_ns), digest_size=16)
+    last_block = max(status.st_size - hash_block_size, 0)
+    with open(path, 'rb') as file:
+        for sample in range(map_cache_hash_samples):
+            file.seek(last_block * sample // max(map_cache_hash_samples - 1, 1))
+            digest.update(file.read(hash_block_size))
+    return digest.hexdigest()
+
+
+def downsample(array) -> np.ndarray:
+    ''' array of MapRaster layout halved, odd last row and column are averaged with themselves '''
+    height, width = array.shape[:2]
+    if height % 2 or width % 2:
+        array = np.pad(array, ((0, height % 2), (0, width % 2), (0, 0)), mode='edge')
+    summed = array[0::2, 0::2].astype(np.uint16)
+    summed += array[1::2, 0::2]
+    summed += array[0::2, 1::2]
+    summed += array[1::2, 1::2]
+    summed += 2
+    return (summed >> 2).astype(np.uint8)
+
+
+def build_pyramid(raster) -> list:
+    ''' arrays of levels 1, 2, ..., until the level fits into single tile '''
+    levels = []
+    array = raster.array
+    while max(array.shape[:2]) > tile_size:
+        array = downsample(array)
+        levels.append(array)
+    return levels
+
+
+def _entry(path):
+    return os.path.join(cache_directory(), map_key(path))
+
+
+def _level_path(entry, level) -> str:
+    return os.path.join(entry, 'level%d.npy' % level)
+
+
+def load_pyramid(path):
+    ''' memory-mapped arrays of cached levels of map file, None if it is not cached '''
+    entry = _entry(path)
+    levels = []
+    try:
+        while os.path.exists(_level_path(entry, len(levels) + 1)):
+            levels.append(np.load(_level_path(entry, len(levels) + 1), mmap_mode='r'))
+        if not os.path.exists(os.path.join(entry, size_file_name)):
+            return None
+        os.utime(entry)
+    except (OSError, ValueError) as error:
+        logger.info("Map cache cannot be read: " + str(error))
+        return None
+    return levels
+
+
+def store_pyramid(path, raster, levels) -> None:
+    ''' writes levels of map file into cache, then removes the least recently used entries over size limit '''
+    entry = _entry(path)
+    try:
+        os.makedirs(cache_directory(), exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=cache_directory(), prefix='.tmp-')
+        try:
+            for level, array in enumerate(levels, 1):
+                np.save(_level_path(temporary, level), array)
+            with open(os.path.join(temporary, size_file_name), 'w') as file:
+                file.write('%d %d\n' % (raster.width(), raster.height()))
+            os.rename(temporary, entry)
+        except OSError:
+            shutil.rmtree(temporary, ignore_errors=True)
+            if not os.path.isdir(entry):  # else it was stored by another editor meanwhile
+                raise
+    except OSError as error:
+        logger.info("Map cache cannot be written: " + str(error))
+        return
+    evict()
+
+
+def pyramid(path, raster) -> list:
+    ''' levels of map loaded from path, from cache or built and cached, for background job '''
+    levels = load_pyramid(path)
+    if levels is None:
+        levels = build_pyramid(raster)
+        store_pyramid(path, raster, levels)
+        stored = load_pyramid(path)  # memory-mapped, pages are not held by the editor
+        levels = levels if stored is None else stored
+    return levels
+
+
+def load_preview(path):
+    ''' (map size, QImage) of the finest cached level small enough to show at once, (None, None) if not cached '''
+    try:
+        entry = _entry(path)
+        with open(os.path.join(entry, size_file_name)) as file:
+            width, height = (int(value) for value in file.read().split())
+        level = 1
+        while (width >> level) * (height >> level) > map_cache_preview_pixels and \
+                os.path.exists(_level_path(entry, level + 1)):
+            level += 1
+        array = np.load(_level_path(entry, level), mmap_mode='r')
+        image = image_view(array).copy()  # detached from the memory map
+    except (OSError, ValueError):
+        return None, None
+    return QSize(width, height), image
+
+
+def _size(entry) -> int:
+    return sum(item.stat().st_size for item in os.scandir(entry) if item.is_file())
+
+
+def evict(size_limit=map_cache_size_limit) -> int:
+    ''' removes the least recently used entries until cache fits into size_limit, returns count of removed '''
+    try:
+        entries = [item for item in os.scandir(cache_directory()) if item.is_dir() and not item.name.startswith('.')]
+        entries = sorted(((item.stat().st_mtime, item.path, _size(item.path)) for item in entries), reverse=True)
+    except OSError:
+        return 0
+    total, removed = 0, 0
+    for _, entry, size in entries:
+        total += size
+        if total > size_limit:
+            shutil.rmtree(entry, ignore_errors=True)
+            removed += 1
+    if removed:
+        logger.debug("Map cache evicted %d entries" % removed)
+    return removed
@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+'''
+Map image input/output, without decoding or encoding whole image at once
+- binary PGM (P5) is memory-mapped and copied into MapRaster in row strips, coarse preview is sampled first,
+  so the map can be shown before it is loaded
+- PGM and grayscale PNG are written in row strips, PNG through streaming zlib compressor
+- files are written atomically, into temporary file, which replaces the target only when it is complete
+- occupancy values follow trinary, scale and raw modes of nav2_map_server map_io.cpp
+'''
+
+# External lib
+import numpy as np
+import yaml  # pip pyaml
+
+# PyQT
+from PyQt5.QtGui import QImage
+from PyQt5.QtCore import QBuffer, QIODevice, QSize
+
+# Python
+import os
+import struct
+import tempfile
+import time
+import zlib
+from math import ceil, sqrt
+from contextlib import contextmanager
+
+# Source files
+from map_editor.Helpers.raster import MapRaster, raster_channels, image_view
+from map_editor.Helpers.colors_helpers import bgra2gray
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import map_io_strip_pixels, grayscale_chunk_pixels, png_compression_level
+from map_editor.Helpers.magic_gui_numbers import map_cache_preview_pixels, map_load_refresh_interval
+
+pgm_magic = b'P5'
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+# occupancy values of nav2_util/occ_grid_values.hpp
+occ_grid_unknown = -1
+occ_grid_free = 0
+occ_grid_occupied = 100
+
+# permissions of new files, umask can be read only by changing it, which is not thread safe in jobs
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def strip_rows(width, strip_pixels=map_io_strip_pixels) -> int:
+    return max(1, strip_pixels // max(width, 1))
+
+
+def read_pgm_header(path):
+    ''' returns (width, height, maxval, data offset) of binary PGM, raises ValueError for other files '''
+    with open(path, 'rb') as file:
+        head = file.read(1024)
+    tokens = []
+    position = 0
+    while len(tokens) < 4:
+        while position < len(head) and head[position:position + 1].isspace():
+            position += 1
+        if head[position:position + 1] == b'#':
+            position = head.find(b'\n', position)
+            if position < 0:
+                raise ValueError("Invalid PGM header: " + path)
+            continue
+        end = position
+        while end < len(head) and not head[end:end + 1].isspace():
+            end += 1
+        if end == position or end >= len(head):
+            raise ValueError("Invalid PGM header: " + path)
+        tokens.append(head[position:end])
+        position = end
+    if tokens[0] != pgm_magic:
+        raise ValueError("Not a binary PGM: " + path)
+    width, height, maxval = (int(token) for token in tokens[1:])
+    # exactly one whitespace separates maxval from pixels
+    return width, height, maxval, position + 1
+
+
+def open_pgm(path) -> np.memmap:
+    ''' (height, width) memory map of binary PGM pixels, nothing is read until rows are accessed '''
+    width, height, maxval, offset = read_pgm_header(path)
+    dtype = np.uint8 if maxval < 256 else np.dtype('>u2')
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(height, width)), maxval
+
+
+def _gray_to_raster(gray, maxval, target) -> None:
+    ''' fills BGRA target by gray pixels of PGM with maxval '''
+    if maxval != 255:
+        gray = (gray.astype(np.uint32) * 255 + maxval // 2) // maxval
+    for channel in range(3):
+        target[..., channel] = gray
+    target[..., 3] = 255
+
+
+def load_pgm(path, progress=None, partial=None) -> MapRaster:
+    '''
+    copies PGM into new MapRaster, one strip of rows at a time, progress(fraction) is called after each
+    partial(update) is given, while the map loads, in this order:
+    ('preview', map size, QImage) of pixels sampled across whole map, if it is larger than preview,
+    ('raster', MapRaster) being loaded, transparent where it is not loaded yet,
+    ('rows', top, bottom) loaded since the last update, at most once per refresh interval, and once at the end
+    '''
+    pixels, maxval = open_pgm(path)
+    height, width = pixels.shape
+    if partial is not None:
+        step = ceil(sqrt(height * width / map_cache_preview_pixels))
+        if step > 1:
+            sampled = pixels[::step, ::step]  # only every step-th row is read
+            preview = np.empty(sampled.shape + (raster_channels,), dtype=np.uint8)
+            _gray_to_raster(sampled, maxval, preview)
+            partial(('preview', QSize(width, height), image_view(preview).copy()))
+        raster_array = np.zeros((height, width, raster_channels), dtype=np.uint8)
+        partial(('raster', MapRaster(raster_array)))
+    else:
+        raster_array = np.empty((height, width, raster_channels), dtype=np.uint8)
+    rows = strip_rows(width)
+    shown_rows, shown_time = 0, time.monotonic()
+    for top in range(0, height, rows):
+        strip = pixels[top:top + rows]
+        _gray_to_raster(strip, maxval, raster_array[top:top + rows])
+        if progress is not None:
+            progress((top + len(strip)) / height)
+        if partial is not None and (time.monotonic() - shown_time >= map_load_refresh_interval or
+                                    top + len(strip) == height):
+            partial(('rows', shown_rows, top + len(strip)))
+            shown_rows, shown_time = top + len(strip), time.monotonic()
+    del pixels  # closes the map
+    return MapRaster(raster_array)
+
+
+def load_map_image(path, progress=None, partial=None) -> MapRaster:
+    ''' binary PGM is streamed, other formats are decoded by Qt at once, partial() is given only for PGM '''
+    try:
+        return load_pgm(path, progress, partial)
+    except ValueError:
+        image = QImage(path)
+        if image.isNull():
+            raise FileNotFoundError(path)
+        return MapRaster.from_image(image)
+
+
+@contextmanager
+def atomic_file(path, mode='wb'):
+    '''
+    yields file object of temporary file in the directory of path, which replaces path after successful write,
+    on any exception path is left untouched and temporary file is removed
+    '''
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(descriptor, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        else:
+            os.chmod(temp_path, 0o666 & ~_umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def gray_strips(raster, progress=None):
+    ''' yields (height, width) uint8 gray strips of raster, only one strip is in memory at a time '''
+    rows = strip_rows(raster.width())
+    buffer = np.empty((min(rows, raster.height()), raster.width()), dtype=np.uint8)
+    for top in range(0, raster.height(), rows):
+        if progress is not None:
+            progress(top / raster.height())
+        strip = raster.array[top:top + rows]
+        yield bgra2gray(strip, grayscale_chunk_pixels, out=buffer[:len(strip)])
+
+
+def write_pgm(file, raster, progress=None) -> None:
+    ''' binary PGM into file object open for binary writing '''
+    file.write(b'%s\n%d %d\n255\n' % (pgm_magic, raster.width(), raster.height()))
+    for strip in gray_strips(raster, progress):
+        file.write(strip.data)
+
+
+def _png_chunk(file, chunk_type, data) -> None:
+    file.write(struct.pack('>I', len(data)))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+
+def write_png(file, raster, compression_level=png_compression_level, progress=None) -> None:
+    ''' 8 bit grayscale PNG into file object open for binary writing, each row has filter type 0 (None) '''
+    file.write(png_signature)
+    _png_chunk(file, b'IHDR', struct.pack('>IIBBBBB', raster.width(), raster.height(), 8, 0, 0, 0, 0))
+    compressor = zlib.compressobj(compression_level)
+    filtered = None
+    for strip in gray_strips(raster, progress):
+        if filtered is None or len(filtered) < len(strip):
+            filtered = np.zeros((len(strip), raster.width() + 1), dtype=np.uint8)
+        filtered[:len(strip), 1:] = strip
+        data = compressor.compress(filtered[:len(strip)].data)
+        if data:
+            _png_chunk(file, b'IDAT', data)
+    _png_chunk(file, b'IDAT', compressor.flush())
+    _png_chunk(file, b'IEND', b'')
+
+
+def write_qt_image(file, raster, image_format) -> None:
+    ''' gray image encoded by Qt, into file object open for binary writing '''
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    if not raster.grayscale_image().save(buffer, image_format):
+        raise OSError("Cannot encode map as " + image_format)
+    file.write(buffer.data().data())
+
+
+def save_map_image(path, raster, progress=None) -> None:
+    '''
+    saves gray map atomically, PGM and PNG are streamed, other formats are encoded by Qt
+    progress(fraction) is called between strips, whatever it raises stops writing, the file at path is kept
+    raster is only read, so it can be snapshot() of the edited one
+    '''
+    extension = os.path.splitext(path)[1].lower()
+    with atomic_file(path) as file:
+        if extension == '.pgm':
+            write_pgm(file, raster, progress)
+        elif extension == '.png':
+            write_png(file, raster, progress=progress)
+        else:
+            write_qt_image(file, raster, extension[1:].upper())
+
+
+def save_map(yaml_path, yaml_text, image_path, raster, progress=None) -> None:
+    '''
+    saves map image, then its YAML, both atomically, YAML is committed only after its image is,
+    so failed or stopped save leaves the previous pair untouched
+    '''
+    save_map_image(image_path, raster, progress)
+    with atomic_file(yaml_path, 'w') as yaml_file:
+        yaml_file.write(yaml_text)
+
+
+def occupancy_from_gray(gray, mode='trinary', negate=0, occupied_thresh=0.65, free_thresh=0.25, alpha=None):
+    '''
+    int8 occupancy of gray pixels, as map_server loads them, rows stay in image order
+    alpha (255 = opaque) is averaged in for trinary mode and marks unknown cells for scale mode
+    '''
+    if mode == 'trinary' and alpha is not None:
+        shade = (3 * gray.astype(np.float64) + alpha) / (4 * 255)
+    else:
+        shade = gray / 255
+    occ = shade if negate else 1 - shade
+    if mode == 'raw':
+        occ_percent = np.round(shade * 255)
+        return np.where(occ_percent <= occ_grid_occupied, occ_percent, occ_grid_unknown).astype(np.int8)
+
+    if mode == 'trinary':
+        cells = np.full(gray.shape, occ_grid_unknown, dtype=np.int8)
+    elif mode == 'scale':
+        # out of range values are overwritten by thresholds below
+        cells = np.rint(np.clip((occ - free_thresh) / (occupied_thresh - free_thresh) * 100,
+                                occ_grid_free, occ_grid_occupied)).astype(np.int8)
+    else:
+        raise ValueError("Invalid map mode: " + str(mode))
+    cells[occupied_thresh < occ] = occ_grid_occupied
+    cells[occ < free_thresh] = occ_grid_free
+    if mode == 'scale' and alpha is not None:
+        cells[alpha != 255] = occ_grid_unknown
+    return cells
+
+
+def gray_from_occupancy(cells, mode='trinary', occupied_thresh=0.65, free_thresh=0.25):
+    ''' returns (gray, alpha) uint8 pixels, as map_server saves occupancy, alpha is None except for scale mode '''
+    unknown = (cells < occ_grid_free) | (occ_grid_occupied < cells)
+    if mode == 'trinary':
+        gray = np.full(cells.shape, 205, dtype=np.uint8)
+        gray[round(occupied_thresh * 100) <= cells] = 0
+        gray[cells <= round(free_thresh * 100)] = 254  # free is checked first by map_server
+        gray[unknown] = 205
+        return gray, None
+    if mode == 'scale':
+        gray = np.round((100 - cells.astype(np.float64)) / 100 * 255).astype(np.uint8)
+        gray[unknown] = 128
+        alpha = np.where(unknown, 0, 255).astype(np.uint8)
+        return gray, alpha
+    if mode == 'raw':
+        return np.where(unknown, 255, cells).astype(np.uint8), None
+    raise ValueError("Invalid map mode: " + str(mode))
+
+
+def load_occupancy(yaml_path) -> np.ndarray:
+    ''' int8 occupancy of map_server YAML + PGM, read strip by strip, rows stay in image order '''
+    with open(yaml_path, 'r') as stream:
+        parameters = yaml.safe_load(stream)
+    image_path = parameters['image']
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(os.path.dirname(os.path.abspath(yaml_path)), image_path)
+    pixels, maxval = open_pgm(image_path)
+    cells = np.empty(pixels.shape, dtype=np.int8)
+    rows = strip_rows(pixels.shape[1])
+    for top in range(0, pixels.shape[0], rows):
+        strip = pixels[top:top + rows]
+        if maxval != 255:
+            strip = (strip.astype(np.uint32) * 255 + maxval // 2) // maxval
+        cells[top:top + rows] = occupancy_from_gray(
+            strip, parameters.get('mode', 'trinary'), int(parameters['negate']),
+            float(parameters['occupied_thresh']), float(parameters['free_thresh']))
+    return cells
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+# External lib
+import numpy as np
+
+# PyQT
+from PyQt5 import sip
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import QRect, QSize
+
+# Python
+from itertools import count
+
+# Source files
+from map_editor.Helpers.colors_helpers import bgra2gray
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import grayscale_chunk_pixels
+
+raster_format = QImage.Format_ARGB32  # 32 bit word 0xAARRGGBB, in memory B, G, R, A
+raster_channels = 4
+
+_content_ids = count()
+
+
+def array_view(image) -> np.ndarray:
+    '''
+    (height, width, 4) uint8 view of pixels of ARGB32/RGB32 QImage, without copying
+    view is valid only as long as the image is alive and not detached
+    '''
+    bits = image.bits()
+    bits.setsize(image.sizeInBytes())
+    rows = np.frombuffer(bits, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width() * raster_channels].reshape(image.height(), image.width(), raster_channels)
+
+
+def gray_view(image) -> np.ndarray:
+    ''' (height, width) uint8 view of pixels of Grayscale8 QImage, without copying '''
+    bits = image.bits()
+    bits.setsize(image.sizeInBytes())
+    rows = np.frombuffer(bits, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    return rows[:, :image.width()]
+
+
+def rect_slices(rect):
+    ''' (rows, columns) slices of array, covered by QRect '''
+    return slice(rect.top(), rect.top() + rect.height()), slice(rect.left(), rect.left() + rect.width())
+
+
+def image_view(array) -> QImage:
+    '''
+    ARGB32 QImage painting straight into (height, width, 4) uint8 array, rows may be strided
+    caller has to keep the array alive, while the image is used
+    '''
+    height, width = array.shape[:2]
+    return QImage(sip.voidptr(array.ctypes.data), width, height, array.strides[0], raster_format)
+
+
+class MapRaster:
+    '''
+    Pixels of the map in one owned uint8 NumPy buffer of shape (height, width, 4), in order B, G, R, A
+    - image is ARGB32 QImage over the same buffer, QPainter and NumPy both work in place
+    - region() and image_region() are views too, copy() is the only way to get separate pixels
+    - call touch() after changing pixels, so cache_key() of modified raster differs
+    - copy() of whole raster keeps cache_key(), until one of them is touched
+    '''
+    def __init__(self, array):
+        if array.dtype != np.uint8 or array.ndim != 3 or array.shape[2] != raster_channels:
+            raise ValueError(array.shape)
+        self.array = np.ascontiguousarray(array)
+        self.image = image_view(self.array)
+        self.content_id = next(_content_ids)
+
+    @classmethod
+    def empty(cls, width, height):
+        return cls(np.zeros((height, width, raster_channels), dtype=np.uint8))
+
+    @classmethod
+    def from_image(cls, image):
+        ''' copies QImage/QPixmap into new raster, this is the only conversion on load '''
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        if image.isNull():
+            return cls.empty(0, 0)
+        image = image.convertToFormat(raster_format)  # has to outlive its view
+        return cls(array_view(image).copy())
+
+    def width(self) -> int:
+        return self.array.shape[1]
+
+    def height(self) -> int:
+        return self.array.shape[0]
+
+    def size(self) -> QSize:
+        return QSize(self.width(), self.height())
+
+    def rect(self) -> QRect:
+        return QRect(0, 0, self.width(), self.height())
+
+    def isNull(self) -> bool:
+        return self.array.size == 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def cache_key(self) -> int:
+        ''' same only for rasters of the same content, like QPixmap.cacheKey() '''
+        return self.content_id
+
+    def touch(self) -> None:
+        self.content_id = next(_content_ids)
+
+    def region(self, rect) -> np.ndarray:
+        ''' view of pixels inside rect, rect has to lie inside the raster '''
+        return self.array[rect_slices(rect)]
+
+    def image_region(self, rect) -> QImage:
+        ''' QImage view of pixels inside rect, valid while the raster is alive '''
+        return image_view(self.region(rect))
+
+    def copy(self, rect=None):
+        ''' deep copy, of rect only if given (clipped to the raster, same as QPixmap.copy) '''
+        if rect is None or rect.isEmpty():
+            raster = MapRaster(self.array.copy())
+            raster.content_id = self.content_id
+            return raster
+        return MapRaster(self.region(rect.intersected(self.rect())).copy())
+
+    def snapshot(self):
+        ''' read-only deep copy with the same cache_key(), for readers in background jobs '''
+        raster = self.copy()
+        raster.array.flags.writeable = False
+        return raster
+
+    def paste(self, point, array) -> None:
+        ''' replaces pixels at point by array of the same layout '''
+        height, width = array.shape[:2]
+        self.region(QRect(point.x(), point.y(), width, height))[...] = array
+        self.touch()
+
+    def to_pixmap(self) -> QPixmap:
+        return QPixmap.fromImage(self.image)
+
+    def grayscale_image(self) -> QImage:
+        ''' new Grayscale8 QImage of the raster, raster itself is not changed '''
+        image = QImage(self.width(), self.height(), QImage.Format_Grayscale8)
+        bgra2gray(self.array, grayscale_chunk_pixels, out=gray_view(image))
+        return image
+
+    def grayscale(self) -> None:
+        ''' converts pixels to gray in place, alpha is kept '''
+        gray = bgra2gray(self.array, grayscale_chunk_pixels)
+        for channel in range(3):
+            self.array[..., channel] = gray
+        self.touch()
@@ -3,7 +3,7 @@
 # PyQT
 from PyQt5.QtWidgets import QLineEdit, QPushButton, QSpinBox, QDoubleSpinBox
 from PyQt5.QtGui import QFocusEvent
-from PyQt5.Qt import Qt
+from PyQt5.QtCore import Qt
 
 
 class FocusOutLineEdit(QLineEdit):
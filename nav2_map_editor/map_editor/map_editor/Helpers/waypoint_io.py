@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+'''
+Waypoints in map YAML, as one sequence in route order, each waypoint with its own theta:
+    waypoints:
+    - [x, y, theta]
+- block is written and read in bulk, rows in the layout written here are parsed without building YAML nodes,
+  anything else falls back to libyaml (CSafeLoader), so hand edited files still load
+- old files with one wp_<id>: [x, y, theta] key per waypoint are still read
+'''
+
+# External lib
+import yaml  # pip pyaml
+
+# Python
+import re
+from itertools import chain
+
+# libyaml bindings are optional part of PyYAML
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+waypoints_key = 'waypoints'
+legacy_waypoint_prefix = 'wp_'
+_block_start = re.compile(r'^%s:[ \t]*$' % waypoints_key, re.MULTILINE)
+_block_end = re.compile(r'^[^\s#-]', re.MULTILINE)  # next top-level key
+_number_pattern = r'(-?(?:0|[1-9]\d*)(?:\.\d+(?:e[-+]\d+)?)?)'  # resolved the same by YAML 1.1 and Python
+_row = re.compile(r'^- \[%s, %s, %s\][ \t]*$' % ((_number_pattern,) * 3), re.MULTILINE)
+
+
+def _number(text):
+    return float(text) if '.' in text else int(text)
+
+
+def _is_plain(value) -> bool:
+    ''' float, whose repr() is read back the same by YAML '''
+    return re.fullmatch(_number_pattern, repr(value)) is not None
+
+
+def dump_waypoints(rows) -> str:
+    ''' YAML block of (x, y, theta) rows, the same as SafeDumper writes with default_flow_style=None '''
+    rows = list(rows)
+    if not rows:
+        return ''
+    values = list(chain.from_iterable(rows))
+    plain = set(map(type, values)) <= {int, float} and all(_is_plain(value) for value in values if type(value) is float)
+    if not plain:
+        return yaml.dump({waypoints_key: [list(row) for row in rows]}, Dumper=SafeDumper, default_flow_style=None)
+    return waypoints_key + ':\n' + ''.join(['- [%r, %r, %r]\n' % tuple(row) for row in rows])
+
+
+def split_waypoints(text):
+    ''' (YAML without waypoints block, waypoints block or '') '''
+    start = _block_start.search(text)
+    if start is None:
+        return text, ''
+    end = _block_end.search(text, start.end())
+    end = len(text) if end is None else end.start()
+    return text[:start.start()] + text[end:], text[start.start():end]
+
+
+def parse_waypoints(block) -> list:
+    ''' (x, y, theta) rows of waypoints block '''
+    if not block:
+        return []
+    rows = _row.findall(block)
+    lines = [line for line in block.splitlines()[1:] if line.strip() and not line.lstrip().startswith('#')]
+    if len(rows) == len(lines):
+        return [(_number(x), _number(y), _number(theta)) for x, y, theta in rows]
+    return [tuple(row) for row in (yaml.load(block, Loader=SafeLoader)[waypoints_key] or [])]
+
+
+def legacy_waypoints(parsed_yaml) -> list:
+    ''' (x, y, theta) rows of wp_<id> keys, ordered by id, the keys are removed from parsed_yaml '''
+    keys = [key for key in parsed_yaml if str(key).startswith(legacy_waypoint_prefix)]
+    keys.sort(key=lambda key: float(key[len(legacy_waypoint_prefix):]))
+    return [tuple(parsed_yaml.pop(key)) for key in keys]
+
+
+def load_map_yaml(text):
+    ''' (parsed map YAML without waypoints, (x, y, theta) rows of waypoints) '''
+    metadata, block = split_waypoints(text)
+    parsed_yaml = yaml.load(metadata, Loader=SafeLoader)
+    if block:
+        return parsed_yaml, parse_waypoints(block)
+    if parsed_yaml and waypoints_key in parsed_yaml:  # flow style or otherwise unusual layout
+        return parsed_yaml, [tuple(row) for row in (parsed_yaml.pop(waypoints_key) or [])]
+    return parsed_yaml, legacy_waypoints(parsed_yaml) if parsed_yaml else []
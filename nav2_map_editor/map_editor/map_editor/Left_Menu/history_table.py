@@ -1,70 +1,185 @@
 #!/usr/bin/python3
 
 # PyQT
-from PyQt5.QtWidgets import QWidget, QHBoxLayout, QLabel
-from PyQt5.QtWidgets import QTableWidget, QAbstractItemView
-from PyQt5.Qt import Qt
-from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtWidgets import QTableView, QAbstractItemView, QHeaderView
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import Qt
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QSize, pyqtSlot
 
 # Python
 import logging
+from collections import OrderedDict
 
 # Source files
-from map_editor.Helpers.helpers import Routine, rotation
+from map_editor.Helpers.helpers import Routine, raster_rotation
+from map_editor.Helpers.raster import MapRaster, image_view
+from map_editor.Helpers.jobs import JobScheduler
+from map_editor.Canvas.history import Patch, reconstruct
 
 # Constants
-from map_editor.Helpers.magic_gui_numbers import left_menu_width, history_box_column_width
+from map_editor.Helpers.magic_gui_numbers import left_menu_width, history_box_column_width, history_thumbnail_size
+from map_editor.Helpers.magic_gui_numbers import history_thumbnail_cache_size
 
 logger = logging.getLogger("map_editor")
 
 
-class HistoryCell(QWidget):
-    """
-    Widget that allows for pixmap + text to be shown in history cell
-    """
-    def __init__(self, pixmap, text, angle, parent=None):
-        QWidget.__init__(self, parent)
-
-        self.pixmap = pixmap
-        self.text = text
-        self.angle = angle
-
-        self.setLayout(QHBoxLayout())
-        self.lbPixmap = QLabel(self)
-        self.lbText = QLabel(self)
-        self.lbText.setAlignment(Qt.AlignCenter)
-
-        self.layout().addWidget(self.lbPixmap)
-        self.layout().addWidget(self.lbText)
-
-        self.initUi()
-
-    def initUi(self):
-        self.lbPixmap.setPixmap(self.pixmap.scaled(self.lbPixmap.size(), Qt.KeepAspectRatio))
-        self.lbText.setText(self.text)
-
-
-class HistoryTable(QTableWidget):
+def history_thumbnail(source, angle=0, progress=None):
+    '''
+    background job, QImage of at most history_thumbnail_size px, rotated by angle
+    of keyframe MapRaster, Patch, or History.recipe() of map, which is reconstructed here
+    '''
+    if isinstance(source, Patch):
+        array = source.array()  # has to outlive its view
+        image = image_view(array)
+    elif isinstance(source, MapRaster):
+        image = source.image
+    else:
+        raster = reconstruct(source, copy=False)  # has to outlive its image
+        image = raster.image
+    if progress is not None:
+        progress(0.5)
+    thumbnail = image.scaled(history_thumbnail_size, history_thumbnail_size, Qt.KeepAspectRatio,
+                             Qt.SmoothTransformation)
+    if progress is not None:
+        progress(0.9)
+    if angle:
+        # only thumbnail is rotated, full map is resampled by canvas when needed
+        return raster_rotation(MapRaster.from_image(thumbnail), angle).image.copy()
+    return thumbnail
+
+
+def entry_text(history_entry) -> str:
+    routine = Routine(history_entry.routine)
+    if routine == Routine.ANGLE:
+        return routine.name + ' ' + str(history_entry.angle) + '°'
+    if routine in (Routine.LOAD, Routine.CROP):
+        size = history_entry.raster.size()
+        return routine.name + ' ' + str(size.width()) + 'x' + str(size.height())
+    return routine.name
+
+
+class HistoryModel(QAbstractTableModel):
+    '''
+    One row per HistoryEntry, rows are added and removed incrementally by sync()
+    - thumbnails are made in background, only for rows the view asks for, and kept in bounded cache
+    '''
+    def __init__(self, history=None):
+        QAbstractTableModel.__init__(self)
+        self.history = history
+        self.uids = []  # uid of entry on each row
+        self.rows = {}  # uid -> row
+        self.thumbnails = OrderedDict()  # uid -> QPixmap, the least recently shown are dropped
+        self.generations = {}  # uid -> count of forgets, thumbnail of older generation is outdated
+        self.thumbnail_jobs = JobScheduler(max_threads=1)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.uids)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return entry_text(self.history[index.row()])
+        if role == Qt.DecorationRole:
+            return self.thumbnail(index.row())
+        return None
+
+    def sync(self) -> None:
+        ''' mirrors history, which may be truncated, appended and evicted from the front '''
+        entries = list(self.history) if self.history is not None else []
+        new_uids = [entry.uid for entry in entries]
+        kept = set(new_uids)
+        front_evicted = bool(self.uids) and self.uids[0] not in kept
+        for row in reversed(range(len(self.uids))):
+            if self.uids[row] not in kept:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                self._forget(self.uids.pop(row))
+                self.endRemoveRows()
+        for row, uid in enumerate(new_uids):
+            if row >= len(self.uids) or self.uids[row] != uid:
+                self.beginInsertRows(QModelIndex(), row, row)
+                self.uids.insert(row, uid)
+                self.endInsertRows()
+        self.rows = {uid: row for row, uid in enumerate(self.uids)}
+        self.generations = {uid: count for uid, count in self.generations.items() if uid in self.rows}
+        if front_evicted and self.uids:
+            # the oldest remaining entry became keyframe, its thumbnail is outdated
+            self._forget(self.uids[0])
+            self.dataChanged.emit(self.index(0, 0), self.index(0, 0))
+
+    def _forget(self, uid) -> None:
+        self.thumbnails.pop(uid, None)
+        self.thumbnail_jobs.cancel('thumbnail %d' % uid)
+        self.generations[uid] = self.generations.get(uid, 0) + 1
+
+    def thumbnail(self, row):
+        uid = self.uids[row]
+        pixmap = self.thumbnails.get(uid)
+        if pixmap is not None:
+            self.thumbnails.move_to_end(uid)
+            return pixmap
+        name = 'thumbnail %d' % uid
+        if not self.thumbnail_jobs.is_running(name):
+            history_entry = self.history[row]
+            if history_entry.is_keyframe:
+                source, angle = history_entry.raster, 0
+            elif history_entry.is_patch:
+                source, angle = history_entry.after, 0  # only the changed region is shown
+            else:
+                # map under rotation is reconstructed by the job, not here on GUI thread
+                source, angle = self.history.base_recipe(row), history_entry.angle
+            generation = self.generations.get(uid, 0)
+            self.thumbnail_jobs.submit(name, history_thumbnail, source, angle,
+                                       on_finished=lambda image: self.thumbnail_finished(uid, generation, image))
+        return None
+
+    def thumbnail_finished(self, uid, generation, image) -> None:
+        row = self.rows.get(uid)
+        if row is None or generation != self.generations.get(uid, 0):
+            return  # entry was removed or changed, while its thumbnail was made
+        self.thumbnails[uid] = QPixmap.fromImage(image)
+        while len(self.thumbnails) > history_thumbnail_cache_size:
+            self.thumbnails.popitem(last=False)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, 0), [Qt.DecorationRole])
+
+
+class HistoryTable(QTableView):
     def __init__(self, left_menu):
         super().__init__()
         logger.debug("HistoryTable created")
         self.left_menu = left_menu
+        self.history_model = HistoryModel()
+        self.setModel(self.history_model)
         self.horizontalHeader().setVisible(False)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(history_thumbnail_size)
+        self.setIconSize(QSize(history_thumbnail_size, history_thumbnail_size))
 
         self.setFixedWidth(left_menu_width)
         self.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.setSelectionMode(QAbstractItemView.SingleSelection)
-        self.setColumnCount(1)
         self.setColumnWidth(0, history_box_column_width)
 
-        self.cellClicked.connect(self.onCellClicked)
-        self.cellDoubleClicked.connect(self.onCellClicked)
+        self.clicked.connect(lambda index: self.onCellClicked(index.row()))
+        self.doubleClicked.connect(lambda index: self.onCellClicked(index.row()))
+
+    @property
+    def history(self):
+        return self.history_model.history
+
+    @history.setter
+    def history(self, history) -> None:
+        self.history_model.history = history
 
     @pyqtSlot(int)
     def onCellClicked(self, row):
         logger.debug("HistoryTable cell clicked")
-        cell_value = self.cellWidget(row, 0)
-        angle = cell_value.angle
+        if self.left_menu.canvas_instance.is_busy():
+            return
+        angle = self.history[row].angle
         self.left_menu.canvas_instance.angle = angle
         self.left_menu.canvas_instance.execute_latest_history(row + 1)
         self.left_menu.canvas_instance.history_current_idx = row
@@ -72,38 +187,5 @@ class HistoryTable(QTableWidget):
 
     def populate(self):
         logger.debug("HistoryTable populated")
-        self.setRowCount(len(self.history))
-
-        for history_idx, history_event in enumerate(self.history):
-            event_routine = history_event[0]
-            event_pixmap = history_event[1]
-            event_angle = history_event[2]
-
-            if event_routine == Routine.ANGLE.value:
-                cell_text = Routine.ANGLE.name + ' ' + str(event_angle) + '°'
-
-            elif event_routine == Routine.LOAD.value:
-                cell_text = Routine.LOAD.name + ' ' + str(event_pixmap.width()) + 'x' + str(event_pixmap.height())
-
-            elif event_routine == Routine.CROP.value:
-                cell_text = Routine.CROP.name + ' ' + str(event_pixmap.width()) + 'x' + str(event_pixmap.height())
-
-            elif event_routine == Routine.PAINT_BRUSH.value:
-                cell_text = Routine.PAINT_BRUSH.name
-                event_pixmap = rotation(event_pixmap, event_angle)
-
-            elif event_routine == Routine.PAINT_LINE.value:
-                cell_text = Routine.PAINT_LINE.name
-
-            elif event_routine == Routine.PAINT_RECT.value:
-                cell_text = Routine.PAINT_RECT.name
-                event_pixmap = rotation(event_pixmap, event_angle)
-
-            elif event_routine == Routine.GRAY.value:
-                cell_text = Routine.GRAY.name
-
-            cell_widget = HistoryCell(event_pixmap, cell_text, event_angle)
-            self.setCellWidget(history_idx, 0, cell_widget)
-
-        self.resizeRowsToContents()
+        self.history_model.sync()
         self.selectRow(self.left_menu.canvas_instance.history_current_idx)
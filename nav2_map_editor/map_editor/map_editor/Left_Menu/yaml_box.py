@@ -3,7 +3,7 @@
 # PyQT
 from PyQt5.QtWidgets import QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLabel
 from PyQt5.QtGui import QIcon
-from PyQt5.Qt import Qt
+from PyQt5.QtCore import Qt
 
 # Python
 import os
@@ -12,7 +12,7 @@ import logging
 
 # Source files
 from map_editor.Helpers.simple_focus_out_widgets import FocusOutLineEdit
-from map_editor.Helpers.default_map import default_yaml
+from map_editor.Helpers import default_map
 from map_editor.Helpers.helpers import correct_image_path
 
 # Constants
@@ -54,7 +54,7 @@ class YamlBox(QWidget):
         self.title = QLabel()
         self.left_menu = left_menu
         self.latest_yaml_name = 'default_map.yaml'
-        self.latest_yaml = default_yaml
+        self.latest_yaml = default_map.default_yaml
         self.flags = {  # used for disabling Save, when input is invalid, call self.update_flags()
             'yaml': True,
             'image': True,
@@ -3,7 +3,7 @@
 # PyQT
 from PyQt5.QtWidgets import QWidget, QPushButton, QHBoxLayout, QLabel
 from PyQt5.QtGui import QIntValidator
-from PyQt5.Qt import Qt
+from PyQt5.QtCore import Qt
 
 # Python
 import logging
@@ -11,6 +11,7 @@ import logging
 # Source files
 from map_editor.Helpers.simple_focus_out_widgets import FocusOutLineEdit
 from map_editor.Helpers.helpers import Routine
+from map_editor.Canvas.history import HistoryEntry
 
 # Constants
 from map_editor.Helpers.magic_gui_numbers import angle_button_dimensions, left_menu_width
@@ -62,11 +63,13 @@ class AngleBox(QWidget):
 
     def angle_set(self, angle_amount) -> None:
 
-        if self.canvas_instance.angle != angle_amount:
+        if self.canvas_instance.is_busy():
+            self.angle_entry.setText(str(self.canvas_instance.angle))
+        elif self.canvas_instance.angle != angle_amount:
             angle_amount %= 360
             self.canvas_instance.angle_rotate(angle_amount)
             self.canvas_instance.add_routine_cull_history(
-                (Routine.ANGLE.value, self.canvas_instance.pixmap, angle_amount))
+                HistoryEntry.rotation(Routine.ANGLE.value, angle_amount))
             self.canvas_instance.angle = angle_amount
             self.canvas_instance.updateStatusBar()
             self.angle_entry.setText(str(angle_amount))
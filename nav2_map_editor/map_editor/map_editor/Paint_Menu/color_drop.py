@@ -1,13 +1,9 @@
 #!/usr/bin/python3
 
-# External lib
-import qimage2ndarray
-import numpy as np
-
 # PyQT
 from PyQt5.QtWidgets import QWidget, QGridLayout, QLabel, QComboBox
-from PyQt5.QtGui import QPixmap, QIcon
-from PyQt5.Qt import Qt, QColor
+from PyQt5.QtGui import QPixmap, QIcon, QColor
+from PyQt5.QtCore import Qt
 
 # Python
 import logging
@@ -33,9 +29,9 @@ class ChangeColor(QWidget):
 
         def create_color_icon(_color, _width=color_icon_width, _height=color_icon_height) -> QIcon:
             '''Used to create rectangle icons of each color, used for drop down menu'''
-            _r, _g, _b, _ = QColor(_color).getRgb()
-            return QIcon(QPixmap.fromImage(qimage2ndarray.array2qimage(
-                (_r, _g, _b) * np.ones((_height, _width, 3), np.ubyte))))
+            pixmap = QPixmap(_width, _height)
+            pixmap.fill(QColor(QColor(_color).rgb()))  # opaque, as RGB image
+            return QIcon(pixmap)
 
         self.combo = QComboBox(self)
         for color_name, qt_color in colors.items():
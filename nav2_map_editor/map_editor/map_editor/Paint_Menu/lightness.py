@@ -5,7 +5,8 @@ import numpy as np
 
 # PyQT
 from PyQt5.QtWidgets import QWidget, QGridLayout, QLabel
-from PyQt5.Qt import Qt, QColor
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor
 
 # Python
 import logging
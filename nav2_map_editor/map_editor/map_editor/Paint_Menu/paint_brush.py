@@ -2,7 +2,7 @@
 
 # PyQT
 from PyQt5.QtWidgets import QWidget, QGridLayout, QLabel
-from PyQt5.Qt import Qt
+from PyQt5.QtCore import Qt
 
 # Python
 import logging
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+# External lib
+import numpy as np
+
+# PyQT
+from PyQt5.QtGui import QPen, QPolygonF, QFont, QFontMetricsF, QStaticText, QTransform
+from PyQt5.QtCore import QRectF, QPointF
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+# Python
+import logging
+from itertools import chain
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import default_color_text, default_color_shape_inside
+from map_editor.Helpers.magic_gui_numbers import default_color_shape_outline, waypoint_size
+from map_editor.Helpers.magic_gui_numbers import waypoint_grid_cell_size, waypoint_label_min_height
+from map_editor.Helpers.magic_gui_numbers import waypoint_label_chars
+
+logger = logging.getLogger("map_editor")
+
+
+class WaypointLayer(QGraphicsItem):
+    '''
+    All waypoints of the canvas drawn by single scene item
+    - positions are kept in numpy arrays, one slot per waypoint, slots are indexed by uniform grid,
+      so hit-testing and finding visible waypoints touch only the cells around, not every waypoint
+    - visible markers are drawn by two drawPoints() calls, labels only when they are readable at the zoom
+    - waypoints themselves are in canvas_instance.waypoints (WaypointStore), layer only draws them
+    '''
+
+    def __init__(self, canvas_instance, parent=None):
+        QGraphicsItem.__init__(self, parent)
+        self.canvas_instance = canvas_instance
+        self.store = canvas_instance.waypoints
+        self._reset()
+        self.font = QFont()
+        self.font_metrics = QFontMetricsF(self.font)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)  # fills option.exposedRect
+
+    # positions
+
+    def _reset(self, capacity=64) -> None:
+        self.xs = np.zeros(capacity)
+        self.ys = np.zeros(capacity)
+        self.slots = [None] * capacity  # slot -> Waypoint
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.grid = {}  # (column, row) of cell -> set of slots
+        self.bounds = QRectF()  # of all waypoint positions, not shrunk on removal
+        self.dragged = None  # Waypoint moved by mouse
+        self.labels = {}  # id -> QStaticText, laid out once
+
+    @staticmethod
+    def _cell(x, y):
+        return int(x // waypoint_grid_cell_size), int(y // waypoint_grid_cell_size)
+
+    def _reserve(self, count) -> None:
+        ''' arrays are grown, at least twice, when there are less than count free slots '''
+        if len(self.free_slots) >= count:
+            return
+        capacity = len(self.slots)
+        grown = max(2 * capacity, capacity + count - len(self.free_slots))
+        self.xs = np.concatenate((self.xs, np.zeros(grown - capacity)))
+        self.ys = np.concatenate((self.ys, np.zeros(grown - capacity)))
+        self.slots.extend([None] * (grown - capacity))
+        self.free_slots = list(range(grown - 1, capacity - 1, -1)) + self.free_slots
+
+    def add(self, waypoint) -> None:
+        self._reserve(1)
+        waypoint.slot = self.free_slots.pop()
+        self.slots[waypoint.slot] = waypoint
+        self._place(waypoint, waypoint.x, waypoint.y)
+
+    def add_many(self, waypoints) -> None:
+        ''' the same as add() for each waypoint, with single geometry change and repaint '''
+        if not waypoints:
+            return
+        self._reserve(len(waypoints))
+        slots = self.free_slots[-len(waypoints):][::-1]
+        del self.free_slots[-len(waypoints):]
+        xs = np.array([waypoint.x for waypoint in waypoints], dtype=np.float64)
+        ys = np.array([waypoint.y for waypoint in waypoints], dtype=np.float64)
+        self.xs[slots], self.ys[slots] = xs, ys
+        columns = (xs // waypoint_grid_cell_size).astype(int).tolist()
+        rows = (ys // waypoint_grid_cell_size).astype(int).tolist()
+        for waypoint, slot, column, row in zip(waypoints, slots, columns, rows):
+            waypoint.slot = slot
+            self.slots[slot] = waypoint
+            self.grid.setdefault((column, row), set()).add(slot)
+        added = QRectF(xs.min(), ys.min(), xs.max() - xs.min() + 1, ys.max() - ys.min() + 1)
+        self.prepareGeometryChange()
+        self.bounds = added if self.bounds.isNull() else self.bounds.united(added)
+        self.update()
+
+    def remove(self, waypoint) -> None:
+        self.grid[self._cell(waypoint.x, waypoint.y)].discard(waypoint.slot)
+        self.slots[waypoint.slot] = None
+        self.free_slots.append(waypoint.slot)
+        self.labels.pop(waypoint.id, None)
+        if self.dragged is waypoint:
+            self.dragged = None
+        self.update(self._waypoint_rect(waypoint.x, waypoint.y))
+
+    def move(self, waypoint, x, y) -> None:
+        self.grid[self._cell(waypoint.x, waypoint.y)].discard(waypoint.slot)
+        self.update(self._waypoint_rect(waypoint.x, waypoint.y))
+        self._place(waypoint, x, y)
+
+    def clear(self) -> None:
+        self.prepareGeometryChange()
+        self._reset()
+
+    def _place(self, waypoint, x, y) -> None:
+        waypoint.x, waypoint.y = x, y
+        self.xs[waypoint.slot], self.ys[waypoint.slot] = x, y
+        self.grid.setdefault(self._cell(x, y), set()).add(waypoint.slot)
+        point = QRectF(x, y, 1, 1)
+        if not self.bounds.contains(point):
+            self.prepareGeometryChange()
+            self.bounds = point if self.bounds.isNull() else self.bounds.united(point)
+        self.update(self._waypoint_rect(x, y))
+
+    def visible_slots(self, rect) -> np.ndarray:
+        ''' slots of waypoints in rect, only cells intersecting it are visited '''
+        left, top = self._cell(rect.left(), rect.top())
+        right, bottom = self._cell(rect.right(), rect.bottom())
+        if (right - left + 1) * (bottom - top + 1) > len(self.grid):
+            cells = [cell for cell in self.grid if left <= cell[0] <= right and top <= cell[1] <= bottom]
+        else:
+            cells = [(column, row) for column in range(left, right + 1) for row in range(top, bottom + 1)
+                     if (column, row) in self.grid]
+        slots = np.fromiter(chain.from_iterable(self.grid[cell] for cell in cells), dtype=np.intp)
+        xs, ys = self.xs[slots], self.ys[slots]
+        inside = (xs >= rect.left()) & (xs <= rect.right()) & (ys >= rect.top()) & (ys <= rect.bottom())
+        return slots[inside]
+
+    def hit(self, point):
+        ''' waypoint, whose marker is under point, the nearest one, None if there is no such '''
+        radius = waypoint_size
+        position = point - QPointF(waypoint_size, waypoint_size)  # markers are drawn right below positions
+        slots = self.visible_slots(QRectF(position.x() - radius, position.y() - radius, 2 * radius, 2 * radius))
+        if not len(slots):
+            return None
+        distances = (self.xs[slots] - position.x()) ** 2 + (self.ys[slots] - position.y()) ** 2
+        nearest = int(np.argmin(distances))
+        return self.slots[slots[nearest]] if distances[nearest] <= radius ** 2 else None
+
+    # painting
+
+    def label_size(self):
+        ''' (width, height) of the longest expected label, in map px, text document margin included '''
+        label_width = self.font_metrics.horizontalAdvance('0' * waypoint_label_chars)
+        return self.store.text_size * (8 + label_width), self.store.text_size * (8 + self.font_metrics.height())
+
+    def _margins(self, labels=True):
+        ''' how far from its position waypoint is drawn (left, top, right, bottom), labels go right and down '''
+        width, height = self.label_size() if labels else (0, 0)
+        return 1, 5, width + 2 * waypoint_size, height + 2 * waypoint_size
+
+    def _waypoint_rect(self, x, y) -> QRectF:
+        left, top, right, bottom = self._margins()
+        return QRectF(x - left, y - top, left + right, top + bottom)
+
+    def boundingRect(self) -> QRectF:
+        if self.bounds.isNull():
+            return QRectF()
+        left, top, right, bottom = self._margins()
+        return self.bounds.adjusted(-left, -top, right, bottom)
+
+    def contains(self, point) -> bool:
+        return self.hit(point) is not None
+
+    def paint(self, painter, option, widget=None) -> None:
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        draw_labels = self.store.showing_text and \
+            lod * self.store.text_size * self.font_metrics.height() >= waypoint_label_min_height
+        left, top, right, bottom = self._margins(labels=False)
+        slots = self.visible_slots(option.exposedRect.adjusted(-right, -bottom, left, top))
+
+        # markers, centers are shifted by waypoint_size from positions
+        markers = QPolygonF(len(slots))
+        buffer = markers.data()
+        buffer.setsize(len(slots) * 2 * 8)
+        centers = np.frombuffer(buffer, dtype=np.float64).reshape(len(slots), 2)
+        centers[:, 0] = self.xs[slots] + waypoint_size
+        centers[:, 1] = self.ys[slots] + waypoint_size
+        painter.setPen(QPen(default_color_shape_outline, waypoint_size + 1, Qt.SolidLine, Qt.RoundCap))
+        painter.drawPoints(markers)
+        painter.setPen(QPen(default_color_shape_inside, waypoint_size - 1, Qt.SolidLine, Qt.RoundCap))
+        painter.drawPoints(markers)
+
+        if draw_labels:
+            # labels are placed as scaled QGraphicsTextItem at (1.5, -4.5) from position, with margin 4
+            left, top, right, bottom = self._margins()
+            slots = self.visible_slots(option.exposedRect.adjusted(-right, -bottom, left, top))
+            scale = self.store.text_size
+            painter.setFont(self.font)
+            painter.setPen(default_color_text)
+            painter.scale(scale, scale)
+            for slot in slots:
+                waypoint = self.slots[slot]
+                label = self.labels.get(waypoint.id)
+                if label is None:
+                    label = self.labels[waypoint.id] = QStaticText(str(waypoint.id))
+                    label.prepare(QTransform(), self.font)
+                painter.drawStaticText(QPointF((waypoint.x + 1.5) / scale + 4, (waypoint.y - 4.5) / scale + 4), label)
+            painter.scale(1 / scale, 1 / scale)
+
+    # display settings
+
+    def set_movable(self, movable) -> None:
+        self.store.movable = movable
+
+    def show_indexes(self, does_show) -> None:
+        self.store.showing_text = does_show
+        self.update()
+
+    def set_text_size(self, size_value) -> None:
+        self.prepareGeometryChange()
+        self.store.text_size = size_value
+        self.update()
+
+    def reindex(self) -> None:
+        self.store.reindex()
+        self.labels.clear()
+        self.update()
+
+    # mouse, waypoint under cursor is deleted by right click and dragged when movable
+
+    def mousePressEvent(self, event) -> None:
+        waypoint = self.hit(event.pos())
+        if waypoint is not None and event.button() == Qt.RightButton:
+            self.canvas_instance.delete_specific_waypoint(waypoint.id)
+        elif waypoint is not None and event.button() == Qt.LeftButton:
+            self.dragged = waypoint
+        else:
+            event.ignore()
+
+    def mouseMoveEvent(self, event) -> None:
+        if self.dragged is None or not self.store.movable:
+            return
+        self.move(self.dragged, round(event.scenePos().x()), round(event.scenePos().y()))
+        self.canvas_instance.main_widget.waypoint_menu.waypoint_table.refresh_specific_waypoint(
+            self.store.index(self.dragged.id))
+
+    def mouseReleaseEvent(self, event) -> None:
+        self.dragged = None
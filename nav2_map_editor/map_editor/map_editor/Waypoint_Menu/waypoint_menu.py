@@ -4,7 +4,7 @@
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QPushButton, QWidget
 from PyQt5.QtWidgets import QGridLayout, QLabel, QTableWidget
-from PyQt5.Qt import Qt
+from PyQt5.QtCore import Qt
 
 # Python
 import logging
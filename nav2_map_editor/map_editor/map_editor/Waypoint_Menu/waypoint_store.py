@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+
+# Python
+import logging
+from bisect import bisect_left, insort
+from decimal import Decimal, ROUND_FLOOR
+
+# Source files
+from map_editor.Helpers.helpers import AddingPosition
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import waypoint_store_bucket_size, waypoint_order_gap
+from map_editor.Helpers.magic_gui_numbers import waypoint_relabel_density
+
+logger = logging.getLogger("map_editor")
+
+
+def label_between(low, high=None) -> Decimal:
+    '''
+    Shortest exact decimal id after low (and below high, if given), used for waypoint added after low
+    3 -> 3.1, 3.1 -> 3.2, 3.9 -> 3.91 (when 4 follows), 3 -> 3.01 (when 3.1 follows)
+    '''
+    low = Decimal(str(low))
+    step = Decimal('0.1')
+    while True:
+        label = (low / step).to_integral_value(ROUND_FLOOR) * step + step
+        if high is None or label < high:
+            return label
+        step = step.scaleb(-1)
+
+
+class WaypointStore:
+    '''
+    Waypoints of one canvas, in route order
+    - route order is kept by integer order keys with gaps (order-maintenance labels), waypoint ids are
+      only shown to the user, they grow in the same order, but nothing is computed from their digits
+    - keys are kept sorted in buckets (like sortedcontainers.SortedList), bucket lengths are summed by
+      Fenwick tree, so lookup, row of waypoint, waypoint of row, insert and delete are O(log n)
+    - when there is no gap between neighbours, the smallest aligned key range which is sparse enough is
+      respaced, amortized O(log n) keys are changed per insert, rows and export order stay the same
+    - display settings shared by the waypoints of the canvas are kept here as well, WaypointLayer changes them
+    '''
+    def __init__(self, bucket_size=waypoint_store_bucket_size):
+        self.bucket_size = bucket_size
+        self.items = {}  # id -> Waypoint
+        self.by_order = {}  # order key -> Waypoint
+        self.buckets = []  # sorted lists of order keys, at most 2 * bucket_size long
+        self.maxes = []  # the last key of each bucket
+        self.tree = [0]  # Fenwick tree of bucket lengths
+
+        self.movable = False
+        self.showing_text = True
+        self.text_size = 3
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            for order in bucket:
+                yield self.by_order[order]
+
+    def __contains__(self, wp_id) -> bool:
+        return wp_id in self.items
+
+    def __getitem__(self, row):
+        ''' waypoint on row of table '''
+        if row < 0:
+            row += len(self.items)
+        if not 0 <= row < len(self.items):
+            raise IndexError(row)
+        bucket_idx, offset = self._locate(row)
+        return self.by_order[self.buckets[bucket_idx][offset]]
+
+    def get(self, wp_id):
+        return self.items.get(wp_id)
+
+    def first(self):
+        return self.by_order[self.buckets[0][0]] if self.buckets else None
+
+    def last(self):
+        return self.by_order[self.buckets[-1][-1]] if self.buckets else None
+
+    # Fenwick tree of bucket lengths
+
+    def _prefix(self, bucket_idx) -> int:
+        ''' count of keys in buckets before bucket_idx '''
+        total = 0
+        while bucket_idx:
+            total += self.tree[bucket_idx]
+            bucket_idx &= bucket_idx - 1
+        return total
+
+    def _update(self, bucket_idx, delta) -> None:
+        bucket_idx += 1
+        while bucket_idx < len(self.tree):
+            self.tree[bucket_idx] += delta
+            bucket_idx += bucket_idx & -bucket_idx
+
+    def _rebuild_tree(self) -> None:
+        self.tree = [0] + [len(bucket) for bucket in self.buckets]
+        for idx in range(1, len(self.tree)):
+            parent = idx + (idx & -idx)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[idx]
+
+    def _locate(self, row):
+        ''' (bucket index, offset in bucket) of row, Fenwick tree descent '''
+        bucket_idx, step = 0, 1 << (len(self.buckets).bit_length() - 1)
+        while step:
+            if bucket_idx + step <= len(self.buckets) and self.tree[bucket_idx + step] <= row:
+                bucket_idx += step
+                row -= self.tree[bucket_idx]
+            step >>= 1
+        return bucket_idx, row
+
+    # ordering
+
+    def rank(self, order) -> int:
+        ''' count of waypoints with lower order key '''
+        bucket_idx = bisect_left(self.maxes, order)
+        if bucket_idx == len(self.buckets):
+            return len(self.items)
+        return self._prefix(bucket_idx) + bisect_left(self.buckets[bucket_idx], order)
+
+    def index(self, wp_id) -> int:
+        ''' row of waypoint '''
+        return self.rank(self.items[wp_id].order)
+
+    def id_rank(self, wp_id) -> int:
+        ''' count of waypoints with id not greater than wp_id, ids grow with rows '''
+        low, high = 0, len(self.items)
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle].id <= wp_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _respace(self, order):
+        '''
+        makes gap after key order, by spreading keys of the smallest aligned key range around it,
+        which has less than density ** -level of keys in it (Bender et al., order-maintenance)
+        '''
+        level = 1
+        while True:
+            level += 1
+            low = (order >> level) << level
+            high = low + (1 << level)
+            first_row, end_row = self.rank(low), self.rank(high)
+            if end_row - first_row + 1 < waypoint_relabel_density ** level:
+                break
+        spacing = (1 << level) // (end_row - first_row + 1)
+        positions = []  # (bucket index, offset) of keys in the range
+        bucket_idx, offset = self._locate(first_row)
+        for _ in range(end_row - first_row):
+            positions.append((bucket_idx, offset))
+            offset += 1
+            if offset == len(self.buckets[bucket_idx]):
+                bucket_idx, offset = bucket_idx + 1, 0
+        # all old keys are dropped first, new key may equal old key of another waypoint
+        waypoints = [self.by_order.pop(self.buckets[bucket_idx][offset]) for bucket_idx, offset in positions]
+        for row, ((bucket_idx, offset), waypoint) in enumerate(zip(positions, waypoints)):
+            waypoint.order = low + row * spacing
+            self.buckets[bucket_idx][offset] = waypoint.order
+            self.by_order[waypoint.order] = waypoint
+        for bucket_idx in {bucket_idx for bucket_idx, _ in positions}:
+            self.maxes[bucket_idx] = self.buckets[bucket_idx][-1]
+        logger.debug("Waypoint keys respaced: %d" % len(waypoints))
+
+    def _order_for_row(self, row) -> int:
+        ''' new key between waypoints on row - 1 and row '''
+        if not self.items:
+            return 0
+        if row == 0:
+            return self.first().order - waypoint_order_gap
+        if row == len(self.items):
+            return self.last().order + waypoint_order_gap
+        previous, following = self[row - 1].order, self[row].order
+        if following - previous < 2:
+            self._respace(previous)
+            previous, following = self[row - 1].order, self[row].order
+        return (previous + following) // 2
+
+    def insert(self, waypoint, row) -> int:
+        ''' adds waypoint on row, rows of the following waypoints shift by one, returns row '''
+        if waypoint.id in self.items:
+            raise KeyError("Duplicate waypoint id: %s" % waypoint.id)
+        waypoint.order = self._order_for_row(row)
+        self.items[waypoint.id] = waypoint
+        self.by_order[waypoint.order] = waypoint
+        if not self.buckets:
+            self.buckets, self.maxes = [[waypoint.order]], [waypoint.order]
+            self._rebuild_tree()
+            return row
+        bucket_idx = min(bisect_left(self.maxes, waypoint.order), len(self.buckets) - 1)
+        bucket = self.buckets[bucket_idx]
+        insort(bucket, waypoint.order)
+        self.maxes[bucket_idx] = bucket[-1]
+        if len(bucket) > 2 * self.bucket_size:
+            self.buckets[bucket_idx:bucket_idx + 1] = [bucket[:self.bucket_size], bucket[self.bucket_size:]]
+            self.maxes[bucket_idx:bucket_idx + 1] = [bucket[self.bucket_size - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._update(bucket_idx, 1)
+        return row
+
+    def add(self, waypoint) -> int:
+        ''' adds waypoint on row given by its id, returns row '''
+        return self.insert(waypoint, self.id_rank(waypoint.id))
+
+    def remove(self, wp_id):
+        ''' returns removed waypoint '''
+        waypoint = self.items.pop(wp_id)
+        del self.by_order[waypoint.order]
+        bucket_idx = bisect_left(self.maxes, waypoint.order)
+        bucket = self.buckets[bucket_idx]
+        del bucket[bisect_left(bucket, waypoint.order)]
+        if bucket:
+            self.maxes[bucket_idx] = bucket[-1]
+            self._update(bucket_idx, -1)
+        else:
+            del self.buckets[bucket_idx], self.maxes[bucket_idx]
+            self._rebuild_tree()
+        return waypoint
+
+    def reset(self, waypoints=()) -> None:
+        ''' replaces all waypoints at once, they are kept in given order, keys are spaced evenly '''
+        waypoints = list(waypoints)
+        self.items = {waypoint.id: waypoint for waypoint in waypoints}
+        self.by_order = {}
+        for row, waypoint in enumerate(waypoints):
+            waypoint.order = row * waypoint_order_gap
+            self.by_order[waypoint.order] = waypoint
+        keys = list(self.by_order)
+        self.buckets = [keys[start:start + self.bucket_size] for start in range(0, len(keys), self.bucket_size)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self._rebuild_tree()
+
+    def clear(self) -> None:
+        self.reset()
+
+    def generate_id(self, adding_position):
+        ''' returns (id, row) of new waypoint, adding_position is AddingPosition or id to add after '''
+        if not self.items:
+            return 1, 0
+        if adding_position == AddingPosition.START.value:
+            return self.first().id - 1, 0
+        elif adding_position == AddingPosition.END.value:
+            return self.last().id + 1, len(self.items)
+        else:
+            row = self.id_rank(adding_position)
+            following = self[row].id if row < len(self.items) else None
+            return label_between(adding_position, following), row
+
+    def reindex(self) -> None:
+        ''' ids become integers starting from 1, order is kept '''
+        waypoints = list(self)
+        self.items = {}
+        for idx, wp in enumerate(waypoints):
+            wp.id = idx + 1
+            self.items[wp.id] = wp
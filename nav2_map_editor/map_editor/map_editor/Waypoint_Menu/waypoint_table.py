@@ -1,83 +1,117 @@
 #!/usr/bin/python3
 
 # PyQT
-from PyQt5.QtWidgets import QWidget
-from PyQt5.QtWidgets import QHBoxLayout, QLabel, QTableWidget
-from PyQt5.Qt import Qt
+from PyQt5.QtWidgets import QTableView, QStyledItemDelegate, QStyleOptionButton, QStyle, QApplication
+from PyQt5.QtWidgets import QHeaderView
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QEvent, QRect, pyqtSignal
+from PyQt5.QtCore import Qt
 
 # Python
 import logging
-from map_editor.Helpers.simple_focus_out_widgets import FocusOutButton
-
-# Source files
-from map_editor.Waypoint_Menu.waypoint_class import Waypoint
 
 # Constants
 from map_editor.Helpers.magic_gui_numbers import waypoint_menu_width, waypoint_column_width
+from map_editor.Helpers.magic_gui_numbers import waypoint_delete_button_size
 
 logger = logging.getLogger("map_editor")
 
 
-class WaypointCell(QWidget):
-    """Cell widget in waypoint table"""
-    def __init__(self, canvas_instance, wp_value, parent=None):
-        QWidget.__init__(self, parent)
-
-        self.canvas_instance = canvas_instance
-        cell_layout = QHBoxLayout()
-
-        cell_text = str(wp_value.x) + 'x' + str(wp_value.y)
-        self.cell_text_label = QLabel(self)
-        self.cell_text_label.setText(cell_text)
-
-        self.delete_button = FocusOutButton(canvas_instance)
-        self.delete_button.setFixedWidth(16)
-        self.delete_button.setFixedHeight(16)
-        self.delete_button.setText("X")
-
-        def delete():
-            logger.debug("Waypoint with id: " + str(wp_value.id) + " deleted")
-            self.canvas_instance.delete_specific_waypoint(wp_value.id)
-
-        self.delete_button.clicked.connect(delete)
-
-        cell_layout.addWidget(self.cell_text_label)
-        cell_layout.addWidget(self.delete_button)
-        cell_layout.setAlignment(Qt.AlignLeft)
-        self.setLayout(cell_layout)
-
-
-class WaypointTable(QTableWidget):
+class WaypointModel(QAbstractTableModel):
+    '''
+    Rows of WaypointStore, in route order
+    - single waypoint changes notify only its row, bulk changes (load, clear) reset the model once
+    '''
+    def __init__(self, store):
+        QAbstractTableModel.__init__(self)
+        self.store = store
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.store)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role == Qt.DisplayRole:
+            wp_value = self.store[index.row()]
+            return str(wp_value.x) + 'x' + str(wp_value.y)
+        return None
+
+    def insert(self, waypoint, row) -> None:
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.store.insert(waypoint, row)
+        self.endInsertRows()
+
+    def remove(self, wp_id):
+        ''' returns removed waypoint '''
+        row = self.store.index(wp_id)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        waypoint = self.store.remove(wp_id)
+        self.endRemoveRows()
+        return waypoint
+
+    def refresh(self, row) -> None:
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def reset(self) -> None:
+        self.beginResetModel()
+        self.endResetModel()
+
+
+class WaypointDelegate(QStyledItemDelegate):
+    '''
+    Paints coordinates and delete button of waypoint row, no widget is created per row
+    '''
+    deleteClicked = pyqtSignal(int)  # row
+
+    @staticmethod
+    def button_rect(option_rect) -> QRect:
+        size = waypoint_delete_button_size
+        return QRect(option_rect.right() - size - 2, option_rect.center().y() - size // 2, size, size)
+
+    def paint(self, painter, option, index) -> None:
+        QStyledItemDelegate.paint(self, painter, option, index)
+        button = QStyleOptionButton()
+        button.rect = self.button_rect(option.rect)
+        button.text = "X"
+        button.state = QStyle.State_Enabled
+        QApplication.style().drawControl(QStyle.CE_PushButton, button, painter)
+
+    def editorEvent(self, event, model, option, index) -> bool:
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton \
+                and self.button_rect(option.rect).contains(event.pos()):
+            self.deleteClicked.emit(index.row())
+            return True
+        return QStyledItemDelegate.editorEvent(self, event, model, option, index)
+
+
+class WaypointTable(QTableView):
     def __init__(self, canvas_instance):
         super().__init__()
         logger.debug("Waypoint table created")
         self.canvas_instance = canvas_instance
-        self.setColumnCount(1)
+        self.waypoint_model = WaypointModel(canvas_instance.waypoints)
+        self.setModel(self.waypoint_model)
+        self.delegate = WaypointDelegate(self)
+        self.setItemDelegate(self.delegate)
+        self.delegate.deleteClicked.connect(self.delete_row)
         self.horizontalHeader().setVisible(False)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.setMinimumWidth(waypoint_menu_width)
         self.setMaximumWidth(waypoint_menu_width)
         self.setColumnWidth(0, waypoint_column_width)
 
+    def delete_row(self, row) -> None:
+        wp_value = self.canvas_instance.waypoints[row]
+        logger.debug("Waypoint with id: " + str(wp_value.id) + " deleted")
+        self.canvas_instance.delete_specific_waypoint(wp_value.id)
 
     def populate(self):
+        ''' whole table is rebuilt, used after bulk changes of waypoints '''
         logger.debug("Populate waypoint table")
-        Waypoint.sort_waypoints_by_id()
-        wpc = Waypoint.waypoint_container
-        self.setRowCount(len(wpc))
-
-        for wp_idx, wp_value in enumerate(wpc):
-            def cell(wp_idx=wp_idx, wp_value=wp_value):
-                # this function is needed for capturing value each iteration
-                _cell_widget = WaypointCell(self.canvas_instance, wp_value=wp_value)
-                return _cell_widget          
-            self.setCellWidget(wp_idx, 0, cell())
-
+        self.waypoint_model.reset()
         self.scrollToBottom()
 
-    # def refresh_specific_waypoint(self, wp_idx):
-    #     wp = Waypoint.waypoint_container[wp_idx]
-    #     cell_text = str(wp.x) + ' ' + str(wp.y)
-    #     cell_widget = QLabel()
-    #     cell_widget.setText(cell_text)
-    #     self.setCellWidget(wp_idx, 0, cell_widget)
-
+    def refresh_specific_waypoint(self, wp_idx):
+        self.waypoint_model.refresh(wp_idx)
@@ -3,13 +3,13 @@
 # PyQT
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QWidget, QRadioButton, QGridLayout, QLabel, QSlider
-from PyQt5.Qt import Qt
+from PyQt5.QtCore import Qt
 
 # Python
 import logging
+from decimal import Decimal, InvalidOperation
 
 # Source files
-from map_editor.Waypoint_Menu.waypoint_class import Waypoint
 from map_editor.Helpers.simple_focus_out_widgets import FocusOutLineEdit, FocusOutButton
 from map_editor.Helpers.helpers import AddingPosition
 
@@ -46,17 +46,17 @@ class WaypointChoices(QWidget):
             line_edit = self.radio3_line_edit.text()
             if not line_edit:
                 self.canvas_instance.waypoint_adding_position = 0
-                Waypoint.waypoint_adding_position = 0
             else:
                 try:
-                    line_edit = float(line_edit)
+                    line_edit = Decimal(line_edit)
+                    if not line_edit.is_finite():
+                        raise InvalidOperation(line_edit)
                     self.radio3_line_edit.setStyleSheet(success_background)
                     self.button.setEnabled(True)
-                except ValueError:
+                except InvalidOperation:
                     self.radio3_line_edit.setStyleSheet(error_background)
                     self.button.setEnabled(False)
                     self.canvas_instance.adding_waypoint = False
-                Waypoint.waypoint_adding_position = line_edit
                 self.canvas_instance.waypoint_adding_position = line_edit
 
         self.radio3_line_edit.textChanged.connect(line_edit_update_adding_position)
@@ -79,18 +79,19 @@ class WaypointChoices(QWidget):
                     position = 0
                 else:
                     try:
-                        line_edit = float(line_edit)
+                        line_edit = Decimal(line_edit)
+                        if not line_edit.is_finite():
+                            raise InvalidOperation(line_edit)
                         self.radio3_line_edit.setStyleSheet(success_background)
                         self.button.setEnabled(True)
                         position = line_edit
-                    except ValueError:
+                    except InvalidOperation:
                         self.radio3_line_edit.setStyleSheet(error_background)
                         self.button.setEnabled(False)
                         self.canvas_instance.adding_waypoint = False
                         position = AddingPosition.END.value
 
 
-            Waypoint.waypoint_adding_position = position
             self.canvas_instance.waypoint_adding_position = position
 
         self.radio1.clicked.connect(change_adding_type)
@@ -123,13 +124,14 @@ class WaypointChoices(QWidget):
         self.wp_size_slider.setSingleStep(1)
         self.wp_size_slider.setRange(1, 12)
         self.wp_size_slider.setValue(wp_default_text_size)
-        Waypoint.waypoint_text_size = wp_default_text_size/wp_text_size_divider
+        self.canvas_instance.waypoints.text_size = wp_default_text_size/wp_text_size_divider
 
         def reindex():
             # resets the indexes of waypoints, so they are integers starting from 1
-            Waypoint.reindex_waypoint()
-            if Waypoint.waypoint_container:
-                self.radio3_line_edit.setText(str(Waypoint.waypoint_container[-1].id))
+            waypoints = self.canvas_instance.waypoints
+            self.canvas_instance.waypoint_layer.reindex()
+            if waypoints:
+                self.radio3_line_edit.setText(str(waypoints.last().id))
                 self.canvas_instance.populate_waypoint_table()
 
         self.reindex_button.clicked.connect(reindex)     
@@ -138,19 +140,17 @@ class WaypointChoices(QWidget):
 
         def show_indexes():
             if self.show_idx_button.isChecked():
-                Waypoint.show_indexes(True)
-                Waypoint.waypoint_showing_text = True
+                self.canvas_instance.waypoint_layer.show_indexes(True)
                 self.wp_size_slider.setEnabled(True)
             else:
-                Waypoint.show_indexes(False)
-                Waypoint.waypoint_showing_text = False
+                self.canvas_instance.waypoint_layer.show_indexes(False)
                 self.wp_size_slider.setEnabled(False)
 
         self.show_idx_button.clicked.connect(show_indexes)
 
         def change_wp_size(size_value):
             # changes waypoint font size
-            Waypoint.change_waypoint_text_size(size_value/wp_text_size_divider)
+            self.canvas_instance.waypoint_layer.set_text_size(size_value/wp_text_size_divider)
             self.canvas_instance.setFocus(Qt.OtherFocusReason)
 
         self.wp_size_slider.valueChanged.connect(lambda: change_wp_size(self.wp_size_slider.value()))
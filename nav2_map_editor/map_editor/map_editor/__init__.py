@@ -1,3 +1,6 @@
+import time
+started = time.perf_counter()  # startup report of main_entry_point() counts from the first import
+
 from map_editor.main import main_entry_point
 
 def init_entry_point():
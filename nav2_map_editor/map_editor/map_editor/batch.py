@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+'''
+Headless batch processing of maps, no window is created
+
+    map_editor_batch recipe.yaml map_a.yaml map_b.yaml ... --output processed --jobs 4
+
+Recipe is YAML list of steps, applied to every map in order, each step is Routine name with its arguments:
+
+    - CROP: [x, y, width, height]
+    - ANGLE: 30                                         # degrees clockwise, same as the angle box
+    - PAINT_RECT: {rect: [x, y, width, height], color: Black}
+    - PAINT_LINE: {points: [[x1, y1], [x2, y2]], color: [20, 88, 134], width: 10}
+    - PAINT_BRUSH: {points: [[x1, y1], [x2, y2], ...], color: Nav2-blue, width: 10, lightness: 40}
+    - GRAY
+
+color is name from colors palette or [r, g, b], lightness is % of max speed, same as in Paint menu.
+Results are written in map_server format, YAML and grayscale PGM named after the input YAML.
+Every result is read back as map_server reads it, with mode, negate and thresholds of its YAML,
+a map, which map_server would fail to load, fails the batch.
+'''
+
+# External lib
+import numpy as np
+import yaml  # pip pyaml
+
+# PyQT
+from PyQt5.QtGui import QPainter, QPen, QBrush, QColor
+from PyQt5.QtCore import QPoint, QRect
+from PyQt5.QtCore import Qt
+
+# Python
+import os
+import sys
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Source files
+from map_editor.Helpers.helpers import Routine, create_logger, dict2str, raster_rotation
+from map_editor.Helpers.colors_helpers import colors, change_lightness
+from map_editor.Helpers.raster import MapRaster
+from map_editor.Helpers.map_io import load_map_image, save_map, load_occupancy
+from map_editor.Helpers.map_io import occ_grid_free, occ_grid_occupied
+from map_editor.Helpers.waypoint_io import load_map_yaml, dump_waypoints
+
+logger = logging.getLogger("map_editor")
+
+geometry_routines = (Routine.CROP.name, Routine.ANGLE.name)  # waypoints are dropped by these, as in the editor
+
+
+def parse_recipe(steps) -> list:
+    ''' validates recipe loaded from YAML, returns list of (Routine name, arguments) '''
+    if not isinstance(steps, list):
+        raise ValueError("Recipe has to be list of steps")
+    recipe = []
+    for step in steps:
+        if isinstance(step, str):
+            routine_name, arguments = step, None
+        elif isinstance(step, dict) and len(step) == 1:
+            routine_name, arguments = next(iter(step.items()))
+        else:
+            raise ValueError("Invalid step: %s" % step)
+        if routine_name not in step_functions:
+            raise ValueError("Unsupported routine: %s" % routine_name)
+        recipe.append((routine_name, arguments))
+    return recipe
+
+
+def step_color(arguments) -> QColor:
+    color = arguments.get('color', 'Nav2-blue')
+    color = QColor(colors[color]) if isinstance(color, str) else QColor(*color)
+    if 'lightness' in arguments:
+        color = QColor(*change_lightness(color, np.interp(arguments['lightness'], [0, 100], [0, 255])))
+    return color
+
+
+def crop_step(raster, arguments) -> MapRaster:
+    rect = QRect(*arguments).intersected(raster.rect())
+    if rect.isEmpty():
+        raise ValueError("Crop %s is outside of the map" % arguments)
+    return raster.copy(rect)
+
+
+def angle_step(raster, arguments) -> MapRaster:
+    return raster_rotation(raster, arguments)
+
+
+def gray_step(raster, arguments) -> MapRaster:
+    raster.grayscale()
+    return raster
+
+
+def paint_rect_step(raster, arguments) -> MapRaster:
+    color = step_color(arguments)
+    painter = QPainter(raster.image)
+    painter.setPen(QPen(color, 1))
+    painter.setBrush(QBrush(color, Qt.SolidPattern))
+    painter.drawRect(QRect(*arguments['rect']))
+    painter.end()
+    raster.touch()
+    return raster
+
+
+def paint_line_step(raster, arguments) -> MapRaster:
+    ''' same pen as canvas brush, used by both PAINT_LINE and PAINT_BRUSH '''
+    points = [QPoint(*point) for point in arguments['points']]
+    painter = QPainter(raster.image)
+    painter.setPen(QPen(step_color(arguments), arguments.get('width', 10), Qt.SolidLine, Qt.SquareCap, Qt.RoundJoin))
+    if len(points) == 1:
+        painter.drawPoint(points[0])
+    else:
+        painter.drawPolyline(*points)
+    painter.end()
+    raster.touch()
+    return raster
+
+
+step_functions = {
+    Routine.CROP.name: crop_step,
+    Routine.ANGLE.name: angle_step,
+    Routine.GRAY.name: gray_step,
+    Routine.PAINT_RECT.name: paint_rect_step,
+    Routine.PAINT_LINE.name: paint_line_step,
+    Routine.PAINT_BRUSH.name: paint_line_step,
+}
+
+
+def process_map(yaml_path, recipe, output_dir) -> str:
+    ''' runs in worker process, returns path of written YAML '''
+    with open(yaml_path, 'r') as stream:
+        parsed_yaml, waypoint_rows = load_map_yaml(stream.read())
+    image_path = parsed_yaml['image']
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(os.path.dirname(os.path.abspath(yaml_path)), image_path)
+    raster = load_map_image(image_path)
+    for routine_name, arguments in recipe:
+        raster = step_functions[routine_name](raster, arguments)
+
+    name = os.path.splitext(os.path.basename(yaml_path))[0]
+    saved_yaml = {'image': name + '.pgm'}
+    for key, value in parsed_yaml.items():
+        if key != 'image':
+            saved_yaml[key] = value
+    export_string = dict2str(saved_yaml)
+    # waypoints, both the block and legacy wp_<id> keys, are read apart from metadata and saved as the block
+    if not any(routine_name in geometry_routines for routine_name, _ in recipe):
+        export_string += '\n' + dump_waypoints(waypoint_rows)
+
+    output_yaml = os.path.join(output_dir, name + '.yaml')
+    save_map(output_yaml, export_string, os.path.join(output_dir, saved_yaml['image']), raster)
+    cells = load_occupancy(output_yaml)
+    occupied, free = np.count_nonzero(cells == occ_grid_occupied), np.count_nonzero(cells == occ_grid_free)
+    logger.info("%s loads as %d occupied, %d free and %d other cells" % (
+        output_yaml, occupied, free, cells.size - occupied - free))
+    return output_yaml
+
+
+def run_batch(recipe, yaml_paths, output_dir, jobs=None) -> int:
+    ''' processes maps in process pool, returns count of failed maps '''
+    os.makedirs(output_dir, exist_ok=True)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(process_map, yaml_path, recipe, output_dir): yaml_path for yaml_path in yaml_paths}
+        for future in as_completed(futures):
+            try:
+                logger.info("Written: " + future.result())
+            except Exception as error:
+                failed += 1
+                logger.error("Failed: %s (%s)" % (futures[future], error))
+    return failed
+
+
+def batch_entry_point(argv=None) -> None:
+    create_logger("map_editor")
+    parser = argparse.ArgumentParser(prog='map_editor_batch',
+                                     description="Apply recipe of map_editor routines to maps, without GUI")
+    parser.add_argument('recipe', help="YAML list of steps, see map_editor/batch.py")
+    parser.add_argument('maps', nargs='+', help="map_server YAML files")
+    parser.add_argument('-o', '--output', required=True, help="directory for processed maps")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes, CPU count by default")
+    args = parser.parse_args(argv)
+
+    with open(args.recipe, 'r') as stream:
+        recipe = parse_recipe(yaml.safe_load(stream))
+    failed = run_batch(recipe, args.maps, args.output, args.jobs)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    batch_entry_point()
@@ -1,31 +1,41 @@
 #!/usr/bin/python3
 
-# External lib
-import yaml  # pip pyaml
-
 # PyQT
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QWidget, QApplication, QMainWindow, QDesktopWidget
-from PyQt5.QtWidgets import QFileDialog, QLabel
+from PyQt5.QtWidgets import QFileDialog, QLabel, QProgressBar, QMessageBox
 from PyQt5.QtWidgets import QAction
-from PyQt5.QtGui import QPixmap, QMouseEvent, QKeyEvent, QIcon
-from PyQt5.Qt import Qt
+from PyQt5.QtGui import QPixmap, QMouseEvent, QKeyEvent, QIcon, QCloseEvent, QDragEnterEvent, QDropEvent
+from PyQt5.QtGui import QPaintEvent
+from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import Qt
 
 # Python
 import os
 import sys
 import signal
+import time
 from collections import namedtuple
 
 # Source files
 from map_editor.Helpers.helpers import Routine
 from map_editor.Helpers.helpers import create_logger, dict2str
 from map_editor.Helpers.helpers import correct_image_path
-from map_editor.Helpers.magic_gui_numbers import default_image_name
-from map_editor.Helpers.default_map import default_image
+from map_editor.Helpers.map_io import load_map_image, save_map, atomic_file
+from map_editor.Helpers import map_cache
+from map_editor.Helpers import instrumentation
+from map_editor.Helpers.waypoint_io import load_map_yaml
+from map_editor.Helpers.jobs import JobScheduler
+from map_editor.Helpers.magic_gui_numbers import default_image_name, left_menu_width, input_trace_env
+from map_editor.Helpers.magic_gui_numbers import instrumentation_overlay_interval
+from map_editor.Helpers import default_map
+from map_editor import started
 
 
 from map_editor.Canvas.canvas import ImageView
+from map_editor.Canvas.history import HistoryEntry
+from map_editor.Canvas.journal import Journal, orphan_journals
+from map_editor.Canvas.input_trace import InputRecorder
 from map_editor.Left_Menu.left_menu import LeftMenu
 from map_editor.Paint_Menu.paint_menu import PaintMenu
 from map_editor.Waypoint_Menu.waypoint_menu import WaypointMenu
@@ -36,7 +46,6 @@ logger.setLevel(log_level)
 signal.signal(signal.SIGINT, signal.SIG_DFL) # Allows CTRL+C to end the program
 
 
-# TODO: Drag and drop
 # TODO: Bottom-up crop
 
 __version__ = "1.0.6"
@@ -53,6 +62,17 @@ available_resolution = None  # calculated in main()
 dimensions = namedtuple('dimensions', 'width height')
 
 
+def load_map_job(image_path, progress=None, partial=None):
+    ''' background job, returns loaded raster, its copy for history and its downsampled levels
+    preview and strips loaded so far are given to partial() on the way '''
+    raster = load_map_image(image_path, progress, partial)
+    history_raster = raster.copy()
+    levels = map_cache.pyramid(image_path, raster)
+    if progress is not None:
+        progress(1)  # cancelled while the copy or the pyramid was made, the map is not shown
+    return raster, history_raster, levels
+
+
 class AppImageView(ImageView):
     def __init__(self, _default_image):
         logger.debug("Canvas created")
@@ -64,6 +84,10 @@ class AppImageView(ImageView):
                         self.cursor_image_x, self.cursor_image_y)
         self.main_widget.statusBar().showMessage(status_msg)
 
+    def paintEvent(self, event: QPaintEvent) -> None:
+        with instrumentation.frame():  # frame time in status bar, when instrumentation is on
+            ImageView.paintEvent(self, event)
+
     def mousePressEvent(self, event: QMouseEvent) -> None:
         ImageView.mousePressEvent(self, event)
 
@@ -80,6 +104,17 @@ class AppImageView(ImageView):
         self.cursor_image_x, self.cursor_image_y = round(self.scene_pos.x()), round(self.scene_pos.y())
         self.updateStatusBar()
 
+    # files dropped on the map are opened by the window
+
+    def dragEnterEvent(self, event: QDragEnterEvent) -> None:
+        self.main_widget.dragEnterEvent(event)
+
+    def dragMoveEvent(self, event) -> None:
+        self.main_widget.dragMoveEvent(event)
+
+    def dropEvent(self, event: QDropEvent) -> None:
+        self.main_widget.dropEvent(event)
+
 
 class MainWindow(QMainWindow):
     def __init__(self, image, input_path):
@@ -87,7 +122,12 @@ class MainWindow(QMainWindow):
         logger.debug("MainWindow created")
 
         self.image = image
-        self.canvas = AppImageView(default_image)
+        self.jobs = JobScheduler()  # load, save, grayscale and rotation run in background
+        self.saved_map = None  # (path, cache_key, mtime) of the last saved map image, to skip saving it again
+        self.input_recorder = None  # records input of the canvas, when the editor runs with input_trace_env set
+        self.canvas = AppImageView(default_map.default_image)
+        self.setAcceptDrops(True)  # map or YAML file dropped on the window is opened
+        self.canvas.setAcceptDrops(True)
         self.canvas.image = self.image
         self.canvas.main_widget = self
         self.setGeometry(400, 400, 1200, 1200)
@@ -164,20 +204,99 @@ class MainWindow(QMainWindow):
         self.main_layout.setAlignment(Qt.AlignCenter)
 
         self.setCentralWidget(self.central)
+
+        self.job_progress = QProgressBar()
+        self.job_progress.setMaximumWidth(left_menu_width)
+        self.job_progress.hide()
+        self.statusBar().addPermanentWidget(self.job_progress)
+        self.jobs.jobStarted.connect(self.job_started)
+        self.jobs.jobProgress.connect(self.job_progressed)
+        self.jobs.jobEnded.connect(self.job_ended)
+
+        if instrumentation.enabled():
+            instrumentation.watch_history(self.canvas.history)
+            self.instrumentation_overlay = QLabel()
+            self.statusBar().addPermanentWidget(self.instrumentation_overlay)
+            self.instrumentation_timer = QTimer(self)
+            self.instrumentation_timer.timeout.connect(
+                lambda: self.instrumentation_overlay.setText(instrumentation.overlay_text()))
+            self.instrumentation_timer.start(instrumentation_overlay_interval)
+
         screen = QDesktopWidget().screenGeometry(self)
         size = self.geometry()
         self.move(int((screen.width() - size.width()) / 4), int((screen.height() - size.height()) / 4))
+        try:
+            self.canvas.history.journal = Journal.create()
+        except OSError as error:
+            logger.info("History is not journaled: " + str(error))
         self.update_view()
         self.canvas.reset_view()
 
     def update_view(self) -> None:
-        default_pixmap = QPixmap.fromImage(self.image)
-        self.canvas.latest_pixmap = default_pixmap
-        self.canvas.history.append((Routine.LOAD.value, default_pixmap, 0))
+        self.canvas.latest_raster = self.canvas.raster
+        self.canvas.history.append(HistoryEntry.keyframe(Routine.LOAD.value, self.canvas.latest_raster, 0))
         self.canvas.populate_history_table()
         self.window_title()
         self.canvas.setFocus(Qt.OtherFocusReason)
 
+    def job_started(self, name) -> None:
+        self.job_progress.setFormat(name + " %p%")
+        self.job_progress.setValue(0)
+        self.job_progress.show()
+
+    def job_progressed(self, name, percent) -> None:
+        self.job_progress.setFormat(name + " %p%")
+        self.job_progress.setValue(percent)
+
+    def job_ended(self, name) -> None:
+        if not self.jobs.jobs:
+            self.job_progress.hide()
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        # save in progress is finished, other jobs are not needed anymore
+        self.jobs.cancel_all(keep=('save',))
+        self.jobs.wait()
+        if self.input_recorder is not None:
+            self.input_recorder.stop()
+            self.input_recorder = None
+        if self.canvas.history.journal is not None:
+            self.canvas.history.journal.close()  # clean exit, there is nothing to recover
+            self.canvas.history.journal = None
+        QMainWindow.closeEvent(self, event)
+
+    def recover_journal(self) -> None:
+        ''' offers to replay history of editor, which crashed, journals not recovered are removed '''
+        orphans = orphan_journals()
+        if not orphans:
+            return
+        answer = QMessageBox.question(self, "Recover", "Editor was not closed properly.\n"
+                                      "Recover the map edits of the last session?")
+        if answer == QMessageBox.Yes:
+            try:
+                journal, entries, current_idx = Journal.recover(orphans.pop())
+            except (OSError, ValueError) as error:
+                logger.info("Cannot recover history: " + str(error))
+            else:
+                if entries and entries[0].is_keyframe:
+                    if self.canvas.history.journal is not None:
+                        self.canvas.history.journal.close()
+                    self.canvas.history.journal = journal
+                    self.canvas.recover_history(entries, current_idx)
+                else:
+                    journal.close()
+        for path in orphans:
+            try:
+                os.remove(path)
+            except OSError as error:
+                logger.info("Cannot remove journal: " + str(error))
+
+    def record_input(self, path) -> None:
+        ''' input of the canvas is written into trace at path, it is replayed by map_editor_replay '''
+        try:
+            self.input_recorder = InputRecorder(self.canvas, path)
+        except OSError as error:
+            logger.info("Input is not recorded: " + str(error))
+
     def file_title(self):
         return os.path.basename(self.input_path)
 
@@ -186,14 +305,20 @@ class MainWindow(QMainWindow):
 
     def load_yaml(self) -> None:
         logger.debug("Load initiated")
+        if self.canvas.is_busy():
+            return
         options = QFileDialog.Options()
         options |= QFileDialog.DontUseNativeDialog
         file_path, _ = QFileDialog.getOpenFileName(self, "Load YAML", "", filter="YAML(*.yaml)", options=options)
+        self.open_yaml(file_path)
+
+    def open_yaml(self, file_path) -> None:
+        ''' loads YAML and waypoints at once, its map image in background '''
         try:
             os.chdir(os.path.dirname(file_path))
             with open(file_path, 'r') as stream:
                 logger.debug("File open")
-                parsed_yaml = yaml.safe_load(stream)
+                parsed_yaml, waypoint_rows = load_map_yaml(stream.read())
                 image_path = parsed_yaml['image']
                 split_path = os.path.split(image_path)
                 self.image_path_in_yaml = split_path[0]
@@ -205,15 +330,8 @@ class MainWindow(QMainWindow):
                 parsed_yaml['image'] = image_basename
                 self.left_menu.yaml_box.latest_yaml = parsed_yaml
                 self.left_menu.yaml_box.insert_yaml_into_entries()
-                self.canvas.delete_all_waypoints()
-                for i in parsed_yaml:
-                    if i.startswith('wp_'):
-                        wp_id = int(i.split('_')[1])
-                        wp_x, wp_y, wp_theta = parsed_yaml[i]
-                        self.canvas.load_waypoint(wp_x, wp_y, wp_theta, wp_id)
-
+                self.canvas.load_waypoints(waypoint_rows)
                 self.canvas.change_waypoint_movable()
-                self.canvas.populate_waypoint_table()
         except (FileNotFoundError, KeyError):
             return
         else:
@@ -224,17 +342,69 @@ class MainWindow(QMainWindow):
             self.left_menu.yaml_box.latest_yaml_name = latest_yaml_name
             self.left_menu.yaml_box.entry_yaml.entry.setText(latest_yaml_name)
             self.left_menu.path_box.img_entry.setText(image_path)
-            loaded_pixmap = QPixmap(image_path)
-            self.input_path = file_path
-            self.window_title()
-            self.canvas.pixmap = loaded_pixmap
-            self.canvas.latest_pixmap = loaded_pixmap
-            self.canvas.angle = 0
-            self.canvas.history.append((Routine.LOAD.value, loaded_pixmap, 0))
-            self.canvas.history_current_idx += 1
-            self.canvas.populate_history_table()
+            self.open_map_image(file_path, image_path)
+
+    def open_map_image(self, file_path, image_path) -> None:
+        '''
+        map image is decoded in background, view and YAML entries stay usable meanwhile
+        cached or sampled preview is shown first, then the map is refined as its strips are loaded
+        '''
+        span = instrumentation.span('load', path=os.path.abspath(image_path))
+        size, preview = map_cache.load_preview(os.path.abspath(image_path))
+        if preview is not None:
+            self.canvas.show_preview(preview, size)
+        job = self.canvas.run_map_job('load', load_map_job, os.path.abspath(image_path),
+                                      on_finished=lambda loaded: self.map_loaded(file_path, *loaded),
+                                      on_failed=lambda error: logger.info("Cannot load map image: " + str(error)),
+                                      on_partial=self.canvas.map_loading)
+        span.track(job)
+
+    def map_loaded(self, file_path, loaded_raster, history_raster, levels) -> None:
+        previewed = self.canvas.previewing()  # view was fitted to the map already, user may have moved it since
+        self.input_path = file_path
+        self.window_title()
+        self.canvas.image = loaded_raster
+        self.canvas.graphics_pixmap.setLevels(levels)
+        self.canvas.latest_raster = self.canvas.raster
+        self.canvas.angle = 0
+        self.canvas.add_routine_cull_history(HistoryEntry(Routine.LOAD.value, 0, raster=history_raster))
+        if previewed:
+            self.paint_menu.angle_box.angle_entry.setText(str(self.canvas.angle))
+        else:
             self.canvas.reset_view()
-            self.canvas.disable_transformations(False)
+        self.canvas.disable_transformations(False)
+        if self.input_recorder is not None:
+            self.input_recorder.record_map(file_path)
+
+    @staticmethod
+    def dropped_path(event):
+        ''' the first local file dropped, None if there is no such '''
+        for url in event.mimeData().urls():
+            if url.isLocalFile():
+                return url.toLocalFile()
+        return None
+
+    def dragEnterEvent(self, event: QDragEnterEvent) -> None:
+        if self.dropped_path(event) is not None:
+            event.acceptProposedAction()
+
+    def dragMoveEvent(self, event) -> None:
+        if self.dropped_path(event) is not None:
+            event.acceptProposedAction()
+
+    def dropEvent(self, event: QDropEvent) -> None:
+        ''' dropped YAML is loaded as by Load button, other files are loaded as map image only '''
+        path = self.dropped_path(event)
+        if path is None or self.canvas.is_busy():
+            return
+        event.acceptProposedAction()
+        logger.debug("Dropped: " + path)
+        if path.lower().endswith(('.yaml', '.yml')):
+            self.open_yaml(path)
+        else:
+            self.left_menu.path_box.img_entry.setText(path)
+            self.left_menu.yaml_box.entry_image.entry.setText(os.path.basename(path))
+            self.open_map_image(path, path)
 
     def save_as(self) -> None:
         logger.debug("Save initiated")
@@ -256,6 +426,13 @@ class MainWindow(QMainWindow):
             logger.debug("Save failed")
             return
 
+        if self.jobs.is_running('save'):
+            logger.info("Previous save is still running")
+            return
+
+        if self.canvas.is_busy():
+            return
+
         yaml_extension = '.yaml'
         if not future_yaml_name.endswith(yaml_extension):
             future_yaml_name += yaml_extension
@@ -271,6 +448,7 @@ class MainWindow(QMainWindow):
             logger.debug("Save failed")
             return
 
+        span = instrumentation.span('save', path=file_path)
         is_path_relative = self.left_menu.path_box.save_as_relative_radio.isChecked()
         self.left_menu.yaml_box.harvest_entry_into_latest_yaml()
         saved_yaml = self.left_menu.yaml_box.latest_yaml
@@ -293,24 +471,57 @@ class MainWindow(QMainWindow):
         # add waypoint data
         export_string += self.canvas.export_waypoints()
 
-        with open(file_path, 'w', encoding="utf-8") as yaml_file:
-            yaml_file.write(export_string)
-
-        self.canvas.grayscale_canvas()
-        
-        image_path = os.path.split(file_path)[0]
-        self.canvas.pixmap.save(os.path.join(image_path, future_image_name))
+        # map is saved in gray, in background from its snapshot, so editing can continue
+        # YAML is written after the image by the same job, so it never references image, which failed to save
+        image_path = os.path.join(os.path.split(file_path)[0], future_image_name)
+        if self.map_saved_as(image_path):
+            logger.debug("Map is unchanged since last save")
+            with atomic_file(file_path, 'w') as yaml_file:
+                yaml_file.write(export_string)
+            span.end(status='unchanged')
+            return
+        snapshot = self.canvas.raster.snapshot()
+        job = self.jobs.submit('save', save_map, file_path, export_string, image_path, snapshot,
+                               on_finished=lambda _: self.map_saved(image_path, snapshot.cache_key()),
+                               on_failed=lambda error: logger.error("Save failed: " + str(error)))
+        span.track(job)
+
+    def map_saved_as(self, image_path) -> bool:
+        ''' whether the shown map was already saved into image_path, which was not modified since '''
+        if self.saved_map is None or not os.path.exists(image_path):
+            return False
+        path, cache_key, mtime = self.saved_map
+        return path == os.path.abspath(image_path) and cache_key == self.canvas.raster.cache_key() \
+            and mtime == os.stat(image_path).st_mtime_ns
+
+    def map_saved(self, image_path, cache_key) -> None:
         logger.debug("Save succeeded")
+        self.saved_map = (os.path.abspath(image_path), cache_key, os.stat(image_path).st_mtime_ns)
+
+
+def report_startup(imported, created) -> None:
+    ''' logs how long the window took to show, counted from the first import of map_editor '''
+    shown = time.perf_counter()
+    logger.info("Startup %.0f ms: imports %.0f ms, window %.0f ms, shown %.0f ms" % (
+        (shown - started) * 1000, (imported - started) * 1000, (created - imported) * 1000, (shown - created) * 1000))
 
 
 def main_entry_point():
+    imported = time.perf_counter()
+    instrumentation.enable_from_environment()
     app = QApplication(sys.argv)
     screen = app.primaryScreen()
     available_screen = screen.availableGeometry()
     global available_resolution
     available_resolution = dimensions(available_screen.width(), available_screen.height())
-    window = MainWindow(default_image, default_image_name)
+    window = MainWindow(default_map.default_image, default_image_name)
+    created = time.perf_counter()
     window.show()
+    QTimer.singleShot(0, lambda: report_startup(imported, created))  # after the first paint of the window
+    trace_path = os.environ.get(input_trace_env)
+    if trace_path:
+        QTimer.singleShot(0, lambda: window.record_input(trace_path))  # view is fitted to the shown window
+    window.recover_journal()
     app.exec_()
 
 
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+'''
+Offscreen replay of input trace, reports latency of canvas handlers and frame times
+
+    NAV2_MAP_EDITOR_INPUT_TRACE=trace.jsonl map_editor      # records input, until the editor is closed
+    map_editor_replay trace.jsonl --speed 1 --json latency.json
+
+- events are sent straight to the canvas, handler latency is the time until its handler returns
+- events are labelled by what they did, mouse moves and releases by the tool in use, keys by their key,
+  undo and redo by their own label
+- frame time is the time to process events queued since the last input, when the viewport got repainted
+- recorded timing is kept by default, --speed 2 replays twice as fast, --speed 0 does not wait at all
+'''
+
+# External lib
+import numpy as np
+
+# PyQT
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtCore import QEvent, QObject, QSize
+from PyQt5.QtCore import Qt
+
+# Python
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from collections import defaultdict
+
+# Source files
+from map_editor.Helpers.helpers import create_logger
+from map_editor.Helpers import instrumentation
+from map_editor.Canvas.input_trace import read_trace, input_event, key_types
+from map_editor.Canvas.input_trace import apply_tool_state, apply_view_state
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import replay_percentiles
+
+logger = logging.getLogger("map_editor")
+
+resize_attempts = 3  # layout of the window may not give all of the size to the canvas at once
+key_names = {value: name[len('Key_'):] for name, value in vars(Qt).items() if name.startswith('Key_')}
+
+
+class PaintCounter(QObject):
+    ''' event filter counting paints of the watched widget '''
+    def __init__(self, widget):
+        QObject.__init__(self, widget)
+        self.widget = widget
+        self.count = 0
+        widget.installEventFilter(self)
+
+    def eventFilter(self, watched, event) -> bool:
+        if event.type() == QEvent.Paint:
+            self.count += 1
+        return False
+
+    def remove(self) -> None:
+        self.widget.removeEventFilter(self)
+
+
+def mouse_mode(canvas) -> str:
+    ''' what the mouse does now, in the order of ImageView.mouseMoveEvent() '''
+    if canvas.rubberBand is not None:
+        return 'zoom'
+    if canvas.cropBand is not None:
+        return 'crop'
+    if canvas.panning:
+        return 'pan'
+    if canvas.drawing_brush:
+        return 'brush'
+    if canvas.drawing_line:
+        return 'line'
+    if canvas.drawing_rect:
+        return 'rect'
+    return 'hover'
+
+
+def event_label(canvas, record, event) -> str:
+    kind = record['type']
+    if kind == 'key_press':
+        if event.matches(QKeySequence.Undo):
+            return 'undo'
+        if event.matches(QKeySequence.Redo):
+            return 'redo'
+        return 'key_press:' + key_names.get(record['key'], str(record['key']))
+    if kind in ('mouse_move', 'mouse_release'):
+        return kind + ':' + mouse_mode(canvas)
+    return kind
+
+
+def settle(painted, frames, until=None) -> None:
+    ''' processes queued events until time until, duration of every round, which repainted, is frame time '''
+    app = QApplication.instance()
+    while True:
+        count = painted.count
+        start = time.perf_counter()
+        app.processEvents()
+        now = time.perf_counter()
+        if painted.count != count:
+            frames.append(now - start)
+        if until is None or now >= until:
+            return
+        time.sleep(min(until - now, 0.001))
+
+
+def wait_for_jobs(window, painted, frames) -> None:
+    ''' background jobs end and their results are delivered '''
+    while window.jobs.jobs:
+        window.jobs.wait()
+        settle(painted, frames)
+
+
+def resize_viewport(window, size) -> None:
+    ''' window is resized, so the viewport of the canvas has the recorded size '''
+    viewport = window.canvas.viewport()
+    for _ in range(resize_attempts):
+        missing = QSize(size[0] - viewport.width(), size[1] - viewport.height())
+        if missing.isNull():
+            return
+        window.resize(window.size() + missing)
+        QApplication.processEvents()
+    logger.info("Viewport is %dx%d, trace was recorded in %dx%d" % (viewport.width(), viewport.height(), *size))
+
+
+def open_map(window, path) -> None:
+    ''' loads map of the trace, as the editor does, and waits for it '''
+    if not os.path.exists(path):
+        logger.info("Map of the trace is missing, replaying on the current map: " + path)
+        return
+    if path.lower().endswith(('.yaml', '.yml')):
+        window.open_yaml(path)
+    else:
+        window.open_map_image(path, path)
+
+
+def replay(window, header, records, speed=1.0) -> dict:
+    ''' sends recorded events to the canvas of shown window, returns label -> list of latencies, in s '''
+    canvas = window.canvas
+    resize_viewport(window, header['viewport'])
+    apply_view_state(canvas, header['view'])
+    painted = PaintCounter(canvas.viewport())
+    samples = defaultdict(list)
+    frames = samples['frame']
+    started = time.perf_counter()
+    for record in records:
+        settle(painted, frames, started + record['t'] / speed if speed > 0 else None)
+        kind = record['type']
+        if kind == 'state':
+            apply_tool_state(canvas, record['state'])
+        elif kind == 'resize':
+            resize_viewport(window, record['size'])
+        elif kind == 'map':
+            loading = time.perf_counter()
+            open_map(window, record['path'])
+            wait_for_jobs(window, painted, [])
+            apply_view_state(canvas, record['view'])
+            started += time.perf_counter() - loading  # load is not part of the recorded timing
+        else:
+            event = input_event(record)
+            if event is None:
+                continue
+            target = canvas if kind in key_types.values() else canvas.viewport()
+            label = event_label(canvas, record, event)
+            start = time.perf_counter()
+            QApplication.sendEvent(target, event)
+            samples[label].append(time.perf_counter() - start)
+    wait_for_jobs(window, painted, frames)
+    settle(painted, frames)
+    painted.remove()
+    return dict(samples)
+
+
+def summarize(samples) -> dict:
+    ''' label -> {count, p50, p90, p99, max}, in s '''
+    summary = {}
+    for label, latencies in sorted(samples.items()):
+        if not latencies:
+            continue
+        row = {'count': len(latencies)}
+        for percentile, value in zip(replay_percentiles, np.percentile(latencies, replay_percentiles)):
+            row['p%d' % percentile] = float(value)
+        row['max'] = float(max(latencies))
+        summary[label] = row
+    return summary
+
+
+def format_summary(summary) -> str:
+    columns = ['p%d' % percentile for percentile in replay_percentiles] + ['max']
+    lines = ['%-24s %7s' % ('event', 'count') + ''.join('%10s' % (column + ' ms') for column in columns)]
+    for label, row in summary.items():
+        lines.append('%-24s %7d' % (label, row['count']) + ''.join('%10.2f' % (row[column] * 1000)
+                                                                   for column in columns))
+    return '\n'.join(lines)
+
+
+def replay_entry_point(argv=None) -> None:
+    create_logger("map_editor")
+    parser = argparse.ArgumentParser(prog='map_editor_replay',
+                                     description="Replay recorded input on the canvas offscreen, report latency")
+    parser.add_argument('trace', help="input trace, recorded with NAV2_MAP_EDITOR_INPUT_TRACE=trace map_editor")
+    parser.add_argument('-s', '--speed', type=float, default=1.0,
+                        help="multiple of recorded speed, 0 sends events without waiting")
+    parser.add_argument('--json', default=None, help="file for the summary, latencies in s")
+    args = parser.parse_args(argv)
+
+    header, records = read_trace(args.trace)
+    instrumentation.enable_from_environment()  # operations of the replay are logged, as in the editor
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication(sys.argv[:1])
+    from map_editor.main import MainWindow  # the editor is not imported for --help
+    from map_editor.Helpers import default_map
+    from map_editor.Helpers.magic_gui_numbers import default_image_name
+    window = MainWindow(default_map.default_image, default_image_name)
+    window.show()
+    app.processEvents()
+    try:
+        summary = summarize(replay(window, header, records, args.speed))
+    finally:
+        window.close()
+    print(format_summary(summary))
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(summary, file, indent=4)
+
+
+if __name__ == '__main__':
+    replay_entry_point()
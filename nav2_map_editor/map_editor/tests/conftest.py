@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+'''
+Unit tests of the editor, run from the directory of setup.py:
+    python -m pytest tests
+'''
+
+# Python
+import os
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
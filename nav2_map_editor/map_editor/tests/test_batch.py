@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+'''
+Batch processing of map YAML with waypoints, CROP and ANGLE move the map under the waypoints, so they are dropped,
+other routines keep them
+'''
+
+# External lib
+import numpy as np
+import pytest
+
+# Source files
+from map_editor.batch import parse_recipe, process_map
+from map_editor.Helpers.map_io import load_occupancy
+from map_editor.Helpers.waypoint_io import load_map_yaml
+
+metadata = 'image: map.pgm\nresolution: 0.05\norigin: [0.0, 0.0, 0.0]\nnegate: 0\n' \
+           'occupied_thresh: 0.65\nfree_thresh: 0.25\n'
+waypoints_block = 'waypoints:\n- [1, 2, 0]\n- [3, 4, 90]\n'
+legacy_waypoints = 'wp_1: [1, 2, 0]\nwp_2: [3, 4, 90]\n'
+
+
+def write_map(directory, text) -> str:
+    ''' 64x48 PGM and map YAML of given text, returns path of the YAML '''
+    with open(str(directory / 'map.pgm'), 'wb') as file:
+        file.write(b'P5\n64 48\n255\n' + np.full((48, 64), 254, dtype=np.uint8).tobytes())
+    yaml_path = directory / 'map.yaml'
+    yaml_path.write_text(text)
+    return str(yaml_path)
+
+
+def processed(tmp_path, text, steps):
+    ''' (parsed output YAML without waypoints, waypoint rows of the output) '''
+    output_dir = tmp_path / 'processed'
+    output_dir.mkdir()
+    output_yaml = process_map(write_map(tmp_path, text), parse_recipe(steps), str(output_dir))
+    with open(output_yaml) as file:
+        return load_map_yaml(file.read())
+
+
+@pytest.mark.parametrize('waypoints', [waypoints_block, legacy_waypoints])
+@pytest.mark.parametrize('steps', [[{'CROP': [0, 0, 32, 32]}], [{'ANGLE': 90}],
+                                   [{'CROP': [0, 0, 32, 32]}, {'ANGLE': 90}]])
+def test_geometry_drops_waypoints(tmp_path, waypoints, steps):
+    parsed_yaml, rows = processed(tmp_path, metadata + waypoints, steps)
+    assert rows == []
+    assert 'waypoints' not in parsed_yaml
+    assert not [key for key in parsed_yaml if key.startswith('wp_')]
+    assert parsed_yaml['resolution'] == 0.05
+
+
+@pytest.mark.parametrize('waypoints', [waypoints_block, legacy_waypoints])
+def test_other_routines_keep_waypoints(tmp_path, waypoints):
+    parsed_yaml, rows = processed(tmp_path, metadata + waypoints, ['GRAY', {'PAINT_RECT': {'rect': [0, 0, 8, 8]}}])
+    assert rows == [(1, 2, 0), (3, 4, 90)]
+    assert parsed_yaml == {'image': 'map.pgm', 'resolution': 0.05, 'origin': [0.0, 0.0, 0.0], 'negate': 0,
+                           'occupied_thresh': 0.65, 'free_thresh': 0.25}
+
+
+def test_saved_map_loads_as_map_server(tmp_path):
+    ''' black rect is occupied, the rest stays free, with thresholds of the input YAML '''
+    output_dir = tmp_path / 'processed'
+    output_dir.mkdir()
+    steps = [{'PAINT_RECT': {'rect': [0, 0, 8, 8], 'color': [0, 0, 0]}}]
+    output_yaml = process_map(write_map(tmp_path, metadata), parse_recipe(steps), str(output_dir))
+    cells = load_occupancy(output_yaml)
+    assert cells.shape == (48, 64)
+    assert (cells[:9, :9] == 100).all()  # pen of width 1 is drawn on the right and bottom edge too
+    assert (cells[9:] == 0).all() and (cells[:, 9:] == 0).all()
+
+
+def test_invalid_mode_fails(tmp_path):
+    with pytest.raises(ValueError):
+        processed(tmp_path, metadata + 'mode: binary\n', ['GRAY'])
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+'''
+History of region patches, eviction over memory budget and spilling of patches to journal,
+every entry left in history has to restore the same pixels as were shown after its routine
+'''
+
+# External lib
+import numpy as np
+import pytest
+
+# PyQT
+from PyQt5.QtCore import QRect
+
+# Source files
+from map_editor.Canvas.history import History, HistoryEntry, reconstruct
+from map_editor.Canvas.journal import Journal
+from map_editor.Helpers.helpers import Routine, raster_rotation
+from map_editor.Helpers.raster import MapRaster
+
+map_width, map_height = 64, 48
+patch_size = 8
+keyframe_nbytes = map_width * map_height * 4  # rotations by right angles keep it
+# None paints a patch, number rotates the map, rotations in a row are resampled from the same map
+steps = [None] * 6 + [90] + [None] * 4 + [30, 180] + [None] * 5 + [270] + [None] * 3
+
+
+def random_array(height, width, seed) -> np.ndarray:
+    ''' (height, width, 4) BGRA array of MapRaster layout, noise does not compress, so its size in history is known '''
+    array = np.random.default_rng(seed).integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+    array[..., 3] = 255
+    return array
+
+
+class Session:
+    '''
+    Routines done on the map, as the canvas adds them to history, with the map shown after each of them
+    - patch is painted on the map shown, rotation is resampled from the last painted map
+    '''
+    def __init__(self, history, seed=1):
+        self.history = history
+        self.random = np.random.default_rng(seed)
+        self.raster = MapRaster(random_array(map_height, map_width, seed))
+        self.angle = 0
+        self.rotated = False
+        self.shown = []  # arrays shown after every entry ever added
+        self.dropped = 0
+        self.add(HistoryEntry.keyframe(Routine.LOAD.value, self.raster, 0), self.raster)
+
+    def add(self, entry, shown, evict=False) -> None:
+        self.history.append(entry)
+        self.shown.append(shown.array.copy())
+        if evict:
+            self.dropped += self.history.evict(len(self.history) - 1)
+
+    def paint(self, evict) -> None:
+        if self.rotated:
+            self.raster = raster_rotation(self.raster, self.angle)
+            self.rotated = False
+        x = int(self.random.integers(0, self.raster.width() - patch_size))
+        y = int(self.random.integers(0, self.raster.height() - patch_size))
+        rect = QRect(x, y, patch_size, patch_size)
+        before = self.raster.region(rect).copy()
+        after = self.random.integers(0, 256, size=before.shape, dtype=np.uint8)
+        self.raster.paste(rect.topLeft(), after)
+        self.add(HistoryEntry.patch(Routine.PAINT_BRUSH.value, self.angle, rect, before, after), self.raster, evict)
+
+    def rotate(self, angle, evict) -> None:
+        self.angle = angle
+        self.rotated = True
+        self.add(HistoryEntry.rotation(Routine.ANGLE.value, angle), raster_rotation(self.raster, angle), evict)
+
+    def run(self, steps, evict=False) -> None:
+        for step in steps:
+            if step is None:
+                self.paint(evict)
+            else:
+                self.rotate(step, evict)
+
+    def check(self) -> None:
+        ''' every entry left restores the map shown after it '''
+        for idx in range(len(self.history)):
+            shown, base, angle = self.history.restore(idx)
+            if shown is None:
+                shown = raster_rotation(base, angle)
+            np.testing.assert_array_equal(shown.array, self.shown[self.dropped + idx], err_msg="entry %d" % idx)
+
+
+def patch_nbytes() -> int:
+    entry = HistoryEntry.patch(Routine.PAINT_BRUSH.value, 0, QRect(0, 0, patch_size, patch_size),
+                               random_array(patch_size, patch_size, 1), random_array(patch_size, patch_size, 2))
+    return entry.nbytes
+
+
+def test_restore_without_eviction():
+    session = Session(History())
+    session.run(steps)
+    assert len(session.history) == len(steps) + 1
+    session.check()
+
+
+@pytest.mark.parametrize('kept_patches', [1, 3, 8])
+def test_restore_after_eviction(kept_patches):
+    ''' budget of keyframe and few patches, the oldest entries are folded into the keyframe as routines go on '''
+    history = History(memory_budget=keyframe_nbytes + kept_patches * patch_nbytes())
+    session = Session(history)
+    session.run(steps, evict=True)
+    assert session.dropped > 0
+    assert history.nbytes <= history.memory_budget
+    assert history[0].is_keyframe
+    session.check()
+
+
+def test_evicted_rotation_becomes_keyframe():
+    ''' rotation followed by patches is resampled into keyframe, when its predecessor is evicted '''
+    session = Session(History())
+    session.run([None, 90, None, None])
+    session.history.memory_budget = keyframe_nbytes + patch_nbytes()
+    session.dropped = session.history.evict(len(session.history) - 1)
+    # load and patch folded, rotation resampled into keyframe, then the first patch folded into it
+    assert session.dropped == 3
+    assert session.history[0].is_keyframe and session.history[0].angle == 90
+    session.check()
+
+
+def test_folding_keeps_keyframe_raster():
+    ''' keyframe raster may be read by journal or thumbnail job, while it is folded, so it is never painted on '''
+    session = Session(History())
+    session.run([None] * 3)
+    keyframe = session.history[0].raster
+    loaded = keyframe.array.copy()
+    session.history.memory_budget = keyframe_nbytes + patch_nbytes()
+    session.dropped = session.history.evict(len(session.history) - 1)
+    assert session.dropped == 2
+    np.testing.assert_array_equal(keyframe.array, loaded)
+    session.check()
+
+
+def test_base_recipe_of_rotation():
+    ''' map under every rotation is reconstructed from the recipe, as thumbnail job does '''
+    session = Session(History())
+    session.run(steps)
+    for idx, entry in enumerate(session.history):
+        if not entry.is_keyframe and not entry.is_patch:
+            base = reconstruct(session.history.base_recipe(idx), copy=False)
+            np.testing.assert_array_equal(raster_rotation(base, entry.angle).array, session.shown[idx])
+
+
+def test_eviction_keeps_current_entry():
+    history = History(memory_budget=0)
+    session = Session(history)
+    session.run([None] * 5)
+    current_idx = 3
+    dropped = history.evict(current_idx)
+    assert dropped == current_idx
+    session.dropped = dropped
+    session.check()
+
+
+def test_spilled_patches_are_read_from_journal(tmp_path):
+    ''' with journal, patches are only dropped from memory, nothing is evicted '''
+    journal = Journal.create(str(tmp_path))
+    try:
+        history = History(memory_budget=keyframe_nbytes + 2 * patch_nbytes())
+        history.journal = journal
+        session = Session(history)
+        session.run(steps)
+        journal.wait()
+        in_memory = history.nbytes
+        assert history.evict(len(history) - 1) == 0
+        assert len(history) == len(steps) + 1
+        assert history.nbytes < in_memory
+        assert any(entry.is_patch and entry.nbytes == 0 for entry in history)
+        session.check()
+    finally:
+        journal.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+'''
+Background jobs, result of job cancelled after its last progress report is not delivered,
+neither when the job is still running, nor when its result waits for the GUI thread
+'''
+
+# External lib
+import pytest
+
+# PyQT
+from PyQt5.QtCore import QCoreApplication
+
+# Python
+import threading
+
+# Source files
+from map_editor.Helpers.jobs import JobScheduler
+
+
+@pytest.fixture
+def jobs():
+    app = QCoreApplication.instance() or QCoreApplication([])
+    scheduler = JobScheduler()
+    yield scheduler
+    scheduler.cancel_all()
+    scheduler.wait()
+    app.processEvents()
+
+
+def deliver(jobs) -> None:
+    jobs.wait()
+    QCoreApplication.processEvents()
+
+
+def blocked_job(started, release, value, progress=None):
+    ''' reports its last progress, then waits for release, as a job in its last, uninterruptible step '''
+    progress(1)
+    started.set()
+    release.wait()
+    return value
+
+
+def test_superseded_after_last_progress(jobs):
+    ''' job cancelled by newer job of the same name, while it is past its last progress report '''
+    started, release = threading.Event(), threading.Event()
+    results, cancelled = [], []
+    old = jobs.submit('load', blocked_job, started, release, 'A', on_finished=results.append)
+    old.signals.cancelled.connect(lambda: cancelled.append('A'))
+    assert started.wait(5)
+    jobs.submit('load', lambda progress=None: 'B', on_finished=results.append)
+    release.set()
+    deliver(jobs)
+    assert results == ['B']
+    assert cancelled == ['A']
+
+
+def test_cancelled_while_result_is_queued(jobs):
+    ''' job returned, its result is queued for the GUI thread, when the job is cancelled '''
+    results = []
+    jobs.submit('gray', lambda progress=None: 'A', on_finished=results.append)
+    jobs.wait()
+    jobs.cancel('gray')
+    QCoreApplication.processEvents()
+    assert results == []
+
+
+def test_finished_job_delivers_result(jobs):
+    results = []
+    jobs.submit('save', lambda progress=None: 'A', on_finished=results.append)
+    deliver(jobs)
+    assert results == ['A']
+    assert not jobs.is_running('save')
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+'''
+Recovery of journal left by crashed editor, it has to stop at the first torn or corrupted record
+and return only the entries written before it
+'''
+
+# External lib
+import numpy as np
+import pytest
+
+# PyQT
+from PyQt5.QtCore import QRect
+
+# Source files
+from map_editor.Canvas.history import HistoryEntry
+from map_editor.Canvas.journal import Journal, journal_magic, _record_header
+from map_editor.Helpers.helpers import Routine
+from map_editor.Helpers.raster import MapRaster
+
+patch_rect = QRect(4, 2, 8, 6)
+
+
+def entries() -> list:
+    ''' keyframe, patch, rotation and patch, as history of short session '''
+    random = np.random.default_rng(0)
+    array = random.integers(0, 256, size=(24, 32, 4), dtype=np.uint8)
+    shape = (patch_rect.height(), patch_rect.width(), 4)
+
+    def patch(angle):
+        return HistoryEntry.patch(Routine.PAINT_BRUSH.value, angle, patch_rect,
+                                  random.integers(0, 256, size=shape, dtype=np.uint8),
+                                  random.integers(0, 256, size=shape, dtype=np.uint8))
+
+    return [HistoryEntry.keyframe(Routine.LOAD.value, MapRaster(array), 0), patch(0),
+            HistoryEntry.rotation(Routine.ANGLE.value, 90), patch(90)]
+
+
+def record_offsets(path) -> list:
+    ''' (offset, length) of every record in journal, header included '''
+    offsets = []
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = len(journal_magic)
+    while offset < len(data):
+        _, length, _ = _record_header.unpack_from(data, offset)
+        offsets.append((offset, _record_header.size + length))
+        offset += _record_header.size + length
+    return offsets
+
+
+@pytest.fixture
+def written(tmp_path):
+    ''' (path of closed journal of entries(), the entries, offsets of their records) '''
+    journal = Journal.create(str(tmp_path))
+    written_entries = entries()
+    for entry in written_entries:
+        journal.append(entry)
+    journal.close(remove=False)  # as after crash, file stays and is not locked
+    return journal.path, written_entries, record_offsets(journal.path)
+
+
+def check_recovered(path, expected) -> None:
+    journal, recovered, current_idx = Journal.recover(path)
+    try:
+        assert len(recovered) == len(expected)
+        assert current_idx == len(expected) - 1
+        for entry, original in zip(recovered, expected):
+            assert (entry.routine, entry.angle, entry.journal_id) == \
+                   (original.routine, original.angle, original.journal_id)
+            assert entry.is_keyframe == original.is_keyframe and entry.is_patch == original.is_patch
+            if entry.is_keyframe:
+                np.testing.assert_array_equal(entry.raster.array, original.raster.array)
+            if entry.is_patch:
+                np.testing.assert_array_equal(entry.before.array(), original.before.array())
+                np.testing.assert_array_equal(entry.after.array(), original.after.array())
+        assert journal.next_id == len(expected)
+    finally:
+        journal.close(remove=False)
+
+
+def test_recover_complete(written):
+    path, written_entries, offsets = written
+    assert len(offsets) == len(written_entries)
+    check_recovered(path, written_entries)
+
+
+@pytest.mark.parametrize('kept', [1, 3, 4, 16])  # bytes of the last record left, 4 cuts its header
+def test_recover_truncated_record(written, kept):
+    path, written_entries, offsets = written
+    offset, length = offsets[-1]
+    with open(path, 'r+b') as file:
+        file.truncate(offset + min(kept, length - 1))
+    check_recovered(path, written_entries[:-1])
+    assert record_offsets(path) == offsets[:-1], "torn record is not cut off"
+
+
+@pytest.mark.parametrize('record', [0, 1, 3])
+def test_recover_corrupted_record(written, record):
+    ''' flipped byte in payload fails crc, the record and all after it are dropped '''
+    path, written_entries, offsets = written
+    offset, length = offsets[record]
+    with open(path, 'r+b') as file:
+        file.seek(offset + _record_header.size + (length - _record_header.size) // 2)
+        byte = file.read(1)
+        file.seek(-1, 1)
+        file.write(bytes([byte[0] ^ 0xff]))
+    check_recovered(path, written_entries[:record])
+
+
+def test_recovered_journal_is_appended(written):
+    ''' records appended after recovery of truncated journal follow the valid prefix '''
+    path, written_entries, offsets = written
+    with open(path, 'r+b') as file:
+        file.truncate(offsets[-1][0] + 1)
+    journal, recovered, _ = Journal.recover(path)
+    appended = entries()[3]
+    journal.append(appended)
+    journal.close(remove=False)
+    check_recovered(path, written_entries[:-1] + [appended])
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+'''
+Occupancy of map pixels, expected values are computed by hand from the rules of nav2_map_server map_io.cpp:
+    shade = gray / 255, occ = shade if negate else 1 - shade
+    trinary: occupied_thresh < occ -> 100, occ < free_thresh -> 0, else -1
+    scale: transparent -> -1, occupied and free as trinary, else rint((occ - free) / (occupied - free) * 100)
+    raw: round(shade * 255) if it is 0..100, else -1, negate is ignored
+thresholds 0.6 and 0.4 are hit exactly by gray 102 and 153, 1 - 102 / 255 == 0.6 in floating point too
+'''
+
+# External lib
+import numpy as np
+import pytest
+
+# Source files
+from map_editor.Helpers.map_io import occupancy_from_gray, gray_from_occupancy, load_occupancy, save_map
+from map_editor.Helpers.raster import MapRaster
+
+# (mode, negate, occupied_thresh, free_thresh, gray, alpha, expected occupancy)
+occupancy_cases = [
+    ('trinary', 0, 0.65, 0.25, [0, 89, 90, 128, 191, 192, 205, 254], None, [100, 100, -1, -1, -1, 0, 0, 0]),
+    ('trinary', 1, 0.65, 0.25, [0, 128, 205, 254], None, [0, -1, 100, 100]),
+    ('trinary', 0, 0.6, 0.4, [101, 102, 153, 154], None, [100, -1, -1, 0]),
+    ('trinary', 1, 0.6, 0.4, [102, 153, 154], None, [-1, -1, 100]),
+    # alpha is averaged in, (3 * gray + alpha) / 4
+    ('trinary', 0, 0.65, 0.25, [0, 0, 254, 254], [0, 255, 0, 255], [100, 100, -1, 0]),
+    ('scale', 0, 0.65, 0.25, [0, 100, 128, 200, 254], None, [100, 89, 62, 0, 0]),
+    ('scale', 1, 0.65, 0.25, [0, 128, 254], None, [0, 63, 100]),
+    ('scale', 0, 0.6, 0.4, [101, 102, 128, 153, 154], None, [100, 100, 49, 0, 0]),
+    ('scale', 0, 0.65, 0.25, [0, 128, 254], [0, 254, 0], [-1, -1, -1]),
+    ('raw', 0, 0.65, 0.25, [0, 42, 100, 101, 255], None, [0, 42, 100, -1, -1]),
+    ('raw', 1, 0.65, 0.25, [0, 42, 100, 101, 255], None, [0, 42, 100, -1, -1]),
+]
+
+# (mode, occupancy, expected gray, expected alpha), thresholds 0.65 and 0.25, free is checked first by map_saver
+gray_cases = [
+    ('trinary', [-1, 0, 25, 26, 50, 64, 65, 100], [205, 254, 254, 205, 205, 205, 0, 0], None),
+    ('scale', [-1, 0, 50, 100], [128, 255, 128, 0], [0, 255, 255, 255]),
+    ('raw', [-1, 0, 42, 100], [255, 0, 42, 100], None),
+]
+
+
+@pytest.mark.parametrize('mode, negate, occupied_thresh, free_thresh, gray, alpha, expected', occupancy_cases)
+def test_occupancy_from_gray(mode, negate, occupied_thresh, free_thresh, gray, alpha, expected):
+    gray = np.array([gray], dtype=np.uint8)
+    alpha = None if alpha is None else np.array([alpha], dtype=np.uint8)
+    cells = occupancy_from_gray(gray, mode, negate, occupied_thresh, free_thresh, alpha)
+    assert cells.dtype == np.int8
+    assert cells.tolist() == [expected]
+
+
+@pytest.mark.parametrize('mode, cells, expected_gray, expected_alpha', gray_cases)
+def test_gray_from_occupancy(mode, cells, expected_gray, expected_alpha):
+    gray, alpha = gray_from_occupancy(np.array([cells], dtype=np.int8), mode)
+    assert gray.tolist() == [expected_gray]
+    assert (alpha is None) if expected_alpha is None else (alpha.tolist() == [expected_alpha])
+
+
+@pytest.mark.parametrize('mode, occupied_thresh, free_thresh, expected', [
+    ('trinary', 0.65, 0.196, [-1, 0, 0, -1, 100, 100]),  # unknown 205 is read as free with free_thresh 0.25
+    ('scale', 1.0, 0.0, [-1, 0, 10, 50, 90, 100]),
+    ('raw', 0.65, 0.25, [-1, 0, 10, 50, 90, 100]),
+])
+def test_saved_occupancy_loads_back(mode, occupied_thresh, free_thresh, expected):
+    ''' occupancy, which map_saver writes, is read back by map_server '''
+    cells = np.array([[-1, 0, 10, 50, 90, 100]], dtype=np.int8)
+    gray, alpha = gray_from_occupancy(cells, mode, occupied_thresh, free_thresh)
+    assert occupancy_from_gray(gray, mode, 0, occupied_thresh, free_thresh, alpha).tolist() == [expected]
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        occupancy_from_gray(np.zeros((1, 1), dtype=np.uint8), 'binary')
+    with pytest.raises(ValueError):
+        gray_from_occupancy(np.zeros((1, 1), dtype=np.int8), 'binary')
+
+
+def write_map(directory, gray, maxval, **parameters) -> str:
+    ''' map_server YAML and binary PGM of gray pixels, returns path of the YAML '''
+    height, width = gray.shape
+    with open(str(directory / 'map.pgm'), 'wb') as file:
+        file.write(b'P5\n%d %d\n%d\n' % (width, height, maxval))
+        file.write(gray.astype(np.uint8 if maxval < 256 else '>u2').tobytes())
+    yaml_path = directory / 'map.yaml'
+    lines = ['image: map.pgm', 'resolution: 0.05', 'origin: [0.0, 0.0, 0.0]']
+    lines += ['%s: %s' % item for item in parameters.items()]
+    yaml_path.write_text('\n'.join(lines) + '\n')
+    return str(yaml_path)
+
+
+@pytest.mark.parametrize('mode, negate, occupied_thresh, free_thresh, gray, alpha, expected',
+                         [case for case in occupancy_cases if case[5] is None])
+@pytest.mark.parametrize('maxval', [255, 65535])
+def test_load_occupancy(tmp_path, maxval, mode, negate, occupied_thresh, free_thresh, gray, alpha, expected):
+    ''' PGM is read as map_server reads it, 16 bit pixels are scaled to 8 bits first '''
+    gray = np.array([gray, gray], dtype=np.uint32) * (maxval // 255)
+    yaml_path = write_map(tmp_path, gray, maxval, mode=mode, negate=negate,
+                          occupied_thresh=occupied_thresh, free_thresh=free_thresh)
+    assert load_occupancy(yaml_path).tolist() == [expected, expected]
+
+
+def test_load_occupancy_default_mode(tmp_path):
+    yaml_path = write_map(tmp_path, np.array([[0, 128, 254]]), 255, negate=0, occupied_thresh=0.65, free_thresh=0.25)
+    assert load_occupancy(yaml_path).tolist() == [[100, -1, 0]]
+
+
+def test_save_map_commits_yaml_after_image(tmp_path):
+    ''' save stopped while the image is written keeps the previous YAML and image '''
+    yaml_path, image_path = str(tmp_path / 'map.yaml'), str(tmp_path / 'map.pgm')
+    raster = MapRaster(np.full((48, 64, 4), 254, dtype=np.uint8))
+    save_map(yaml_path, 'image: map.pgm\n', image_path, raster)
+    saved_image = (tmp_path / 'map.pgm').read_bytes()
+
+    def stop(fraction):
+        raise RuntimeError("stopped")
+
+    with pytest.raises(RuntimeError):
+        save_map(yaml_path, 'image: other.pgm\n', image_path, MapRaster(np.zeros((48, 64, 4), dtype=np.uint8)), stop)
+    assert (tmp_path / 'map.yaml').read_text() == 'image: map.pgm\n'
+    assert (tmp_path / 'map.pgm').read_bytes() == saved_image
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['map.pgm', 'map.yaml']
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+'''
+Waypoint store, order keys of waypoints inserted between the same neighbours run out and get respaced,
+rows given by the Fenwick tree of buckets have to match plain list of waypoints after every change
+'''
+
+# External lib
+import numpy as np
+import pytest
+
+# Python
+from decimal import Decimal
+
+# Source files
+from map_editor.Waypoint_Menu.waypoint_class import Waypoint
+from map_editor.Waypoint_Menu.waypoint_store import WaypointStore, label_between
+
+# Constants
+from map_editor.Helpers.magic_gui_numbers import waypoint_order_gap
+
+bucket_size = 4  # small buckets, so rows span many of them
+
+
+def waypoint(wp_id) -> Waypoint:
+    return Waypoint(0, 0, 0, wp_id)
+
+
+def check(store, expected) -> None:
+    ''' store holds expected waypoints, in their order, every row and key agrees with it '''
+    assert len(store) == len(expected)
+    assert list(store) == expected
+    orders = [wp.order for wp in expected]
+    assert orders == sorted(set(orders)), "order keys are not strictly increasing"
+    for row, wp in enumerate(expected):
+        assert store.index(wp.id) == row
+        assert store[row] is wp
+        assert store.get(wp.id) is wp
+    assert store.first() is (expected[0] if expected else None)
+    assert store.last() is (expected[-1] if expected else None)
+
+
+@pytest.mark.parametrize('low, high, label', [
+    (3, None, Decimal('3.1')),
+    (Decimal('3.1'), None, Decimal('3.2')),
+    (Decimal('3.9'), Decimal(4), Decimal('3.91')),
+    (3, Decimal('3.1'), Decimal('3.01')),
+    (-1, 0, Decimal('-0.9')),
+])
+def test_label_between(low, high, label):
+    assert label_between(low, high) == label
+
+
+def test_label_between_same_neighbours():
+    ''' labels added right after 3, before the previous one, get longer, but stay between 3 and 4 '''
+    high = Decimal(4)
+    for _ in range(20):
+        label = label_between(3, high)
+        assert 3 < label < high
+        high = label
+
+
+def test_respace_between_same_neighbours(monkeypatch):
+    ''' every insert halves the gap after the first waypoint, until keys run out and are respaced '''
+    respaced = []
+    respace = WaypointStore._respace
+    monkeypatch.setattr(WaypointStore, '_respace', lambda store, order: respaced.append(order) or respace(store, order))
+    store = WaypointStore(bucket_size)
+    expected = [waypoint(wp_id) for wp_id in range(1, 11)]
+    store.reset(expected)
+    wp_id = 100
+    while len(respaced) < 3:
+        wp_id += 1
+        wp = waypoint(wp_id)
+        assert store.insert(wp, 1) == 1
+        expected.insert(1, wp)
+        check(store, expected)
+        assert len(expected) < 200, "order keys were not respaced"
+    assert len(expected) > waypoint_order_gap.bit_length()
+
+
+def test_insert_and_remove_in_the_middle():
+    ''' random inserts and removals in the middle, rows are checked against plain list after each '''
+    random = np.random.default_rng(0)
+    store = WaypointStore(bucket_size)
+    expected = []
+    for wp_id in range(1, 400):
+        if expected and random.random() < 0.3:
+            removed = expected.pop(int(random.integers(len(expected))))
+            assert store.remove(removed.id) is removed
+            assert removed.id not in store
+        else:
+            row = int(random.integers(len(expected) + 1))
+            wp = waypoint(wp_id)
+            store.insert(wp, row)
+            expected.insert(row, wp)
+        check(store, expected)
+
+
+def test_rows_after_buckets_empty():
+    ''' removal of whole bucket rebuilds the tree, the following rows move up '''
+    store = WaypointStore(bucket_size)
+    expected = [waypoint(wp_id) for wp_id in range(1, 4 * bucket_size + 1)]
+    store.reset(expected)
+    for wp in expected[bucket_size:2 * bucket_size]:
+        store.remove(wp.id)
+    del expected[bucket_size:2 * bucket_size]
+    check(store, expected)
+    wp = waypoint(100)
+    store.insert(wp, bucket_size)
+    expected.insert(bucket_size, wp)
+    check(store, expected)
+
+
+def test_duplicate_id():
+    store = WaypointStore(bucket_size)
+    store.insert(waypoint(1), 0)
+    with pytest.raises(KeyError):
+        store.insert(waypoint(1), 1)